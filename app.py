@@ -1,39 +1,154 @@
+import hmac
+import logging
 import os
 
-from flask import Flask, render_template, session, g, flash, redirect, url_for, request, jsonify
-from models import connect_db, db, User, CountryPreferences, OutletPreferences
+import click
+
+from flask import (Flask, Blueprint, Response, render_template, stream_template, session, g, flash,
+                   get_flashed_messages, redirect, url_for, request, current_app, jsonify,
+                   send_file, abort)
+from models import connect_db, db, Story
 from forms import UserAddForm, LoginForm, PreferencesForm
 from functools import wraps
-from helpers import signUpNewUser, CURR_USER_KEY, handle_login, do_login
-import requests
-from config import supported_countries, categories
-from api_key import api_key
+from helpers import (signUpNewUser, CURR_USER_KEY, handle_login, do_login, update_user_preferences,
+                     feed_page, LazyPage, cacheable_json, slim_headlines, thumbnail_url,
+                     image_signature)
+from config import (supported_countries, categories, config_profiles, INGEST_INTERVAL,
+                    FEED_PAGE_SIZE, FEED_MAX_PAGE_SIZE, HEADLINES_HTTP_CACHE, SOURCES_HTTP_CACHE,
+                    SLOW_REQUEST_SECONDS, THUMBNAIL_MAX_AGE, IMAGE_PROXY_SECRET)
+from services import (built, get_news_client, get_news_quota, get_sources_catalog,
+                      get_thumbnailer)
+from profiles import load_profile, invalidate_profile
+from ingest import local_headlines, last_good_headlines
+from feeds import load_feed, build_feed
+from search import search_stories
+from ranking import like_story, unlike_story
+from compression import compress_response
+from metrics import (start_request_timer, current_timer, observe_request, render_metrics,
+                     observe_news_client, BUDGET_USED, BUDGET_LIMIT)
+
+
+bp = Blueprint('courier', __name__, cli_group=None)
 
+# WSGI environ key the async serving mode uses to hand /user_home headlines
+# it already fetched to the view.
+PREFETCHED_HEADLINES_KEY = 'courier.headlines'
 
-BASE_URL = 'https://newsapi.org/v2'
-API_KEY = api_key
-headers = {'X-API-Key': API_KEY}
 
 ##### Initializing app ######
-app = Flask(__name__)
-app.app_context().push()
+def create_app(config_name=None):
+    """Build the Flask app for a config profile: production, development or testing.
+
+    Defaults to COURIER_ENV, or production. The database engine and the News API
+    client are only set up when first used, so building an app is cheap.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_profiles[config_name or os.environ.get('COURIER_ENV', 'production')])
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL', app.config['SQLALCHEMY_DATABASE_URI']))
+
+    # no indentation or spaces in JSON bodies, even in debug mode
+    app.json.compact = True
+    connect_db(app)
+    app.register_blueprint(bp)
+    if not IMAGE_PROXY_SECRET and not app.testing:
+        app.logger.warning("IMAGE_PROXY_SECRET is not set; article images are linked "
+                           "directly instead of through /img.")
+    return app
+
+
+@bp.app_template_filter('thumbnail')
+def thumbnail_filter(url):
+    return thumbnail_url(url)
+
+
+#### CLI commands ####
+@bp.cli.command('refresh-sources')
+def refresh_sources_command():
+    """Download the full News API sources catalog for the preference pages."""
+    sources_catalog = get_sources_catalog()
+    count = sources_catalog.refresh(get_news_client())
+    if count is None:
+        raise click.ClickException("Could not fetch the sources catalog from the News API.")
+    click.echo(f"Stored {count} sources in {sources_catalog.path}.")
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = True
-app.config['SECRET_KEY'] = "fjrgjfgoij34389792fruhg"
 
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///courier_capstone'))
+@bp.cli.command('ingest-headlines')
+@click.option('--loop', is_flag=True, help="Keep polling every --interval seconds.")
+@click.option('--interval', default=INGEST_INTERVAL, show_default=True)
+def ingest_headlines_command(loop, interval):
+    """Poll the News API for every followed outlet and country and store the stories."""
+    from ingest import ingest_once, run_forever
 
-connect_db(app)
+    if loop:
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+        run_forever(get_news_client(), interval)
+    stats = ingest_once(get_news_client())
+    click.echo(f"Ingested {stats['stories']} stories from {stats['queries']} queries "
+               f"({stats['failed']} failed).")
+
+
+@bp.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Create missing tables and apply schema upgrades to an existing database."""
+    import migrations
+
+    count = migrations.upgrade()
+    click.echo(f"Applied {count} schema statements.")
 
 
 #### Helper functions ####
-@app.before_request
+def home_headlines_params(sources):
+    """The /top-headlines query for a home feed of `sources`."""
+    return {'sources': ','.join(sources), 'pagesize': 50}
+
+
+def home_feed(user_id, sources):
+    """Return the user's whole home feed for `sources`, up to 50 stories."""
+    data = (request.environ.get(PREFETCHED_HEADLINES_KEY)
+            or load_feed(user_id, sources))
+    if data is None:
+        data = get_news_client().get('/top-headlines', params=home_headlines_params(sources))
+        data = last_good_headlines(data, sources=sources)
+    return data
+
+
+def render_page(template_name, **context):
+    """Render a page, streaming it to the client when STREAM_TEMPLATES is on."""
+    if not current_app.config['STREAM_TEMPLATES']:
+        return render_template(template_name, **context)
+    get_flashed_messages(with_categories=True)
+    return Response(stream_template(template_name, **context))
+
+
+@bp.before_app_request
+def start_timer():
+    start_request_timer()
+
+
+@bp.after_app_request
+def record_request(response):
+    """Record the request's timings once its body has been sent."""
+    timer = current_timer()
+    if timer is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        logger = current_app.logger
+        method, status = request.method, response.status_code
+        response.call_on_close(lambda: observe_request(timer, route, method, status,
+                                                       logger, SLOW_REQUEST_SECONDS))
+    return response
+
+
+@bp.after_app_request
+def compress_json(response):
+    return compress_response(response, request.headers.get('Accept-Encoding'))
+
+
+@bp.before_app_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = load_profile(session[CURR_USER_KEY])
     else:
         g.user = None
 
@@ -48,18 +163,31 @@ def login_required(func):
         """Add login-required decorator"""
         if not g.user:
             flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('courier.login'))
         return func(*args, **kwargs)
     return decorated_function
 
 
 ########## Routes before logging in #########
-@app.route('/')
+@bp.route('/metrics')
+def metrics():
+    """Request, phase and upstream latency histograms for Prometheus to scrape."""
+    quota = get_news_quota()
+    if quota is not None:
+        usage = quota.usage()
+        BUDGET_USED.set(usage['used'])
+        BUDGET_LIMIT.set(usage['limit'])
+    client = built('news_client')
+    if client is not None:
+        observe_news_client(client.stats(), 'sync')
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/')
 def home():
     """Home landing page for all site visits"""
     return render_template('home.html')
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     """Login route for signed up users"""
     form = LoginForm()
@@ -67,7 +195,7 @@ def login():
         return handle_login(form)
     return render_template('login.html', form=form)
 
-@app.route('/signup', methods=['GET', 'POST'])
+@bp.route('/signup', methods=['GET', 'POST'])
 def signup():
     form = UserAddForm()
     if form.is_submitted() and form.validate():
@@ -82,91 +210,85 @@ def signup():
 
 
 ####### Logged in user views and functions #######
-@app.route('/user_home')
+@bp.route('/user_home')
 @login_required
 def go_homepage():
-    outlets = OutletPreferences.query.filter_by(user=g.user.id).all()
+    outlets = g.user.outlets
     if len(outlets) != 0:
-        home_news_url = f"{BASE_URL}/top-headlines?sources="
-        for i in range(len(outlets)):
-            if i < len(outlets)-1:
-                home_news_url += outlets[i].outlet + ','
-            else:
-                home_news_url += outlets[i].outlet
-        response = requests.get(f"{home_news_url}&pagesize=50", headers=headers)
-        data = response.json()
-        return render_template('user/home.html', data=data)
+        sources, user_id = list(outlets), g.user.id
+        data = LazyPage(lambda: feed_page(home_feed(user_id, sources), 1, FEED_PAGE_SIZE))
+        return render_page('user/home.html', data=data)
     flash("We don't have any preferences for you yet. Set some here.")
     return redirect ('/user/first')
 
-@app.route('/logout')
+@bp.route('/api/feed')
+@login_required
+def feed_api():
+    """One page of the home feed as JSON, for infinite scroll on /user_home."""
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = request.args.get('page_size', FEED_PAGE_SIZE, type=int)
+    page_size = min(max(page_size, 1), FEED_MAX_PAGE_SIZE)
+    outlets = list(g.user.outlets)
+    if not outlets:
+        return cacheable_json(feed_page({'status': 'ok', 'totalResults': 0, 'articles': []},
+                                        page, page_size), HEADLINES_HTTP_CACHE)
+    return cacheable_json(slim_headlines(feed_page(home_feed(g.user.id, outlets), page, page_size)),
+                          HEADLINES_HTTP_CACHE)
+
+@bp.route('/logout')
 @login_required
 def logout():
     do_logout()
     return redirect('/')
 
-@app.route('/user/first', methods=['GET','POST'])
+@bp.route('/user/first', methods=['GET','POST'])
 @login_required
 def user_home():
     """When user initially logs in, allow them to select preferences for their user experience."""
-    user = User.query.get(g.user.id)
     form1 = PreferencesForm()
     form2 = PreferencesForm()
-    return render_template('/user/first.html', user=user, countries=supported_countries, form1=form1, form2=form2)
+    return render_template('/user/first.html', user=g.user, countries=supported_countries, form1=form1, form2=form2)
 
-@app.route('/user/first_prefs', methods=['GET', 'POST'])
+@bp.route('/user/first_prefs', methods=['GET', 'POST'])
 @login_required
 def first_prefs():
     form = PreferencesForm()
     if form.is_submitted() and form.validate():
         country_preferences = request.form.getlist('countries[]')
-        params = []
-        for country in country_preferences:
-            params.append(country)
-        data = []
-        for country in params:
-            response = requests.get(f"{BASE_URL}/top-headlines/sources?country={country}", headers=headers)
-            data.append(response.json())
-        return jsonify(data)
-
-@app.route('/user/pref')
+        sources_catalog = get_sources_catalog()
+        if sources_catalog.is_ready(get_news_client()):
+            data = [{'status': 'ok', 'sources': sources_catalog.by_country(country)}
+                    for country in country_preferences]
+            return cacheable_json(data, SOURCES_HTTP_CACHE)
+        data = get_news_client().get_many('/top-headlines/sources',
+                                          [{'country': country} for country in country_preferences])
+        return cacheable_json(data, SOURCES_HTTP_CACHE)
+
+@bp.route('/user/pref')
 @login_required
 def new_user_prefs():
-    preferences = CountryPreferences.query.filter_by(user=g.user.id).all()
-    params = []
-    for country in preferences:
-        params.append(country.country)
-    response = requests.get(f"{BASE_URL}/top-headlines/sources", params={"country": params})
-    data = response.json()
-    return jsonify(data)
-
-@app.route('/submit_prefs', methods=["GET","POST"])
+    params = list(g.user.countries)
+    sources_catalog = get_sources_catalog()
+    if sources_catalog.is_ready(get_news_client()):
+        return cacheable_json({'status': 'ok', 'sources': sources_catalog.for_countries(params)},
+                              SOURCES_HTTP_CACHE)
+    data = get_news_client().get('/top-headlines/sources', params={"country": params})
+    return cacheable_json(data, SOURCES_HTTP_CACHE)
+
+@bp.route('/submit_prefs', methods=["GET","POST"])
 @login_required
 def update_preferences():
     form = PreferencesForm()
-    # deletes all user prefs in db and readds all the ones present in country list
+    # replaces the user's prefs in db with the ones present in the submitted lists
     if form.is_submitted() and form.validate():
         country_preferences = request.form.getlist('countries[]')
         outlet_preferences = request.form.getlist('outlets[]')
-        country_prefs_db = CountryPreferences.query.filter_by(user=g.user.id).all()
-        outlet_prefs_db = OutletPreferences.query.filter_by(user=g.user.id).all()
-        
-        # Delete user preferences from the db;
+
         if len(country_preferences) > 0:
-            for country in country_prefs_db:
-                db.session.delete(country)
-            for outlet in outlet_prefs_db:
-                db.session.delete(outlet)
-        
-            #Instate users preferences from form data into db; 
-            for country in country_preferences:
-                cpref = CountryPreferences(country=country, user=g.user.id)
-                db.session.add(cpref)
-            for outlet in outlet_preferences:
-                opref = OutletPreferences(user=g.user.id, outlet=outlet)
-                db.session.add(opref)
-            
-            db.session.commit()
+            update_user_preferences(g.user.id, country_preferences, outlet_preferences)
+            invalidate_profile(g.user.id)
+            if set(outlet_preferences) != set(g.user.outlets):
+                build_feed(g.user.id, outlet_preferences)
         else:
             flash("Your preferences have been saved, but you didn't select any outlets. We are showing top US headlines.")
             return redirect('/user_home')
@@ -174,41 +296,83 @@ def update_preferences():
     return redirect('/user_home')
 
 
-@app.route('/display_profile')
+@bp.route('/display_profile')
 def show_profile():
-    user = User.query.get(g.user.id)
-    return render_template('user/profile.html', user = user)
+    return render_template('user/profile.html', user = g.user)
 
 
-@app.route('/user/manage_prefs', methods=['GET','POST'])
+@bp.route('/user/manage_prefs', methods=['GET','POST'])
 @login_required
 def manage_preferences():
     """Allow user to update preferences for their user experience."""
-    country_prefs = CountryPreferences.query.filter_by(user=g.user.id).all()
-    user = User.query.get(g.user.id)
     form1 = PreferencesForm()
     form2 = PreferencesForm()
-    for preference in country_prefs:
-        form1.countries.append_entry({'name': preference.country})
-    return render_template('/user/manage_prefs.html', user=user, countries=supported_countries, form1=form1, form2=form2)
+    for country in g.user.countries:
+        form1.countries.append_entry({'name': country})
+    return render_template('/user/manage_prefs.html', user=g.user, countries=supported_countries, form1=form1, form2=form2)
 
 
-@app.route('/discover', methods=['GET','POST'])
+@bp.route('/discover', methods=['GET','POST'])
 @login_required
 def discover_news():
     """Open Discover page, and allow user to discover news sources and articles based on categories."""
     form = PreferencesForm()
     if request.method == 'GET':
-        return render_template('user/discover.html', countries=supported_countries, categories=categories, form=form)
+        return render_page('user/discover.html', countries=supported_countries, categories=categories, form=form)
     else:
         data = request.json.get('articles')
-        return render_template('/user/discover.html', data=data, form=form, categories=categories)
+        return render_page('/user/discover.html', data=data, form=form, categories=categories)
     
-@app.route('/interact_with_api', methods=['GET','POST'])
+@bp.route('/search')
+@login_required
+def search():
+    """Ingested stories matching ?q=, best match first, one page at a time."""
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = request.args.get('page_size', FEED_PAGE_SIZE, type=int)
+    page_size = min(max(page_size, 1), FEED_MAX_PAGE_SIZE)
+    return cacheable_json(slim_headlines(search_stories(query, page, page_size)),
+                          HEADLINES_HTTP_CACHE)
+
+@bp.route('/api/like', methods=['POST', 'DELETE'])
+@login_required
+def like():
+    """Like (POST) or unlike (DELETE) the ingested story at ?url=; likes rank the home feed."""
+    story_id = db.session.scalar(db.select(Story.id).where(Story.url == request.args.get('url')))
+    if story_id is None:
+        return jsonify({'status': 'error', 'message': "We haven't stored that story."}), 404
+    if request.method == 'POST':
+        like_story(g.user.id, story_id)
+    else:
+        unlike_story(g.user.id, story_id)
+    return jsonify({'status': 'ok', 'liked': request.method == 'POST'})
+
+@bp.route('/img')
+def image_proxy():
+    """A card-width thumbnail of the remote image at ?u=, for URLs made by thumbnail_url."""
+    url = request.args.get('u', '')
+    width = request.args.get('w', 0, type=int)
+    signature = image_signature(url, width)
+    if width <= 0 or signature is None or not hmac.compare_digest(request.args.get('s', ''),
+                                                                  signature):
+        abort(404)
+    found = get_thumbnailer().thumbnail(url, width, request.headers.get('Accept'))
+    if found is None:
+        return redirect(url)
+    digest, path, mimetype = found
+    response = send_file(path, mimetype=mimetype, etag=digest, max_age=THUMBNAIL_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
+
+@bp.route('/interact_with_api', methods=['GET','POST'])
 @login_required
 def interact_with_api():
     category = request.args.get('category')
     country = request.args.get('country')
-    response = requests.get(f'{BASE_URL}/top-headlines?country={country}&category={category}', headers=headers)
-    data = response.json()
-    return data
\ No newline at end of file
+    data = local_headlines(country=country, category=category)
+    if data is None:
+        data = get_news_client().get('/top-headlines', params={'country': country, 'category': category})
+        data = last_good_headlines(data, country=country, category=category)
+    return cacheable_json(slim_headlines(data), HEADLINES_HTTP_CACHE)
\ No newline at end of file
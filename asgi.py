@@ -0,0 +1,210 @@
+"""Async (ASGI) serving mode for Courier app.
+
+    uvicorn asgi:app --workers 4
+
+The News API-bound work is done on the event loop with a non-blocking HTTP
+client, so a worker waiting on upstream keeps accepting requests:
+/interact_with_api is served natively, and /user_home fetches its headlines
+here before handing the page render to Flask. Every other route goes to the
+regular Flask app through asgiref's WSGI adapter, running on a pool of
+ASGI_WSGI_THREADS threads so a slow view (a login's bcrypt check, say) only
+holds up its own request. The sync mode (`gunicorn wsgi:app`) is unchanged.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from asgiref.wsgi import WsgiToAsgi, WsgiToAsgiInstance
+from flask import request, session
+
+from app import create_app, home_headlines_params, PREFETCHED_HEADLINES_KEY
+from compression import compress_response
+from config import ASGI_WSGI_THREADS, HEADLINES_HTTP_CACHE, SLOW_REQUEST_SECONDS
+from helpers import CURR_USER_KEY, cacheable_json, slim_headlines
+from feeds import load_feed
+from ingest import local_headlines, last_good_headlines
+from metrics import (RequestTimer, observe_request, observe_news_client, add_collector,
+                     remove_collector)
+from models import db, OutletPreferences
+from profiles import load_profile
+from newsapi import AsyncNewsAPIClient
+from services import get_api_key, get_news_cache, get_news_quota
+
+# ASGI scope key whose dict is merged into the WSGI environ Flask sees.
+ENVIRON_SCOPE_KEY = 'courier.environ'
+
+
+class ThreadedWsgiToAsgiInstance(WsgiToAsgiInstance):
+    """asgiref's WSGI adapter, minus the single shared thread.
+
+    asgiref runs every WSGI call with thread_sensitive=True, which queues all
+    Flask requests on a worker behind one thread. Here they run on `executor`.
+    """
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    async def run_wsgi_app(self, body):
+        run = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func
+        await sync_to_async(run, thread_sensitive=False, executor=self.executor)(self, body)
+
+    def build_environ(self, scope, body):
+        environ = super().build_environ(scope, body)
+        environ.update(scope.get(ENVIRON_SCOPE_KEY, {}))
+        return environ
+
+
+class ThreadedWsgiToAsgi(WsgiToAsgi):
+    """Serve a WSGI app from ASGI on a pool of `threads` threads."""
+
+    def __init__(self, wsgi_application, threads=ASGI_WSGI_THREADS):
+        super().__init__(wsgi_application)
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+
+    async def __call__(self, scope, receive, send):
+        await ThreadedWsgiToAsgiInstance(self.wsgi_application, self.executor)(
+            scope, receive, send)
+
+
+class CourierASGI:
+    """Route upstream-bound requests to async handlers and the rest to Flask."""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self.wsgi = ThreadedWsgiToAsgi(flask_app)
+        self.news_client = None
+        self.routes = {'/interact_with_api': self.interact_with_api,
+                       '/user_home': self.user_home}
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        handler = self.routes.get(scope.get('path'))
+        if scope['type'] != 'http' or handler is None or scope['method'] != 'GET':
+            return await self.wsgi(scope, receive, send)
+        if self.news_client is None:
+            self.news_client = AsyncNewsAPIClient(get_api_key(), cache=get_news_cache(),
+                                                  quota=get_news_quota())
+        await handler(scope, receive, send, await self.current_user_id(scope))
+
+    def collect_metrics(self):
+        if self.news_client is not None:
+            observe_news_client(self.news_client.stats(), 'async')
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # /metrics is served by Flask, which can't see the async client
+                add_collector(self.collect_metrics)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                remove_collector(self.collect_metrics)
+                if self.news_client is not None:
+                    await self.news_client.aclose()
+                self.wsgi.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def current_user_id(self, scope):
+        """The logged in user's id, checked the way Flask's `add_user_to_g` does.
+
+        The session cookie is opened by Flask's session interface, and the
+        user only counts as logged in if profiles.py can still load them.
+        """
+        cookies = [('Cookie', value.decode('latin-1'))
+                   for name, value in scope['headers'] if name == b'cookie']
+        if not cookies:
+            return None
+        return await asyncio.get_running_loop().run_in_executor(
+            self.wsgi.executor, self.logged_in_user_id, cookies)
+
+    def logged_in_user_id(self, headers):
+        with self.flask_app.test_request_context(headers=headers):
+            user_id = session.get(CURR_USER_KEY)
+            if user_id is None or load_profile(user_id) is None:
+                return None
+            return user_id
+
+    def run_with_app_context(self, func, *args, **kwargs):
+        """Run a blocking db call on a thread inside a Flask app context."""
+        def call():
+            with self.flask_app.app_context():
+                return func(*args, **kwargs)
+        return asyncio.get_running_loop().run_in_executor(self.wsgi.executor, call)
+
+    async def interact_with_api(self, scope, receive, send, user_id):
+        """Served here, so timed here: the Flask hooks never see this route."""
+        timer = RequestTimer()
+        if user_id is None:
+            status = await self.send_response(send, 302, b'', [(b'location', b'/login')])
+        else:
+            args = parse_qs(scope['query_string'].decode('latin-1'))
+            category = args.get('category', [None])[0]
+            country = args.get('country', [None])[0]
+            start = time.perf_counter()
+            data = await self.run_with_app_context(local_headlines, country=country,
+                                                   category=category)
+            timer.phases['db'] = time.perf_counter() - start
+            if data is None:
+                start = time.perf_counter()
+                data = await self.news_client.get('/top-headlines',
+                                                  params={'country': country, 'category': category})
+                timer.phases['upstream'] = time.perf_counter() - start
+                data = await self.run_with_app_context(last_good_headlines, data,
+                                                       country=country, category=category)
+            status = await self.send_json(scope, send, slim_headlines(data), HEADLINES_HTTP_CACHE)
+        observe_request(timer, '/interact_with_api', 'GET', status, self.flask_app.logger,
+                        SLOW_REQUEST_SECONDS)
+
+    async def user_home(self, scope, receive, send, user_id):
+        """Fetch the home feed here, then let Flask render the page with it.
+
+        Logged out users and users without outlets go straight to Flask, which
+        redirects them with the usual flash message.
+        """
+        if user_id is None:
+            return await self.wsgi(scope, receive, send)
+        # a fresh materialized feed answers without looking up the user's outlets
+        data = await self.run_with_app_context(load_feed, user_id)
+        if data is None:
+            sources = await self.run_with_app_context(followed_outlets, user_id)
+            if not sources:
+                return await self.wsgi(scope, receive, send)
+            data = await self.run_with_app_context(load_feed, user_id, sources)
+        if data is None:
+            data = await self.news_client.get('/top-headlines',
+                                              params=home_headlines_params(sources))
+            data = await self.run_with_app_context(last_good_headlines, data, sources=sources)
+        scope = {**scope, ENVIRON_SCOPE_KEY: {PREFETCHED_HEADLINES_KEY: data}}
+        await self.wsgi(scope, receive, send)
+
+    async def send_json(self, scope, send, data, http_cache):
+        """Send `data` through the helpers the Flask routes use, so with the same headers."""
+        headers = [(name.decode('latin-1'), value.decode('latin-1'))
+                   for name, value in scope['headers']]
+        with self.flask_app.test_request_context(scope['path'], headers=headers):
+            response = compress_response(cacheable_json(data, http_cache),
+                                         request.headers.get('Accept-Encoding'))
+        return await self.send_response(send, response.status_code, response.get_data(), [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in response.headers.items() if name.lower() != 'content-length'])
+
+    async def send_response(self, send, status, body, headers):
+        """Send a whole response and return its status."""
+        headers = headers + [(b'content-length', str(len(body)).encode())]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+        return status
+
+
+def followed_outlets(user_id):
+    return db.session.scalars(db.select(OutletPreferences.outlet)
+                              .where(OutletPreferences.user == user_id)
+                              .order_by(OutletPreferences.id)).all()
+
+
+app = CourierASGI(create_app())
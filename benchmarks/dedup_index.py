@@ -0,0 +1,89 @@
+"""Measure near-duplicate checks against a growing MinHash/LSH index.
+
+Builds synthetic headlines (a pool of wire stories, each rewritten by a few
+outlets with small edits), then times checking one new story against the
+index at several sizes, next to comparing it with every indexed signature.
+Also reports how often rewrites were found and unrelated stories matched.
+
+    python benchmarks/dedup_index.py --sizes 1000 10000 100000
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from config import DEDUP_THRESHOLD
+from dedup import shingles, minhash, band_keys, MinHashIndex
+
+
+def words(n):
+    return [''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 9)))
+            for _ in range(n)]
+
+
+def rewrite(headline):
+    """The same story as another outlet might title it: a word or two changed."""
+    edited = headline.split()
+    for _ in range(random.randint(1, 2)):
+        edited[random.randrange(len(edited))] = words(1)[0]
+    return ' '.join(edited)
+
+
+def build(size):
+    """An index of `size` stories from 4 outlets; returns it and its signatures."""
+    index, signatures = MinHashIndex(), []
+    for key in range(size):
+        signature = minhash(shingles(' '.join(words(10))))
+        index.add(key, signature, band_keys(signature), outlet=key % 4)
+        signatures.append(signature)
+    return index, np.array(signatures)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10_000, 100_000])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(0)
+    print(f"{'indexed':>9}{'sign ms':>9}{'lsh ms':>8}{'scan ms':>9}{'found':>7}{'false':>7}")
+    for size in args.sizes:
+        index, signatures = build(size)
+        found = false = 0
+        sign_ms = lsh_ms = scan_ms = 0.0
+        for n in range(args.queries):
+            # even queries are a rewrite of a story just indexed, odd ones are unrelated
+            text = ' '.join(words(10))
+            if n % 2 == 0:
+                source = minhash(shingles(text))
+                index.add(size + n, source, band_keys(source), outlet=0)
+                text = rewrite(text)
+
+            start = time.perf_counter()
+            signature = minhash(shingles(text))
+            bands = band_keys(signature)
+            sign_ms += time.perf_counter() - start
+            start = time.perf_counter()
+            match = index.match(signature, bands, outlet=1)
+            lsh_ms += time.perf_counter() - start
+            start = time.perf_counter()
+            (np.mean(signatures == np.array(signature), axis=1) >= DEDUP_THRESHOLD).any()
+            scan_ms += time.perf_counter() - start
+
+            if n % 2 == 0:
+                found += match == size + n
+            else:
+                false += match is not None
+        per = 1000 / args.queries
+        print(f"{size:>9}{sign_ms * per:>9.3f}{lsh_ms * per:>8.3f}{scan_ms * per:>9.2f}"
+              f"{found / (args.queries / 2):>7.0%}{false / (args.queries / 2):>7.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Measure home feed image weight with and without the /img thumbnails.
+
+Makes `--cards` synthetic publisher photos (smooth gradients with noise, so
+they compress like photographs rather than flat colour) at typical publisher
+sizes, then compares their total size with the WebP and JPEG thumbnails /img
+serves, and reports how long making each thumbnail takes.
+
+    python benchmarks/image_weight.py --cards 50
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageFilter
+
+from config import THUMBNAIL_WIDTH
+from thumbnails import resize
+
+SIZES = [(3000, 2000), (2400, 1600), (2048, 1152), (1920, 1080), (1200, 800)]
+
+
+def photo(width, height):
+    """JPEG bytes of a noisy gradient, about as compressible as a news photo."""
+    image = Image.effect_noise((width // 4, height // 4), 60).convert('RGB')
+    image = image.resize((width, height), Image.BICUBIC).filter(ImageFilter.SMOOTH)
+    tint = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    image = Image.blend(image, tint, 0.4)
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=random.choice([85, 90, 95]))
+    return out.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cards', type=int, default=50)
+    parser.add_argument('--width', type=int, default=THUMBNAIL_WIDTH)
+    args = parser.parse_args()
+
+    random.seed(0)
+    originals = [photo(*random.choice(SIZES)) for _ in range(args.cards)]
+    print(f"{'image':>10}{'total KB':>10}{'per card KB':>13}{'resize ms':>11}")
+    print(f"{'original':>10}{sum(map(len, originals)) / 1024:>10.0f}"
+          f"{sum(map(len, originals)) / 1024 / args.cards:>13.0f}{'':>11}")
+    for fmt in ('webp', 'jpeg'):
+        start = time.perf_counter()
+        thumbnails = [resize(data, args.width, fmt) for data in originals]
+        elapsed = time.perf_counter() - start
+        print(f"{fmt:>10}{sum(map(len, thumbnails)) / 1024:>10.0f}"
+              f"{sum(map(len, thumbnails)) / 1024 / args.cards:>13.0f}"
+              f"{1000 * elapsed / args.cards:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
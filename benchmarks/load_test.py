@@ -0,0 +1,173 @@
+"""End-to-end load test against the fake News API.
+
+Starts the fake News API (tests/fake_newsapi.py) and the app under gunicorn
+pointed at it, creates `--users` accounts, then has that many simulated users
+log in and browse concurrently: /user_home, a page of /api/feed, /discover
+and a category lookup, and now and then /submit_prefs. Reports throughput and
+p50/p95/p99 latency per route. The News API budget starts empty each run and
+allows --upstream-rate calls per second.
+
+    createdb courier_bench
+    python benchmarks/load_test.py --users 50 --duration 30 --latency 0.15 --error-rate 0.01
+
+Never point BENCH_DATABASE_URL at a real database: the tables are dropped.
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tests'))
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', 'postgresql:///courier_bench')
+# Cheap hashes for the seeded accounts; the server checks them at the same cost.
+os.environ.setdefault('BCRYPT_LOG_ROUNDS', '4')
+
+import httpx
+
+from fake_newsapi import FakeNewsAPI
+
+PASSWORD = 'load-test-password'
+COUNTRIES = ['us', 'gb', 'ar', 'fr', 'de', 'in']
+OUTLETS = ['bbc-news', 'cnn', 'espn', 'techcrunch', 'clarin', 'le-monde', 'financial-times']
+CATEGORIES = ['business', 'entertainment', 'general', 'health', 'science', 'sports', 'technology']
+CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def seed_users(count):
+    """Recreate the tables and add `count` users with a few preferences each."""
+    from app import create_app
+    from models import db, User, CountryPreferences, OutletPreferences
+
+    app = create_app('production')
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for n in range(count):
+            user = User.signup(f"load{n}", f"load{n}@example.com", PASSWORD, None)
+            db.session.flush()
+            for country in random.sample(COUNTRIES, 2):
+                db.session.add(CountryPreferences(user=user.id, country=country))
+            for outlet in random.sample(OUTLETS, 3):
+                db.session.add(OutletPreferences(user=user.id, outlet=outlet))
+        db.session.commit()
+
+
+def start_server(port, workers, threads, newsapi_url, upstream_rate):
+    env = {**os.environ, 'NEWSAPI_BASE_URL': newsapi_url, 'NEWSAPI_KEY': 'load-test',
+           'NEWSAPI_RETRIES': '0', 'NEWSAPI_RATE_LIMIT': str(upstream_rate),
+           'NEWSAPI_RATE_BURST': str(max(int(upstream_rate), 1)), 'NEWSAPI_DAILY_QUOTA': str(10 ** 9),
+           'NEWSAPI_QUOTA_PATH': os.path.join(tempfile.mkdtemp(), 'quota.sqlite3')}
+    cmd = ['gunicorn', '-w', str(workers), '--threads', str(threads), '-b', f"127.0.0.1:{port}",
+           '--log-level', 'warning', 'wsgi:app']
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+
+
+class Recorder:
+    """Latencies and failures per route."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+
+    async def request(self, client, route, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.latencies.setdefault(route, []).append(1000 * (time.perf_counter() - start))
+        if not ok:
+            self.errors[route] = self.errors.get(route, 0) + 1
+        return response
+
+    def report(self, elapsed):
+        print(f"{'route':>16}{'requests':>10}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+              f"{'p99 ms':>9}{'errors':>8}")
+        for route, latencies in self.latencies.items():
+            latencies.sort()
+            pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]
+            print(f"{route:>16}{len(latencies):>10}{len(latencies) / elapsed:>9.1f}"
+                  f"{pick(0.5):>9.0f}{pick(0.95):>9.0f}{pick(0.99):>9.0f}"
+                  f"{self.errors.get(route, 0):>8}")
+
+
+async def simulated_user(n, url, deadline, think, recorder):
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        response = await recorder.request(client, 'GET /login', 'GET', '/login')
+        token = CSRF.search(response.text).group(1) if response is not None else ''
+        await recorder.request(client, 'POST /login', 'POST', '/login',
+                               data={'csrf_token': token, 'username': f"load{n}",
+                                     'password': PASSWORD})
+        while time.perf_counter() < deadline:
+            await recorder.request(client, 'GET /user_home', 'GET', '/user_home')
+            await recorder.request(client, 'GET /api/feed', 'GET', '/api/feed',
+                                   params={'page': 2})
+            await recorder.request(client, 'GET /discover', 'GET', '/discover')
+            await recorder.request(client, 'GET /interact', 'GET', '/interact_with_api',
+                                   params={'country': random.choice(COUNTRIES),
+                                           'category': random.choice(CATEGORIES)})
+            if random.random() < 0.1:
+                await recorder.request(client, 'POST /submit_prefs', 'POST', '/submit_prefs',
+                                       data={'csrf_token': token,
+                                             'countries[]': random.sample(COUNTRIES, 2),
+                                             'outlets[]': random.sample(OUTLETS, 3)})
+            await asyncio.sleep(random.uniform(0, 2 * think))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--think', type=float, default=0.2, help="mean pause between page views")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.15)
+    parser.add_argument('--error-rate', type=float, default=0.01)
+    parser.add_argument('--articles', type=int, default=50)
+    parser.add_argument('--upstream-rate', type=float, default=50,
+                        help="News API calls per second the budget allows")
+    args = parser.parse_args()
+
+    fake = FakeNewsAPI(latency=args.latency, error_rate=args.error_rate,
+                       articles=args.articles).start()
+    print(f"Seeding {args.users} users...")
+    seed_users(args.users)
+    port = 8704
+    server = start_server(port, args.workers, args.threads, fake.url, args.upstream_rate)
+    url = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient() as client:
+            for _ in range(100):
+                try:
+                    await client.get(f"{url}/")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+
+        recorder = Recorder()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(simulated_user(n, url, deadline, args.think, recorder)
+                               for n in range(args.users)))
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+        fake.stop()
+
+    print(f"{args.users} users for {elapsed:.0f}s, {args.workers} workers x {args.threads} threads, "
+          f"upstream latency {1000 * args.latency:.0f} ms, error rate {args.error_rate:.0%}")
+    recorder.report(elapsed)
+    print(f"upstream requests: {fake.requests}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,72 @@
+"""Benchmark password checks per second at different bcrypt costs.
+
+Simulates a login burst: `--clients` threads each verify passwords through the
+bounded bcrypt pool for `--seconds`, once per cost in `--rounds`. Checks
+turned away because the queue was full are reported separately.
+
+    python benchmarks/login_throughput.py --rounds 10 11 12 13 --clients 32
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import BCRYPT_WORKERS, BCRYPT_QUEUE_DEPTH
+from passwords import PasswordHasher, PasswordQueueFull
+
+
+def run(rounds, clients, seconds, workers, queue_depth):
+    hasher = PasswordHasher(rounds=rounds, workers=workers, queue_depth=queue_depth)
+    pw_hash = hasher.hash('correct horse battery staple')
+    counts = {'ok': 0, 'rejected': 0}
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                hasher.check(pw_hash, 'correct horse battery staple')
+                outcome = 'ok'
+            except PasswordQueueFull:
+                outcome = 'rejected'
+            with lock:
+                counts[outcome] += 1
+                if outcome == 'ok':
+                    latencies.append(1000 * (time.perf_counter() - start))
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] if latencies else 0
+    p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+    return counts['ok'] / seconds, counts['rejected'], p50, p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, nargs='+', default=[10, 11, 12, 13])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=BCRYPT_WORKERS)
+    parser.add_argument('--queue-depth', type=int, default=BCRYPT_QUEUE_DEPTH)
+    args = parser.parse_args()
+
+    print(f"{args.clients} clients, {args.workers} bcrypt workers, queue depth {args.queue_depth}")
+    print(f"{'rounds':>6}{'logins/s':>10}{'rejected':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for rounds in args.rounds:
+        rate, rejected, p50, p95 = run(rounds, args.clients, args.seconds, args.workers,
+                                       args.queue_depth)
+        print(f"{rounds:>6}{rate:>10.1f}{rejected:>10}{p50:>10.1f}{p95:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
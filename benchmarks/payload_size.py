@@ -0,0 +1,80 @@
+"""Measure /interact_with_api payload size and serialization time.
+
+Builds a /top-headlines body shaped like the News API's (100 articles with
+full `content`), then compares the raw passthrough with the slim projection,
+as indented and compact JSON, uncompressed, gzip and brotli.
+
+    python benchmarks/payload_size.py --articles 100
+"""
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compression import brotli, compress
+from helpers import slim_headlines
+
+
+def words(n):
+    return ' '.join(''.join(random.choices(string.ascii_lowercase, k=random.randint(3, 9)))
+                    for _ in range(n))
+
+
+def headlines(count):
+    articles = []
+    for i in range(count):
+        articles.append({
+            'source': {'id': f"outlet-{i % 20}", 'name': f"Outlet {i % 20}"},
+            'author': words(2),
+            'title': words(12),
+            'description': words(35),
+            'url': f"https://example.com/news/{i}/{words(4).replace(' ', '-')}",
+            'urlToImage': f"https://images.example.com/{i}.jpg",
+            'publishedAt': '2024-01-01T12:00:00Z',
+            'content': words(40) + ' [+3120 chars]',
+        })
+    return {'status': 'ok', 'totalResults': count, 'articles': articles}
+
+
+def timed(func, number):
+    """Return the mean ms per call of func()."""
+    return 1000 * timeit.timeit(func, number=number) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--articles', type=int, default=100)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(0)
+    data = headlines(args.articles)
+    variants = {
+        'raw, indented': lambda: json.dumps(data, indent=2).encode(),
+        'raw, compact': lambda: json.dumps(data, separators=(',', ':')).encode(),
+        'slim, compact': lambda: json.dumps(slim_headlines(data), separators=(',', ':')).encode(),
+    }
+    encodings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+
+    print(f"{args.articles} articles, mean of {args.number} runs"
+          + ('' if brotli else ' (brotli not installed)'))
+    print(f"{'body':>15}{'encoding':>10}{'bytes':>10}{'serialize ms':>14}{'compress ms':>13}")
+    for name, serialize in variants.items():
+        body = serialize()
+        serialize_ms = timed(serialize, args.number)
+        for encoding in encodings:
+            if encoding == 'identity':
+                size, compress_ms = len(body), 0.0
+            else:
+                size = len(compress(body, encoding))
+                compress_ms = timed(lambda: compress(body, encoding), args.number)
+            print(f"{name:>15}{encoding:>10}{size:>10}{serialize_ms:>14.3f}{compress_ms:>13.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark preference lookups by user with and without the (user, ...) indexes.
+
+Seeds a throwaway database with many users and preference rows, times the
+`filter_by(user=...)` lookups every authenticated page makes, then applies the
+migrations and times them again.
+
+    createdb courier_bench
+    python benchmarks/preferences_lookup.py --users 500000 --per-user 5
+
+Never point BENCH_DATABASE_URL at a real database: the tables are truncated.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', 'postgresql:///courier_bench')
+
+from sqlalchemy import text
+
+from app import create_app
+from models import db, CountryPreferences, OutletPreferences
+import migrations
+
+app = create_app('production')
+
+COUNTRIES = ['us', 'gb', 'ar', 'fr', 'de', 'jp', 'in', 'br', 'ca', 'au']
+
+
+def execute(sql, **params):
+    db.session.execute(text(sql), params)
+    db.session.commit()
+
+
+def seed(users, per_user):
+    """Recreate the preference tables without indexes and fill them."""
+    db.drop_all()
+    db.create_all()
+    for table, name in (('country_preferences', 'uq_country_preferences_user_country'),
+                        ('outlet_preferences', 'uq_outlet_preferences_user_outlet')):
+        execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {name}")
+    execute("""INSERT INTO users (username, email, password)
+               SELECT 'bench' || u, 'bench' || u || '@example.com', 'x'
+               FROM generate_series(1, :users) u""", users=users)
+    execute("""INSERT INTO country_preferences ("user", country)
+               SELECT u, (CAST(:countries AS text[]))[1 + (u + k) % :n]
+               FROM generate_series(1, :users) u, generate_series(1, :per_user) k""",
+            users=users, per_user=min(per_user, len(COUNTRIES)), countries=COUNTRIES,
+            n=len(COUNTRIES))
+    execute("""INSERT INTO outlet_preferences ("user", outlet)
+               SELECT u, 'outlet-' || ((u * 7 + k) % 500)
+               FROM generate_series(1, :users) u, generate_series(1, :per_user) k""",
+            users=users, per_user=per_user)
+    execute("ANALYZE")
+
+
+def time_lookups(users, lookups):
+    """Return (mean ms, p95 ms) for one country + one outlet lookup per user id."""
+    ids = [random.randint(1, users) for _ in range(lookups)]
+    timings = []
+    for user_id in ids:
+        start = time.perf_counter()
+        CountryPreferences.query.filter_by(user=user_id).all()
+        OutletPreferences.query.filter_by(user=user_id).all()
+        timings.append(1000 * (time.perf_counter() - start))
+        db.session.rollback()
+    timings.sort()
+    return sum(timings) / len(timings), timings[int(len(timings) * 0.95)]
+
+
+def plan(user_id):
+    rows = db.session.execute(text(
+        'EXPLAIN SELECT * FROM country_preferences WHERE "user" = :user'), {'user': user_id})
+    return rows.first()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=500_000)
+    parser.add_argument('--per-user', type=int, default=5)
+    parser.add_argument('--lookups', type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"Seeding {args.users} users x {args.per_user} country and outlet preferences...")
+    seed(args.users, args.per_user)
+
+    before = time_lookups(args.users, args.lookups)
+    print(f"without indexes: {plan(1)}")
+    migrations.upgrade()
+    execute("ANALYZE")
+    after = time_lookups(args.users, args.lookups)
+    print(f"with indexes:    {plan(1)}")
+
+    print(f"\n{'':16}{'mean ms':>10}{'p95 ms':>10}")
+    print(f"{'without indexes':16}{before[0]:>10.2f}{before[1]:>10.2f}")
+    print(f"{'with indexes':16}{after[0]:>10.2f}{after[1]:>10.2f}")
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        main()
@@ -0,0 +1,117 @@
+"""Measure how long ranking a batch of home feed candidates takes.
+
+Builds synthetic candidates (outlets, content tags and publish times drawn
+from skewed distributions, like ingested stories) and synthetic like
+histories, then times the NumPy scoring in ranking.py for one user and for a
+batch of users against a plain Python loop computing the same scores. Exits
+non-zero if one user's p95 goes over --budget-ms.
+
+    python benchmarks/ranking_latency.py --candidates 500 --likes 200
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from ranking import Candidates, affinities, score
+from config import RANK_RECENCY_WEIGHT, RANK_HALF_LIFE, RANK_OUTLET_WEIGHT, RANK_TAG_WEIGHT
+
+NOW = datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+
+def skewed(n):
+    """A random int in [1, n], small values far more likely than large ones."""
+    return int(n ** random.random())
+
+
+def synthetic_candidates(count, outlets, tags):
+    stories = []
+    for _ in range(count):
+        published = NOW - timedelta(seconds=random.randint(0, 2 * 24 * 60 * 60))
+        stories.append((skewed(outlets), random.sample(range(1, tags + 1), 8) + [skewed(tags)],
+                        published.strftime('%Y-%m-%dT%H:%M:%SZ')))
+    return stories
+
+
+def synthetic_likes(users, count, outlets, tags):
+    return [[(skewed(outlets), [skewed(tags) for _ in range(6)]) for _ in range(count)]
+            for _ in range(users)]
+
+
+def rank_numpy(stories, likes):
+    candidates = Candidates(*zip(*stories), now=NOW.timestamp())
+    return score(candidates, *affinities(likes, candidates))
+
+
+def rank_python(stories, likes):
+    """The same scores, one user and one candidate at a time."""
+    scores = []
+    for user_likes in likes:
+        total = max(len(user_likes), 1)
+        outlet_counts = Counter(outlet for outlet, _ in user_likes)
+        tag_counts = Counter(tag for _, tags in user_likes for tag in tags)
+        row = []
+        for outlet, tags, published in stories:
+            age = (NOW - datetime.strptime(published, '%Y-%m-%dT%H:%M:%SZ')
+                   .replace(tzinfo=timezone.utc)).total_seconds()
+            tag_share = sum(tag_counts[tag] for tag in tags) / total / max(len(tags), 1)
+            row.append(RANK_RECENCY_WEIGHT * 0.5 ** (max(age, 0) / RANK_HALF_LIFE)
+                       + RANK_OUTLET_WEIGHT * outlet_counts[outlet] / total
+                       + RANK_TAG_WEIGHT * tag_share)
+        scores.append(row)
+    return scores
+
+
+def timed(func, repeat):
+    """Return (p50 ms, p95 ms) of func()."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(1000 * (time.perf_counter() - start))
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--candidates', type=int, default=500)
+    parser.add_argument('--likes', type=int, default=200, help="likes per user")
+    parser.add_argument('--users', type=int, default=64, help="users in the batch run")
+    parser.add_argument('--outlets', type=int, default=300)
+    parser.add_argument('--tags', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--budget-ms', type=float, default=5.0)
+    args = parser.parse_args()
+
+    random.seed(0)
+    stories = synthetic_candidates(args.candidates, args.outlets, args.tags)
+    likes = synthetic_likes(args.users, args.likes, args.outlets, args.tags)
+    assert np.allclose(rank_numpy(stories, likes[:2]), rank_python(stories, likes[:2]))
+
+    print(f"{'users':>6}{'numpy p50 ms':>14}{'p95':>8}{'per user':>10}"
+          f"{'python p50 ms':>15}{'p95':>8}")
+    results = {}
+    for users in (1, args.users):
+        batch = likes[:users]
+        numpy_ms = timed(lambda: rank_numpy(stories, batch), args.repeat)
+        python_ms = timed(lambda: rank_python(stories, batch), max(args.repeat // 20, 3))
+        results[users] = numpy_ms
+        print(f"{users:>6}{numpy_ms[0]:>14.2f}{numpy_ms[1]:>8.2f}{numpy_ms[0] / users:>10.3f}"
+              f"{python_ms[0]:>15.2f}{python_ms[1]:>8.2f}")
+
+    if results[1][1] > args.budget_ms:
+        print(f"\nRanking {args.candidates} candidates took {results[1][1]:.2f} ms at p95, "
+              f"over the {args.budget_ms:g} ms budget.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
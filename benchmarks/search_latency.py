@@ -0,0 +1,133 @@
+"""Benchmark /search queries over a large synthetic story corpus.
+
+Seeds a throwaway database with synthetic stories whose words follow a
+skewed distribution (a few very common words, a long tail of rare ones),
+builds the search vectors and GIN index, then times search_stories() for
+common, rare, prefix and multi-word queries against an ILIKE scan of the
+same columns.
+
+    createdb courier_bench
+    python benchmarks/search_latency.py --stories 1000000
+
+Never point BENCH_DATABASE_URL at a real database: the tables are dropped.
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', 'postgresql:///courier_bench')
+
+from sqlalchemy import text
+
+from app import create_app
+from models import db
+from search import search_stories, backfill_search_vectors
+
+app = create_app('production')
+
+COMMON = ['election', 'market', 'government', 'police', 'weather', 'football', 'energy',
+          'health', 'court', 'climate', 'budget', 'school', 'storm', 'minister', 'trade']
+
+
+def execute(sql, **params):
+    result = db.session.execute(text(sql), params)
+    db.session.commit()
+    return result
+
+
+def vocabulary(size):
+    random.seed(0)
+    words = set(COMMON)
+    while len(words) < size:
+        words.add(''.join(random.choices(string.ascii_lowercase, k=random.randint(4, 10))))
+    return COMMON + sorted(words - set(COMMON))
+
+
+def seed(stories, words):
+    """Recreate the tables and fill `stories` with random text, then index it."""
+    db.drop_all()
+    db.create_all()
+    execute("DROP INDEX ix_stories_search")
+    execute("""INSERT INTO outlets (name, source_id)
+               SELECT 'Outlet ' || o, 'outlet-' || o FROM generate_series(1, 200) o""")
+    # floor(n ^ random()) picks low (common) word indexes far more often than high ones;
+    # the `s` in each subquery makes Postgres draw new words for every row.
+    phrase = """(SELECT string_agg(word, ' ') FROM (
+                     SELECT words[floor(power(:n, random()))::int] AS word
+                     FROM generate_series(1, {count} + s % 3)) picked)"""
+    execute(f"""INSERT INTO stories (title, description, author, outlet, url, date)
+                SELECT {phrase.format(count=8)}, {phrase.format(count=25)},
+                       'Author ' || (s % 5000), 1 + s % 200, 'https://example.com/' || s,
+                       to_char(TIMESTAMP '2024-01-01' + s * INTERVAL '1 minute',
+                               'YYYY-MM-DD"T"HH24:MI:SS"Z"')
+                FROM generate_series(1, :stories) s, CAST(:words AS text[]) words""",
+            stories=stories, words=words, n=len(words))
+    backfill_search_vectors()
+    db.session.commit()
+    execute("CREATE INDEX ix_stories_search ON stories USING GIN (search_vector)")
+    execute("ANALYZE")
+
+
+def ilike_search(word, page_size):
+    pattern = f"%{word}%"
+    return execute("""SELECT id FROM stories
+                      WHERE title ILIKE :p OR description ILIKE :p OR author ILIKE :p
+                      ORDER BY date DESC LIMIT :limit""", p=pattern, limit=page_size).all()
+
+
+def timed(func, repeat):
+    """Return (p50 ms, p95 ms) of func()."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(1000 * (time.perf_counter() - start))
+        db.session.rollback()
+    timings.sort()
+    return timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--stories', type=int, default=1_000_000)
+    parser.add_argument('--words', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--page-size', type=int, default=10)
+    args = parser.parse_args()
+
+    words = vocabulary(args.words)
+    print(f"Seeding {args.stories} stories from a {len(words)} word vocabulary...")
+    start = time.perf_counter()
+    seed(args.stories, words)
+    print(f"Seeded and indexed in {time.perf_counter() - start:.0f}s.")
+
+    queries = {
+        'common word': words[0],
+        'mid word': words[200],
+        'rare word': words[5000],
+        'prefix': words[3][:4],
+        'two words': f"{words[1]} {words[50]}",
+        'no match': 'zzzzzzzzzz',
+    }
+    print(f"\n{'query':>12}{'text':>22}{'matches':>10}{'search p50':>12}{'p95':>8}"
+          f"{'ILIKE p50':>11}{'p95':>8}")
+    for name, query in queries.items():
+        matches = execute("SELECT count(*) FROM stories WHERE search_vector @@ "
+                          "to_tsquery('english', :q)",
+                          q=' & '.join(query.split()[:-1] + [query.split()[-1] + ':*'])).scalar()
+        search = timed(lambda: search_stories(query, 1, args.page_size), args.repeat)
+        if ' ' in query:
+            ilike = (float('nan'), float('nan'))
+        else:
+            ilike = timed(lambda: ilike_search(query, args.page_size), max(args.repeat // 4, 3))
+        print(f"{name:>12}{query:>22}{matches:>10}{search[0]:>12.1f}{search[1]:>8.1f}"
+              f"{ilike[0]:>11.1f}{ilike[1]:>8.1f}")
+
+
+if __name__ == '__main__':
+    with app.app_context():
+        main()
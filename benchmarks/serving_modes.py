@@ -0,0 +1,178 @@
+"""Compare concurrency vs latency for the sync (gunicorn) and async (uvicorn) serving modes.
+
+Starts a stub News API that answers every request after a fixed delay, runs the
+app once under gunicorn sync workers and once under uvicorn with the ASGI app,
+and drives two routes at increasing concurrency:
+
+- api: /interact_with_api, served on the event loop in async mode. Every
+  request uses a distinct category.
+- prefs: /user/pref, a Flask view that blocks on upstream in both modes. Each
+  client is a different user following a different country, with the sources
+  cache and catalog off, so every request waits on upstream and a mode that
+  queues Flask requests behind one thread shows it.
+
+Either way the response cache and request coalescing can't hide the upstream wait.
+
+    createdb courier_bench
+    python benchmarks/serving_modes.py --workers 2 --upstream-latency 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', 'postgresql:///courier_bench')
+
+import httpx
+
+
+async def stub_newsapi(port, latency):
+    """A News API stand-in that sleeps `latency` seconds before answering."""
+    body = json.dumps({'status': 'ok', 'totalResults': 1, 'articles': [
+        {'source': {'id': None, 'name': 'Stub'}, 'title': 'Stub story', 'url': 'http://stub'}]}).encode()
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await reader.readuntil(b'\r\n\r\n')
+                if not request:
+                    break
+                await asyncio.sleep(latency)
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, '127.0.0.1', port, backlog=4096)
+
+
+def session_cookies(count):
+    """Create `count` benchmark users and return a session cookie for each.
+
+    User n follows the made-up country "bench-n", so their /user/pref lookups
+    never share an upstream call.
+    """
+    from app import create_app
+    from helpers import CURR_USER_KEY
+    from models import db, User, CountryPreferences
+
+    app = create_app('production')
+    app.app_context().push()
+    db.create_all()
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = []
+    for n in range(count):
+        user = User.query.filter_by(username=f"bench{n}").first()
+        if user is None:
+            user = User(username=f"bench{n}", email=f"bench{n}@example.com", password='x')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add(CountryPreferences(user=user.id, country=f"bench-{n}"))
+            db.session.commit()
+        cookies.append({app.config['SESSION_COOKIE_NAME']:
+                        serializer.dumps({CURR_USER_KEY: user.id})})
+    return cookies
+
+
+def start_server(mode, port, workers, upstream_port):
+    env = {**os.environ, 'NEWSAPI_BASE_URL': f"http://127.0.0.1:{upstream_port}",
+           'NEWSAPI_CACHE_BACKEND': 'memory', 'NEWSAPI_SOURCES_TTL': '0',
+           'SOURCES_CATALOG_PATH': os.path.join(ROOT, 'benchmarks', 'no-such-catalog.json'),
+           'SOURCES_CATALOG_REFRESH': str(10 ** 10), 'NEWSAPI_QUOTA_BACKEND': 'off'}
+    if mode == 'sync':
+        cmd = ['gunicorn', '-w', str(workers), '-b', f"127.0.0.1:{port}", '--log-level', 'warning',
+               'wsgi:app']
+    else:
+        cmd = ['uvicorn', 'asgi:app', '--workers', str(workers), '--port', str(port),
+               '--log-level', 'warning']
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+
+
+async def wait_until_up(url, cookies):
+    async with httpx.AsyncClient(cookies=cookies) as client:
+        for _ in range(100):
+            try:
+                await client.get(f"{url}/interact_with_api?country=us&category=warmup")
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not start")
+
+
+def request_for(route, run, n, i):
+    """Return (path, params) for client n's i-th request to `route`."""
+    if route == 'api':
+        return '/interact_with_api', {'country': 'us', 'category': f"bench-{run}-{n}-{i}"}
+    return '/user/pref', None
+
+
+async def drive(url, cookies, route, concurrency, requests_per_client, run):
+    """Return (requests/s, p50 ms, p95 ms, errors) at one concurrency level."""
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def user(n):
+            nonlocal errors
+            for i in range(requests_per_client):
+                path, params = request_for(route, run, n, i)
+                start = time.perf_counter()
+                try:
+                    response = await client.get(f"{url}{path}", params=params,
+                                                cookies=cookies[n])
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(1000 * (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return (len(latencies) / elapsed, latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.95)], errors)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--upstream-latency', type=float, default=0.2)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--requests-per-client', type=int, default=5)
+    parser.add_argument('--routes', nargs='+', choices=['api', 'prefs'], default=['api', 'prefs'])
+    args = parser.parse_args()
+
+    upstream_port, ports = 8799, {'sync': 8701, 'async': 8702}
+    upstream = await stub_newsapi(upstream_port, args.upstream_latency)
+    cookies = session_cookies(max(args.concurrency))
+
+    print(f"{args.workers} workers, upstream latency {1000 * args.upstream_latency:.0f} ms")
+    print(f"{'mode':>6}{'route':>7}{'clients':>9}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'errors':>8}")
+    for mode, port in ports.items():
+        server = start_server(mode, port, args.workers, upstream_port)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            await wait_until_up(url, cookies[0])
+            for route in args.routes:
+                for concurrency in args.concurrency:
+                    rate, p50, p95, errors = await drive(url, cookies, route, concurrency,
+                                                         args.requests_per_client, concurrency)
+                    print(f"{mode:>6}{route:>7}{concurrency:>9}{rate:>9.1f}{p50:>9.0f}"
+                          f"{p95:>9.0f}{errors:>8}")
+        finally:
+            server.terminate()
+            server.wait()
+    upstream.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
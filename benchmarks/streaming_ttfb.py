@@ -0,0 +1,106 @@
+"""Compare time to first byte for buffered and streamed page renders.
+
+Runs the app under gunicorn once with STREAM_TEMPLATES=0 and once with
+STREAM_TEMPLATES=1 against a stub News API that answers after a fixed delay,
+and times /user_home (whose feed goes upstream on every request) and
+/discover: time to the first body byte and to the whole page.
+
+    createdb courier_bench
+    python benchmarks/streaming_ttfb.py --upstream-latency 0.3
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', 'postgresql:///courier_bench')
+
+import httpx
+
+from serving_modes import stub_newsapi
+
+
+def session_cookie():
+    """Create a benchmark user following one outlet and return their session cookie."""
+    from app import create_app
+    from helpers import CURR_USER_KEY
+    from models import db, User, OutletPreferences
+
+    app = create_app('production')
+    app.app_context().push()
+    db.create_all()
+    user = User.query.filter_by(username='bench-ttfb').first()
+    if user is None:
+        user = User(username='bench-ttfb', email='bench-ttfb@example.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(OutletPreferences(user=user.id, outlet='bench-outlet'))
+        db.session.commit()
+    serializer = app.session_interface.get_signing_serializer(app)
+    return {app.config['SESSION_COOKIE_NAME']: serializer.dumps({CURR_USER_KEY: user.id})}
+
+
+def start_server(streamed, port, upstream_port):
+    env = {**os.environ, 'NEWSAPI_BASE_URL': f"http://127.0.0.1:{upstream_port}",
+           'NEWSAPI_CACHE_BACKEND': 'memory', 'NEWSAPI_HEADLINES_TTL': '0',
+           'STREAM_TEMPLATES': '1' if streamed else '0', 'NEWSAPI_QUOTA_BACKEND': 'off'}
+    cmd = ['gunicorn', '-w', '1', '-b', f"127.0.0.1:{port}", '--log-level', 'warning', 'wsgi:app']
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+
+
+async def time_page(client, url, requests):
+    """Return (median ms to first body byte, median ms to last byte) for `url`."""
+    first, total = [], []
+    for _ in range(requests):
+        start = time.perf_counter()
+        async with client.stream('GET', url) as response:
+            first_byte = None
+            async for chunk in response.aiter_raw():
+                if first_byte is None and chunk:
+                    first_byte = time.perf_counter()
+        first.append(1000 * (first_byte - start))
+        total.append(1000 * (time.perf_counter() - start))
+    first.sort()
+    total.sort()
+    return first[len(first) // 2], total[len(total) // 2]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--upstream-latency', type=float, default=0.3)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    upstream_port, port = 8798, 8703
+    upstream = await stub_newsapi(upstream_port, args.upstream_latency)
+    cookies = session_cookie()
+
+    print(f"upstream latency {1000 * args.upstream_latency:.0f} ms, median of {args.requests}")
+    print(f"{'render':>9}{'page':>12}{'ttfb ms':>10}{'total ms':>10}")
+    for streamed in (False, True):
+        server = start_server(streamed, port, upstream_port)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            async with httpx.AsyncClient(cookies=cookies, timeout=60) as client:
+                for _ in range(100):
+                    try:
+                        await client.get(f"{url}/")
+                        break
+                    except httpx.TransportError:
+                        await asyncio.sleep(0.1)
+                for page in ('/user_home', '/discover'):
+                    ttfb, total = await time_page(client, f"{url}{page}", args.requests)
+                    label = 'streamed' if streamed else 'buffered'
+                    print(f"{label:>9}{page:>12}{ttfb:>10.1f}{total:>10.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+    upstream.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
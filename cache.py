@@ -0,0 +1,190 @@
+"""Response caches for News API lookups."""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Query parameters whose values are case-insensitive codes or comma separated lists.
+LIST_PARAMS = ('sources', 'country', 'category', 'domains', 'excludeDomains')
+
+
+def normalize_value(name, value):
+    """Return a canonical string for one query parameter value."""
+    if isinstance(value, (list, tuple, set)):
+        values = [str(v) for v in value]
+    elif name in LIST_PARAMS:
+        values = str(value).split(',')
+    else:
+        return str(value)
+    values = sorted({v.strip().lower() for v in values if v and v.strip()})
+    return ','.join(values)
+
+
+def cache_key(endpoint, params=None):
+    """Build a cache key that is stable across param order and list order.
+
+    `sources=bbc,cnn` and `sources=cnn,bbc` (or the same values passed as a
+    list) produce the same key, and params with empty values are dropped.
+    """
+    parts = []
+    for name in sorted(params or {}):
+        value = params[name]
+        if value is None or value == '' or value == []:
+            continue
+        parts.append(f"{name}={normalize_value(name, value)}")
+    return f"{endpoint}?{'&'.join(parts)}"
+
+
+def sqlite_connector(path, synchronous='NORMAL'):
+    """Return a function that opens `path` in WAL mode, once per thread and process.
+
+    SQLite connections can't be shared between threads or carried over a
+    fork, so every gunicorn worker and thread gets its own.
+    """
+    local = threading.local()
+
+    def connect():
+        conn = getattr(local, 'conn', None)
+        if conn is None or getattr(local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            if synchronous:
+                conn.execute(f"PRAGMA synchronous={synchronous}")
+            local.conn = conn
+            local.pid = os.getpid()
+        return conn
+    return connect
+
+
+class MemoryCache:
+    """In-process LRU cache with per-entry expiry.
+
+    Expired entries are kept for another `max_stale` seconds, for `get_stale`.
+    Values are returned as stored, so callers must treat them as read-only.
+    """
+
+    def __init__(self, max_entries=1024, max_stale=0):
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            now = time.time()
+            if entry is None or entry[0] <= now:
+                if entry is not None and entry[0] + self.max_stale <= now:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def get_stale(self, key, max_stale=None):
+        """Return an entry even if it expired less than `max_stale` seconds ago.
+
+        `max_stale` defaults to, and can't be more than, the cache's own.
+        """
+        max_stale = self.max_stale if max_stale is None else min(max_stale, self.max_stale)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] + max_stale <= time.time():
+                return None
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """LRU cache with per-entry expiry kept in a SQLite file.
+
+    Every gunicorn worker on a host can point at the same file, so a response
+    fetched by one worker is served by all of them. Expired entries are kept
+    for another `max_stale` seconds, for `get_stale`.
+    """
+
+    def __init__(self, path, max_entries=1024, max_stale=0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_stale = max_stale
+        self.hits = 0
+        self.misses = 0
+        self._connect = sqlite_connector(path)
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+                                key TEXT PRIMARY KEY,
+                                value TEXT NOT NULL,
+                                expires_at REAL NOT NULL,
+                                accessed_at REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)")
+
+    def get(self, key):
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute("SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                           (key, now)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def get_stale(self, key, max_stale=None):
+        """Return an entry even if it expired less than `max_stale` seconds ago.
+
+        `max_stale` defaults to, and can't be more than, the cache's own.
+        """
+        max_stale = self.max_stale if max_stale is None else min(max_stale, self.max_stale)
+        row = self._connect().execute("SELECT value FROM cache WHERE key = ? AND expires_at > ?",
+                                      (key, time.time() - max_stale)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, ttl):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) "
+                     "VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(value, separators=(',', ':')), now + ttl, now))
+        conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache "
+                     "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        self._connect().execute("DELETE FROM cache")
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+
+def make_cache(backend, max_entries, path=None, max_stale=0):
+    """Build the cache backend named in config."""
+    if backend == 'memory':
+        return MemoryCache(max_entries=max_entries, max_stale=max_stale)
+    if backend == 'sqlite':
+        return SQLiteCache(path, max_entries=max_entries, max_stale=max_stale)
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,122 @@
+"""Local News API sources catalog for Courier app."""
+import json
+import os
+import threading
+import time
+
+from config import SOURCES_CATALOG_PATH, SOURCES_CATALOG_REFRESH, SOURCES_CATALOG_RETRY
+from quota import BACKGROUND
+
+SOURCE_FIELDS = ('id', 'name', 'description', 'url', 'category', 'language', 'country')
+
+
+class SourcesCatalog:
+    """Every News API source, kept in a compact JSON file and indexed in memory.
+
+    `/top-headlines/sources` with no filters returns the whole catalog, so one
+    upstream call is enough to answer any country or category filter locally.
+    The file is rewritten by `refresh`, either from the `flask refresh-sources`
+    command or in the background once it is older than `max_age` seconds.
+    Background refreshes are at least `retry_after` seconds apart, so an
+    upstream outage doesn't turn every page view into another full fetch.
+    """
+
+    def __init__(self, path=SOURCES_CATALOG_PATH, max_age=SOURCES_CATALOG_REFRESH,
+                 retry_after=SOURCES_CATALOG_RETRY):
+        self.path = path
+        self.max_age = max_age
+        self.retry_after = retry_after
+        self.fetched_at = 0
+        self.attempted_at = 0
+        self.sources = []
+        self._by_country = {}
+        self._by_category = {}
+        self._mtime = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _index(self, sources, fetched_at):
+        by_country = {}
+        by_category = {}
+        for source in sources:
+            by_country.setdefault(source.get('country'), []).append(source)
+            by_category.setdefault(source.get('category'), []).append(source)
+        self.sources = sources
+        self._by_country = by_country
+        self._by_category = by_category
+        self.fetched_at = fetched_at
+
+    def load(self):
+        """Load the catalog file if it changed on disk since the last load."""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return True
+        with open(self.path) as f:
+            catalog = json.load(f)
+        with self._lock:
+            self._index(catalog['sources'], catalog['fetched_at'])
+            self._mtime = mtime
+        return True
+
+    def refresh(self, client):
+        """Fetch the full catalog from upstream and rewrite the local file.
+
+        Returns the number of sources stored, or None if the upstream call failed.
+        """
+        data = client.fetch('/top-headlines/sources', priority=BACKGROUND)
+        if data.get('status') != 'ok':
+            return None
+        sources = [{field: source.get(field) for field in SOURCE_FIELDS}
+                   for source in data.get('sources', [])]
+        catalog = {'fetched_at': time.time(), 'sources': sources}
+
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(catalog, f, separators=(',', ':'))
+        os.replace(tmp_path, self.path)
+        with self._lock:
+            self._index(sources, catalog['fetched_at'])
+            self._mtime = os.path.getmtime(self.path)
+        return len(sources)
+
+    def is_ready(self, client=None):
+        """Return True if the catalog can answer lookups.
+
+        Picks up a newer file written by another process, and starts a
+        background refresh through `client` when the catalog is stale.
+        """
+        self.load()
+        if client is not None and time.time() - self.fetched_at > self.max_age:
+            self._refresh_in_background(client)
+        return bool(self.sources)
+
+    def _refresh_in_background(self, client):
+        with self._lock:
+            if self._refreshing or time.time() - self.attempted_at < self.retry_after:
+                return
+            self._refreshing = True
+            self.attempted_at = time.time()
+
+        def run():
+            try:
+                self.refresh(client)
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='sources-catalog-refresh', daemon=True).start()
+
+    def by_country(self, country):
+        return self._by_country.get(country, [])
+
+    def by_category(self, category):
+        return self._by_category.get(category, [])
+
+    def for_countries(self, countries):
+        """Return sources for several countries, in the order given."""
+        sources = []
+        for country in countries:
+            sources.extend(self.by_country(country))
+        return sources
@@ -0,0 +1,68 @@
+"""Response compression for Courier app's JSON endpoints.
+
+gzip is always available; brotli is used when the optional `brotli` package
+is installed and the client accepts it.
+"""
+import gzip
+
+from config import COMPRESS_MIN_SIZE, COMPRESS_GZIP_LEVEL, COMPRESS_BROTLI_QUALITY
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def accepted_encodings(header):
+    """Return the content codings an Accept-Encoding header allows."""
+    encodings = set()
+    for token in (header or '').split(','):
+        name, *params = token.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name.strip() and quality > 0:
+            encodings.add(name.strip().lower())
+    return encodings
+
+
+def choose_encoding(accept_encoding, size):
+    """Pick the coding for a `size` byte body, or None to send it as is."""
+    if size < COMPRESS_MIN_SIZE:
+        return None
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESS_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESS_GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, accept_encoding):
+    """Compress a buffered JSON Flask response in place if the client accepts it."""
+    if (response.direct_passthrough or response.is_streamed or response.status_code != 200
+            or response.mimetype != 'application/json' or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    encoding = choose_encoding(accept_encoding, len(body))
+    if encoding is None:
+        return response
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    # the bytes differ per coding, so the tag can only claim semantic equivalence
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
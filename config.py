@@ -1,3 +1,37 @@
+import os
+
+
+class Config:
+    """Settings shared by every environment."""
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///courier_capstone'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ECHO = False
+    SECRET_KEY = os.environ.get('SECRET_KEY', "fjrgjfgoij34389792fruhg")
+    # Send /user_home and /discover while the template renders instead of all at once.
+    STREAM_TEMPLATES = os.environ.get('STREAM_TEMPLATES', '1') != '0'
+
+
+class ProductionConfig(Config):
+    pass
+
+
+class DevelopmentConfig(Config):
+    SQLALCHEMY_ECHO = True
+
+
+class TestingConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'postgresql:///capstone_1_test'
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+
+
+# Picked by create_app from its argument or COURIER_ENV; DATABASE_URL overrides the db.
+config_profiles = {
+    'production': ProductionConfig,
+    'development': DevelopmentConfig,
+    'testing': TestingConfig,
+}
+
 categories = ['business','entertainment','general','health','science','sports','technology']
 
 supported_countries = [("Argentina","ar"),("Greece", "gr"),("Netherlands","nl"),("South Africa","za"),("Australia","au"),("Hong Kong","hk"),("New Zealand","nz"),("South Korea","kr")
@@ -37,3 +71,126 @@ supported_countries = [("Argentina","ar"),("Greece", "gr"),("Netherlands","nl"),
                        ("Germany","de"),
                        ("Morocco","ma"),
                        ("Slovenia","si")]
+
+# News API client settings; override with environment variables per deployment.
+NEWSAPI_BASE_URL = os.environ.get('NEWSAPI_BASE_URL', 'https://newsapi.org/v2')
+NEWSAPI_POOL_SIZE = int(os.environ.get('NEWSAPI_POOL_SIZE', 20))
+NEWSAPI_CONNECT_TIMEOUT = float(os.environ.get('NEWSAPI_CONNECT_TIMEOUT', 3.05))
+NEWSAPI_READ_TIMEOUT = float(os.environ.get('NEWSAPI_READ_TIMEOUT', 10))
+NEWSAPI_RETRIES = int(os.environ.get('NEWSAPI_RETRIES', 2))
+NEWSAPI_BACKOFF = float(os.environ.get('NEWSAPI_BACKOFF', 0.3))
+
+# Response cache in front of the News API. 'memory' is per worker; 'sqlite' is
+# shared by every worker on the host through NEWSAPI_CACHE_PATH.
+NEWSAPI_CACHE_BACKEND = os.environ.get('NEWSAPI_CACHE_BACKEND', 'memory')
+NEWSAPI_CACHE_PATH = os.environ.get('NEWSAPI_CACHE_PATH', '/tmp/courier-newsapi-cache.sqlite3')
+NEWSAPI_CACHE_MAX_ENTRIES = int(os.environ.get('NEWSAPI_CACHE_MAX_ENTRIES', 2048))
+# Expired responses are kept this long, to answer requests when the News API is down,
+# erroring or over budget.
+NEWSAPI_CACHE_MAX_STALE = int(os.environ.get('NEWSAPI_CACHE_MAX_STALE', 24 * 60 * 60))
+# A response expired less than this long ago is served at once while it is refreshed
+# in the background, on NEWSAPI_REFRESH_WORKERS threads per worker.
+NEWSAPI_STALE_WHILE_REVALIDATE = int(os.environ.get('NEWSAPI_STALE_WHILE_REVALIDATE', 10 * 60))
+NEWSAPI_REFRESH_WORKERS = int(os.environ.get('NEWSAPI_REFRESH_WORKERS', 2))
+NEWSAPI_CACHE_TTLS = {
+    '/top-headlines': int(os.environ.get('NEWSAPI_HEADLINES_TTL', 300)),
+    '/top-headlines/sources': int(os.environ.get('NEWSAPI_SOURCES_TTL', 6 * 60 * 60)),
+}
+
+# Request budget for the News API plan: a token bucket of NEWSAPI_RATE_LIMIT requests
+# per second (bursting to NEWSAPI_RATE_BURST) and NEWSAPI_DAILY_QUOTA requests per UTC
+# day. 'sqlite' shares the budget between every worker on the host; 'off' removes it.
+# Background work leaves NEWSAPI_BACKGROUND_RESERVE of both for page views, and a page
+# view waits at most NEWSAPI_QUOTA_MAX_WAIT seconds for a token.
+NEWSAPI_QUOTA_BACKEND = os.environ.get('NEWSAPI_QUOTA_BACKEND', 'sqlite')
+NEWSAPI_QUOTA_PATH = os.environ.get('NEWSAPI_QUOTA_PATH', '/tmp/courier-newsapi-quota.sqlite3')
+NEWSAPI_RATE_LIMIT = float(os.environ.get('NEWSAPI_RATE_LIMIT', 5))
+NEWSAPI_RATE_BURST = int(os.environ.get('NEWSAPI_RATE_BURST', 10))
+NEWSAPI_DAILY_QUOTA = int(os.environ.get('NEWSAPI_DAILY_QUOTA', 1000))
+NEWSAPI_BACKGROUND_RESERVE = float(os.environ.get('NEWSAPI_BACKGROUND_RESERVE', 0.2))
+NEWSAPI_QUOTA_MAX_WAIT = float(os.environ.get('NEWSAPI_QUOTA_MAX_WAIT', 0.5))
+
+# Concurrent lookups fanned out from one request (e.g. sources for many countries).
+NEWSAPI_FANOUT_WORKERS = int(os.environ.get('NEWSAPI_FANOUT_WORKERS', 8))
+NEWSAPI_FANOUT_DEADLINE = float(os.environ.get('NEWSAPI_FANOUT_DEADLINE', 5))
+
+# Local copy of the full /top-headlines/sources catalog used by the preference pages.
+SOURCES_CATALOG_PATH = os.environ.get('SOURCES_CATALOG_PATH', 'sources_catalog.json')
+SOURCES_CATALOG_REFRESH = int(os.environ.get('SOURCES_CATALOG_REFRESH', 24 * 60 * 60))
+# How long a worker waits after a failed background refresh before trying again.
+SOURCES_CATALOG_RETRY = int(os.environ.get('SOURCES_CATALOG_RETRY', 5 * 60))
+
+# Background headline ingestion (flask ingest-headlines).
+INGEST_INTERVAL = int(os.environ.get('INGEST_INTERVAL', 10 * 60))
+# Stories older than this are not trusted on the request path; routes go upstream instead.
+INGEST_MAX_AGE = int(os.environ.get('INGEST_MAX_AGE', 30 * 60))
+INGEST_PAGE_SIZE = int(os.environ.get('INGEST_PAGE_SIZE', 100))
+
+# Browser caching of JSON responses, as (max-age, stale-while-revalidate) seconds.
+HEADLINES_HTTP_CACHE = (int(os.environ.get('HEADLINES_MAX_AGE', 60)),
+                        int(os.environ.get('HEADLINES_STALE_WHILE_REVALIDATE', 240)))
+SOURCES_HTTP_CACHE = (int(os.environ.get('SOURCES_MAX_AGE', 60 * 60)),
+                      int(os.environ.get('SOURCES_STALE_WHILE_REVALIDATE', 24 * 60 * 60)))
+
+# JSON responses at least this many bytes are gzip (or brotli, if installed) compressed.
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 500))
+COMPRESS_GZIP_LEVEL = int(os.environ.get('COMPRESS_GZIP_LEVEL', 6))
+COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY', 5))
+
+# Home feed pagination: /user_home renders the first page, /api/feed serves the rest.
+FEED_PAGE_SIZE = int(os.environ.get('FEED_PAGE_SIZE', 10))
+FEED_MAX_PAGE_SIZE = int(os.environ.get('FEED_MAX_PAGE_SIZE', 50))
+
+# Home feed ranking: a story scores RANK_RECENCY_WEIGHT when just published (halving
+# every RANK_HALF_LIFE seconds), plus up to RANK_OUTLET_WEIGHT and RANK_TAG_WEIGHT for
+# how much of the user's last RANK_MAX_LIKES likes went to its outlet and content tags.
+RANK_RECENCY_WEIGHT = float(os.environ.get('RANK_RECENCY_WEIGHT', 1.0))
+RANK_HALF_LIFE = float(os.environ.get('RANK_HALF_LIFE', 6 * 60 * 60))
+RANK_OUTLET_WEIGHT = float(os.environ.get('RANK_OUTLET_WEIGHT', 0.5))
+RANK_TAG_WEIGHT = float(os.environ.get('RANK_TAG_WEIGHT', 1.0))
+RANK_MAX_LIKES = int(os.environ.get('RANK_MAX_LIKES', 200))
+
+# Near-duplicate stories: two stories whose MinHash signatures agree on at least
+# DEDUP_THRESHOLD of their hashes are one story, if fetched within DEDUP_WINDOW seconds.
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.5))
+DEDUP_WINDOW = int(os.environ.get('DEDUP_WINDOW', 2 * 24 * 60 * 60))
+
+# Article images are served through /img as THUMBNAIL_WIDTH pixel wide WebP (or JPEG)
+# thumbnails, kept in a THUMBNAIL_CACHE_MAX_BYTES LRU in THUMBNAIL_CACHE_DIR that every
+# worker on the host shares. Proxy URLs are signed with IMAGE_PROXY_SECRET so /img
+# only fetches images our own pages link to; without it, pages link the publishers'
+# images directly and /img serves nothing.
+THUMBNAIL_WIDTH = int(os.environ.get('THUMBNAIL_WIDTH', 800))
+THUMBNAIL_CACHE_DIR = os.environ.get('THUMBNAIL_CACHE_DIR', '/tmp/courier-thumbnails')
+THUMBNAIL_CACHE_MAX_BYTES = int(os.environ.get('THUMBNAIL_CACHE_MAX_BYTES', 1024 ** 3))
+THUMBNAIL_MAX_AGE = int(os.environ.get('THUMBNAIL_MAX_AGE', 365 * 24 * 60 * 60))
+# Remote images bigger than this aren't fetched; the browser is sent to the original.
+THUMBNAIL_MAX_SOURCE_BYTES = int(os.environ.get('THUMBNAIL_MAX_SOURCE_BYTES', 20 * 1024 ** 2))
+THUMBNAIL_FETCH_TIMEOUT = float(os.environ.get('THUMBNAIL_FETCH_TIMEOUT', 5))
+# How long an image that couldn't be fetched or read is sent to the original instead.
+THUMBNAIL_FAILURE_TTL = int(os.environ.get('THUMBNAIL_FAILURE_TTL', 10 * 60))
+IMAGE_PROXY_SECRET = os.environ.get('IMAGE_PROXY_SECRET')
+
+# /search pages past this one aren't offered.
+SEARCH_MAX_PAGE = int(os.environ.get('SEARCH_MAX_PAGE', 20))
+# Only this many of a query's newest matches are ranked, so a common word
+# doesn't rank the whole table.
+SEARCH_RANK_WINDOW = int(os.environ.get('SEARCH_RANK_WINDOW', 2000))
+
+# Slim per-user profile (id, username, image, preference lists) cached across requests.
+PROFILE_CACHE_BACKEND = os.environ.get('PROFILE_CACHE_BACKEND', NEWSAPI_CACHE_BACKEND)
+PROFILE_CACHE_PATH = os.environ.get('PROFILE_CACHE_PATH', '/tmp/courier-profile-cache.sqlite3')
+PROFILE_CACHE_MAX_ENTRIES = int(os.environ.get('PROFILE_CACHE_MAX_ENTRIES', 10000))
+PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 60))
+
+# Password hashing. Raising BCRYPT_LOG_ROUNDS rehashes each user's password on their next login.
+BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+BCRYPT_WORKERS = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 2))
+BCRYPT_QUEUE_DEPTH = int(os.environ.get('BCRYPT_QUEUE_DEPTH', 32))
+BCRYPT_QUEUE_TIMEOUT = float(os.environ.get('BCRYPT_QUEUE_TIMEOUT', 0.5))
+
+# Threads that run Flask views in the async (uvicorn) serving mode.
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+
+# Requests taking at least this many seconds are logged with their db/upstream/render breakdown.
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 1.0))
@@ -0,0 +1,186 @@
+"""Near-duplicate detection across outlets, with MinHash and LSH.
+
+The same wire story runs in many outlets with slightly different titles.
+Each ingested story gets a MinHash signature of its title and description
+shingles, cut into LSH bands whose keys are stored in `stories.lsh_bands`
+behind a GIN index. A new story only compares its signature with the
+stories that share a band key with it, found through the index, so checking
+it doesn't depend on how many stories there are. Stories whose signatures
+agree on at least DEDUP_THRESHOLD of their hashes (an estimate of the
+Jaccard similarity of their shingles) and come from different outlets join
+the same cluster, named by the id of its first story. One outlet's similar
+stories are usually updates, not copies, and are left apart.
+
+Feeds show one card per cluster, for its best ranked story, listing the
+other outlets that covered it.
+"""
+import re
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import literal
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from config import DEDUP_THRESHOLD, DEDUP_WINDOW
+from models import db, Story
+
+SHINGLE_SIZE = 5
+# 16 bands of 4 rows put the LSH threshold near a Jaccard similarity of 0.5.
+BANDS = 16
+ROWS = 4
+NUM_HASHES = BANDS * ROWS
+# Hashes are a * x + b mod a Mersenne prime, with coefficients fixed so that
+# signatures stored by one process compare with those of another.
+PRIME = (1 << 31) - 1
+_coefficients = np.random.RandomState(20240101).randint(1, PRIME, size=(2, NUM_HASHES, 1),
+                                                        dtype=np.int64)
+HASH_A, HASH_B = _coefficients
+# News API titles often end in " - Outlet Name".
+OUTLET_SUFFIX = re.compile(r'\s+[-|]\s+[^-|]+$')
+NON_WORD = re.compile(r'\W+')
+
+
+def shingles(title, description=None):
+    """The set of character shingles of a story's normalized title and description."""
+    text = ' '.join([OUTLET_SUFFIX.sub('', title or ''), description or ''])
+    text = NON_WORD.sub(' ', text.lower()).strip()
+    if len(text) <= SHINGLE_SIZE:
+        return {text} if text else set()
+    return {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+
+
+def minhash(shingle_set):
+    """Return the MinHash signature of a set of shingles, NUM_HASHES ints."""
+    if not shingle_set:
+        return [PRIME] * NUM_HASHES
+    x = np.fromiter((zlib.crc32(s.encode()) for s in shingle_set), dtype=np.int64,
+                    count=len(shingle_set)) % PRIME
+    return ((HASH_A * x + HASH_B) % PRIME).min(axis=1).tolist()
+
+
+def band_keys(signature):
+    """The signature's LSH band keys; the band number is in the high bits."""
+    return [(band << 32) | zlib.crc32(np.array(signature[band * ROWS:(band + 1) * ROWS],
+                                               dtype=np.int64).tobytes())
+            for band in range(BANDS)]
+
+
+def similarity(a, b):
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(np.asarray(a) == np.asarray(b)))
+
+
+class MinHashIndex:
+    """Signatures by LSH band key, for finding near duplicates as they arrive."""
+
+    def __init__(self):
+        self.signatures = {}
+        self.outlets = {}
+        self.clusters = {}
+        self.buckets = {}
+
+    def add(self, key, signature, bands, outlet, cluster=None):
+        self.signatures[key] = signature
+        self.outlets[key] = outlet
+        self.clusters[key] = cluster or key
+        for band in bands:
+            self.buckets.setdefault(band, []).append(key)
+
+    def match(self, signature, bands, outlet):
+        """Return the cluster of the most similar indexed signature, or None.
+
+        Only signatures sharing a band are compared, and only those from
+        another outlet at least DEDUP_THRESHOLD similar count.
+        """
+        best, best_similarity = None, DEDUP_THRESHOLD
+        candidates = {key for band in bands for key in self.buckets.get(band, ())}
+        for key in sorted(candidates):
+            if outlet is not None and self.outlets[key] == outlet:
+                continue
+            candidate_similarity = similarity(signature, self.signatures[key])
+            if candidate_similarity >= best_similarity:
+                best, best_similarity = key, candidate_similarity
+        return None if best is None else self.clusters[best]
+
+
+def cluster_stories(story_ids):
+    """Sign the given stories and put each into its near duplicates' cluster.
+
+    Candidates are recent stories (fetched in the last DEDUP_WINDOW seconds)
+    from other outlets sharing an LSH band with the story, including the
+    earlier ones of the given stories, taken in order. A story keeps its
+    cluster while its text doesn't change. Returns the number of stories that
+    joined another story's cluster. Does not commit.
+    """
+    if not story_ids:
+        return 0
+    stories = db.session.execute(
+        db.select(Story.id, Story.title, Story.description, Story.outlet, Story.minhash,
+                  Story.cluster)
+        .where(Story.id.in_(story_ids)).order_by(Story.id)).all()
+    signed = []
+    for story in stories:
+        signature = minhash(shingles(story.title, story.description))
+        if signature != story.minhash or story.cluster is None:
+            signed.append((story.id, signature, band_keys(signature), story.outlet))
+    if not signed:
+        return 0
+
+    index = MinHashIndex()
+    keys = sorted({band for _, _, bands, _ in signed for band in bands})
+    cutoff = datetime.utcnow() - timedelta(seconds=DEDUP_WINDOW)
+    for story_id, signature, bands, outlet, cluster in db.session.execute(
+            db.select(Story.id, Story.minhash, Story.lsh_bands, Story.outlet, Story.cluster)
+            .where(Story.lsh_bands.overlap(literal(keys, ARRAY(db.BigInteger))),
+                   Story.fetched_at >= cutoff, Story.id.not_in([row[0] for row in signed]))):
+        index.add(story_id, signature, bands, outlet, cluster)
+
+    rows, joined = [], 0
+    for story_id, signature, bands, outlet in signed:
+        cluster = index.match(signature, bands, outlet)
+        joined += cluster is not None
+        cluster = story_id if cluster is None else cluster
+        index.add(story_id, signature, bands, outlet, cluster)
+        rows.append({'id': story_id, 'minhash': signature, 'lsh_bands': bands, 'cluster': cluster})
+    db.session.execute(db.update(Story), rows)
+    return joined
+
+
+def backfill_clusters():
+    """Cluster recent stories that were ingested before clustering existed. Does not commit."""
+    cutoff = datetime.utcnow() - timedelta(seconds=DEDUP_WINDOW)
+    cluster_stories(db.session.scalars(
+        db.select(Story.id).where(Story.minhash.is_(None), Story.fetched_at >= cutoff)).all())
+
+
+def collapse_duplicates(stories):
+    """Group stories by cluster, keeping the order of each cluster's first story.
+
+    Returns a list of (story, duplicates) pairs.
+    """
+    groups = {}
+    for story in stories:
+        groups.setdefault(story.cluster or story.id, []).append(story)
+    return [(group[0], group[1:]) for group in groups.values()]
+
+
+def deduplicated_headlines(stories):
+    """Wrap stories in a /top-headlines body with one article per cluster.
+
+    An article whose story other outlets also covered gains an
+    `alsoCoveredBy` list of their names and URLs.
+    """
+    articles = []
+    for story, duplicates in collapse_duplicates(stories):
+        article = story.to_article()
+        seen = {story.outlet}
+        also = []
+        for duplicate in duplicates:
+            if duplicate.outlet not in seen:
+                seen.add(duplicate.outlet)
+                also.append({'name': duplicate.source.name, 'url': duplicate.url})
+        if also:
+            article['alsoCoveredBy'] = also
+        articles.append(article)
+    return {'status': 'ok', 'totalResults': len(articles), 'articles': articles}
@@ -0,0 +1,106 @@
+"""Materialized per-user home feeds.
+
+A user's feed is stored as a short list of story ids, newest first, that
+point into the shared `stories` table. It is built from the local store the
+first time it is needed or when the user's outlets change, and new stories
+are merged into the feeds of everyone following their outlet as they are
+ingested (fan-out on write). Loading a home page is then one lookup by user
+id, which also brings back the user's likes, and one batch fetch of the
+stories, which are ranked for the user and
+collapsed to one card per near-duplicate cluster on the way out (see
+ranking.py and dedup.py).
+"""
+from datetime import datetime
+
+from sqlalchemy import and_, any_, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import contains_eager
+
+from ingest import fresh_cutoff, local_stories
+from models import db, Story, Outlet, OutletPreferences, UserFeed
+from ranking import rank_stories, user_likes, parse_likes
+from dedup import deduplicated_headlines
+
+# Matches the 50 stories a home feed gets from upstream.
+FEED_LENGTH = 50
+
+
+def load_feed(user_id, sources=None):
+    """Return the user's ranked home feed as a News API style body, or None.
+
+    A stored feed is used while the ingester keeps it fresh and, if `sources`
+    is given, while it was built for those outlets. Otherwise it is rebuilt
+    from `sources`; None means the local store can't answer (see
+    `local_stories`) or no `sources` were given to rebuild from.
+    """
+    # the user's likes come back with the feed row, so ranking costs no extra round trip
+    feed, likes = db.session.execute(
+        db.select(UserFeed, user_likes(user_id)).where(UserFeed.user == user_id)
+    ).first() or (None, None)
+    if (feed is not None and feed.built_at >= fresh_cutoff()
+            and (sources is None or feed.sources == sorted(sources))):
+        stories = feed_stories(feed.story_ids)
+        return deduplicated_headlines(rank_stories(user_id, stories, parse_likes(likes)))
+    if sources is None:
+        return None
+    return build_feed(user_id, sources)
+
+
+def build_feed(user_id, sources):
+    """Rebuild and store the user's feed from the local store, and return it ranked.
+
+    Returns None, dropping any stored feed, if the store has nothing fresh
+    for one of `sources`. Commits.
+    """
+    stories = local_stories(sources=sources, limit=FEED_LENGTH)
+    if stories is None:
+        db.session.execute(db.delete(UserFeed).where(UserFeed.user == user_id))
+    else:
+        values = {'sources': sorted(sources), 'story_ids': [story.id for story in stories],
+                  'built_at': datetime.utcnow()}
+        stmt = insert(UserFeed).values(user=user_id, **values)
+        db.session.execute(stmt.on_conflict_do_update(index_elements=['user'], set_=values))
+    db.session.commit()
+    return None if stories is None else deduplicated_headlines(rank_stories(user_id, stories))
+
+
+def feed_stories(story_ids):
+    """Fetch stories by id in one query, in the order given.
+
+    Ids of stories that have since been deleted are skipped.
+    """
+    stories = (Story.query.join(Outlet, Story.outlet == Outlet.id)
+               .options(contains_eager(Story.source))
+               .filter(Story.id.in_(story_ids)).all())
+    by_id = {story.id: story for story in stories}
+    return [by_id[story_id] for story_id in story_ids if story_id in by_id]
+
+
+def fan_out(story_ids):
+    """Merge just-written stories into the stored feeds of their outlets' followers.
+
+    Each affected feed is re-sorted over its current ids plus the new ones it
+    should show, and cut back to FEED_LENGTH, so the cost depends on the
+    stories written and not on how many stories the outlets have. Feeds that
+    were never built are left alone; they are built when first loaded.
+    Returns the number of feeds updated. Does not commit.
+    """
+    if not story_ids:
+        return 0
+    followed = (db.select(Outlet.id)
+                .join(OutletPreferences, OutletPreferences.outlet == Outlet.source_id)
+                .where(OutletPreferences.user == UserFeed.user)
+                .correlate(UserFeed))
+    merged = (db.select(Story.id)
+              .where(or_(Story.id == any_(UserFeed.story_ids),
+                         and_(Story.id.in_(story_ids), Story.outlet.in_(followed))))
+              .order_by(Story.date.desc().nullslast(), Story.id.desc())
+              .limit(FEED_LENGTH))
+    followers = (db.select(OutletPreferences.user)
+                 .join(Outlet, OutletPreferences.outlet == Outlet.source_id)
+                 .join(Story, Story.outlet == Outlet.id)
+                 .where(Story.id.in_(story_ids)))
+    return db.session.execute(
+        db.update(UserFeed).where(UserFeed.user.in_(followers))
+        .values(story_ids=func.array(merged.scalar_subquery()), built_at=datetime.utcnow())
+    ).rowcount
@@ -1,7 +1,17 @@
-from models import User, db
-from flask import flash, render_template, redirect, session
+import hashlib
+import hmac
+from functools import lru_cache
+from urllib.parse import urlencode
+
+from models import User, db, CountryPreferences, OutletPreferences
+from passwords import PasswordQueueFull
+from flask import flash, render_template, redirect, session, request, jsonify
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
 
+from config import IMAGE_PROXY_SECRET, THUMBNAIL_WIDTH
+
 CURR_USER_KEY = "curr_user"
 
 
@@ -14,6 +24,9 @@ def signUpNewUser(form):
                 image_url=form.image_url.data,
             )
         db.session.commit()
+    except PasswordQueueFull:
+        flash("We're signing up a lot of people right now. Please try again in a moment.", 'warning')
+        return render_template('signup.html', form=form)
     except IntegrityError as e:
         error_info = str(e.orig)
         if "unique constraint" in error_info.lower():
@@ -28,8 +41,14 @@ def signUpNewUser(form):
 
 
 def handle_login(form):
-    user = User.authenticate(form.username.data, form.password.data)
+    try:
+        user = User.authenticate(form.username.data, form.password.data)
+    except PasswordQueueFull:
+        flash("We're handling a lot of logins right now. Please try again in a moment.", 'warning')
+        return render_template('login.html', form=form), 503
     if user:
+        # saves the password if it was rehashed at a new cost
+        db.session.commit()
         do_login(user)
         flash(f"Hello, {user.username}!", "success")
         return redirect("/user_home")
@@ -38,6 +57,162 @@ def handle_login(form):
         return redirect('/login')
 
 
+def image_signature(url, width):
+    """The signature that lets /img fetch `url` at `width`, or None without IMAGE_PROXY_SECRET."""
+    if not IMAGE_PROXY_SECRET:
+        return None
+    return _signature(IMAGE_PROXY_SECRET, url, width)
+
+
+def _signature(secret, url, width):
+    message = f"{width}:{url}".encode()
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()[:32]
+
+
+def thumbnail_url(url, width=THUMBNAIL_WIDTH):
+    """Return the /img URL of a card-width thumbnail of a remote image.
+
+    Anything that isn't an http(s) URL, including a URL this already made, is
+    returned unchanged, as is every URL when IMAGE_PROXY_SECRET isn't set.
+    """
+    if not IMAGE_PROXY_SECRET or not url or not url.startswith(('http://', 'https://')):
+        return url
+    return _signed_thumbnail_url(IMAGE_PROXY_SECRET, url, width)
+
+
+# Every feed response links the same few thousand images again, so each is signed once.
+@lru_cache(maxsize=16384)
+def _signed_thumbnail_url(secret, url, width):
+    return '/img?' + urlencode({'u': url, 'w': width, 's': _signature(secret, url, width)})
+
+
+def slim_article(article):
+    """Keep only the article fields the templates render.
+
+    `urlToImage` becomes the image's thumbnail URL.
+    """
+    slim = {
+        'source': {'name': (article.get('source') or {}).get('name')},
+        'title': article.get('title'),
+        'description': article.get('description'),
+        'url': article.get('url'),
+        'urlToImage': thumbnail_url(article.get('urlToImage')),
+    }
+    # feeds list the other outlets that ran a near-duplicate story; see dedup.py
+    if article.get('alsoCoveredBy'):
+        slim['alsoCoveredBy'] = article['alsoCoveredBy']
+    return slim
+
+
+def slim_headlines(data):
+    """Project a /top-headlines body down to what the article cards use.
+
+    Drops `content`, `author`, `publishedAt` and the source id, which no
+    template reads. Error bodies are returned unchanged.
+    """
+    if data.get('status') != 'ok':
+        return data
+    return {**data, 'articles': [slim_article(article) for article in data.get('articles', [])]}
+
+
+def is_ok(data):
+    """True if `data` (a News API style body, or a list of them) has no errors."""
+    if isinstance(data, list):
+        return all(is_ok(item) for item in data)
+    return data.get('status') == 'ok'
+
+
+def body_etag(body):
+    """A strong ETag for a serialized response body."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def cache_control(max_age, stale_while_revalidate):
+    # private: the body depends on who is logged in, so shared caches must not keep it
+    return f"private, max-age={max_age}, stale-while-revalidate={stale_while_revalidate}"
+
+
+def cacheable_json(data, http_cache):
+    """Return `data` as a JSON response the browser can reuse.
+
+    `http_cache` is a (max-age, stale-while-revalidate) pair. The ETag hashes
+    the serialized body, whose keys are sorted, so the same data always gets
+    the same tag and a request whose If-None-Match matches gets an empty 304.
+    Error bodies are sent with no-store so a failed upstream call isn't reused.
+    """
+    response = jsonify(data)
+    if not is_ok(data):
+        response.cache_control.no_store = True
+        return response
+    response.set_etag(body_etag(response.get_data()))
+    response.headers['Cache-Control'] = cache_control(*http_cache)
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
+
+
+def feed_page(data, page, page_size):
+    """Return one page of a News API style body.
+
+    The articles are cut down to page `page` (counting from 1) and the body
+    gains `page`, `pageSize` and `nextPage`, which is None on the last page.
+    Error bodies are returned unchanged.
+    """
+    if data.get('status') != 'ok':
+        return data
+    articles = data.get('articles', [])
+    start = (page - 1) * page_size
+    return {
+        **data,
+        'articles': articles[start:start + page_size],
+        'page': page,
+        'pageSize': page_size,
+        'nextPage': page + 1 if start + page_size < len(articles) else None,
+    }
+
+
+class LazyPage:
+    """A feed page that is only loaded when the template first reads it.
+
+    Passed to a streamed template, this lets the header, navigation and flash
+    messages go out before the page waits on the database or the News API.
+    """
+
+    def __init__(self, load):
+        self._load = load
+        self._data = None
+
+    def __getitem__(self, key):
+        if self._data is None:
+            self._data = self._load()
+        return self._data[key]
+
+
 def do_login(user):
     """Log in user."""
-    session[CURR_USER_KEY] = user.id
\ No newline at end of file
+    session[CURR_USER_KEY] = user.id
+
+
+def update_user_preferences(user_id, countries, outlets):
+    """Save a user's country and outlet preferences as a set difference.
+
+    Only removed values are deleted and only new values are inserted, so an
+    unchanged save costs two SELECTs and a save that changes both lists costs
+    at most six statements, all in one transaction.
+    """
+    countries = list(dict.fromkeys(countries))
+    outlets = list(dict.fromkeys(outlets))
+    _sync_preferences(CountryPreferences, CountryPreferences.country, 'country', user_id, countries)
+    _sync_preferences(OutletPreferences, OutletPreferences.outlet, 'outlet', user_id, outlets)
+    db.session.commit()
+
+
+def _sync_preferences(model, column, name, user_id, values):
+    current = set(db.session.scalars(db.select(column).where(model.user == user_id)))
+    removed = current.difference(values)
+    added = [value for value in values if value not in current]
+    if removed:
+        db.session.execute(delete(model).where(model.user == user_id, column.in_(removed)))
+    if added:
+        # a concurrent save may have inserted the same row already
+        db.session.execute(insert(model).values([{'user': user_id, name: value} for value in added])
+                           .on_conflict_do_nothing())
@@ -0,0 +1,235 @@
+"""Background headline ingestion into the Story and Outlet tables."""
+import logging
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import contains_eager
+
+from config import categories, INGEST_MAX_AGE, INGEST_PAGE_SIZE
+from models import db, Story, Outlet, CountryPreferences, OutletPreferences
+from quota import BACKGROUND
+from search import story_search_vector
+from ranking import tag_stories
+from dedup import cluster_stories
+
+# The News API accepts at most 20 ids in one `sources` param.
+MAX_SOURCES_PER_CALL = 20
+# The request budget resets at midnight UTC.
+SECONDS_PER_DAY = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+def tracked_queries():
+    """Return the /top-headlines params needed to cover every user's preferences.
+
+    Followed outlets are batched into `sources` lists; every country someone
+    follows is polled once per category so /discover can be served locally.
+    """
+    outlets = sorted(row[0] for row in
+                     db.session.query(OutletPreferences.outlet).distinct() if row[0])
+    countries = sorted(row[0] for row in
+                       db.session.query(CountryPreferences.country).distinct() if row[0])
+
+    queries = []
+    for i in range(0, len(outlets), MAX_SOURCES_PER_CALL):
+        queries.append({'sources': ','.join(outlets[i:i + MAX_SOURCES_PER_CALL])})
+    for country in countries:
+        for category in categories:
+            queries.append({'country': country, 'category': category})
+    return queries
+
+
+def upsert_outlets(articles):
+    """Insert any outlets we haven't seen and return a {name: id} map."""
+    sources = {}
+    for article in articles:
+        source = article.get('source') or {}
+        if source.get('name'):
+            sources.setdefault(source['name'], source.get('id'))
+    if not sources:
+        return {}
+
+    stmt = insert(Outlet).values([{'name': name, 'source_id': source_id}
+                                  for name, source_id in sources.items()])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'source_id': func.coalesce(stmt.excluded.source_id, Outlet.source_id)})
+    db.session.execute(stmt)
+    rows = db.session.query(Outlet.name, Outlet.id).filter(Outlet.name.in_(sources)).all()
+    return dict(rows)
+
+
+def upsert_stories(articles, country=None, category=None):
+    """Bulk upsert News API articles into `stories`, deduplicated by URL.
+
+    The written stories are tagged for ranking, clustered with their near
+    duplicates and merged into the materialized feeds of users who follow
+    their outlets. Returns the number of rows written. Does not commit.
+    """
+    # feeds reads stories through this module
+    from feeds import fan_out
+
+    articles = [a for a in articles
+                if a.get('url') and a.get('title') and a['title'] != '[Removed]']
+    if not articles:
+        return 0
+    outlet_ids = upsert_outlets(articles)
+    now = datetime.utcnow()
+
+    rows = {}
+    for article in articles:
+        outlet_name = (article.get('source') or {}).get('name')
+        rows[article['url']] = {
+            'url': article['url'],
+            'title': article['title'],
+            'description': article.get('description'),
+            'author': article.get('author'),
+            'date': article.get('publishedAt'),
+            'url_to_image': article.get('urlToImage'),
+            'outlet': outlet_ids.get(outlet_name),
+            'country': country,
+            'category': category,
+            'fetched_at': now,
+            'search_vector': story_search_vector(article['title'], article.get('description'),
+                                                 article.get('author'), outlet_name),
+        }
+
+    stmt = insert(Story).values(list(rows.values()))
+    update = {column: stmt.excluded[column]
+              for column in ('title', 'description', 'author', 'date', 'url_to_image',
+                             'outlet', 'fetched_at', 'search_vector')}
+    # A story first seen through a sources query keeps a country/category
+    # learned later from a country/category query, and vice versa.
+    update['country'] = func.coalesce(stmt.excluded.country, Story.country)
+    update['category'] = func.coalesce(stmt.excluded.category, Story.category)
+    story_ids = db.session.scalars(stmt.on_conflict_do_update(index_elements=['url'], set_=update)
+                                   .returning(Story.id)).all()
+    tag_stories(story_ids)
+    cluster_stories(story_ids)
+    fan_out(story_ids)
+    return len(rows)
+
+
+def ingest_once(client):
+    """Poll every tracked query once and store the results.
+
+    Returns a dict with the number of queries made, failed, and stories stored.
+    """
+    stats = {'queries': 0, 'failed': 0, 'stories': 0}
+    for params in tracked_queries():
+        data = client.fetch('/top-headlines', params={**params, 'pageSize': INGEST_PAGE_SIZE},
+                            priority=BACKGROUND)
+        stats['queries'] += 1
+        if data.get('status') != 'ok':
+            stats['failed'] += 1
+            continue
+        stats['stories'] += upsert_stories(data.get('articles', []),
+                                           country=params.get('country'),
+                                           category=params.get('category'))
+        db.session.commit()
+    return stats
+
+
+def paced_interval(interval, queries, remaining, seconds_left):
+    """Seconds between ticks of `queries` calls, so `remaining` calls last `seconds_left`.
+
+    Never less than `interval`; with too few calls left for a whole tick,
+    ingestion waits for the budget to reset.
+    """
+    if remaining is None or not queries:
+        return interval
+    if remaining < queries:
+        return max(interval, seconds_left)
+    return max(interval, seconds_left / (remaining // queries))
+
+
+def run_forever(client, interval):
+    """Call `ingest_once` every `interval` seconds, or less often if the budget needs it.
+
+    Ticks are spaced so the background share of the day's News API budget
+    lasts until the UTC day rolls over.
+    """
+    while True:
+        started = time.monotonic()
+        queries = 0
+        try:
+            stats = ingest_once(client)
+            queries = stats['queries']
+            logger.info("Ingested %d stories from %d queries (%d failed) in %.1fs.",
+                        stats['stories'], stats['queries'], stats['failed'],
+                        time.monotonic() - started)
+        except Exception:
+            db.session.rollback()
+            logger.exception("Ingestion failed")
+        quota = getattr(client, 'quota', None)
+        remaining = quota.background_remaining() if quota is not None else None
+        seconds_left = SECONDS_PER_DAY - time.time() % SECONDS_PER_DAY
+        pause = paced_interval(interval, queries, remaining, seconds_left)
+        if pause > interval:
+            logger.info("Next ingestion in %.0fs to stay within the News API budget "
+                        "(%d background calls left today).", pause, remaining)
+        time.sleep(max(0, pause - (time.monotonic() - started)))
+
+
+def fresh_cutoff(max_age=INGEST_MAX_AGE):
+    if max_age is None:
+        return datetime.min
+    return datetime.utcnow() - timedelta(seconds=max_age)
+
+
+def local_stories(sources=None, country=None, category=None, limit=50, max_age=INGEST_MAX_AGE):
+    """Return recent ingested stories, newest first, or None.
+
+    Answers either a list of `sources` or a `country` + `category` pair. None
+    means the local store has nothing fresh for some part of the query (a
+    newly followed outlet, say), and the caller should go upstream instead.
+    With max_age=None stories of any age count as fresh.
+    """
+    query = Story.query.join(Outlet, Story.outlet == Outlet.id)
+    cutoff = fresh_cutoff(max_age)
+    if sources is not None:
+        query = query.filter(Outlet.source_id.in_(sources))
+        fresh = {source_id for source_id, latest in
+                 query.with_entities(Outlet.source_id, func.max(Story.fetched_at))
+                      .group_by(Outlet.source_id)
+                 if latest >= cutoff}
+        if not sources or fresh != set(sources):
+            return None
+    elif country and category:
+        query = query.filter(Story.country == country, Story.category == category)
+        latest = query.with_entities(func.max(Story.fetched_at)).scalar()
+        if latest is None or latest < cutoff:
+            return None
+    else:
+        return None
+
+    return (query.options(contains_eager(Story.source))
+            .order_by(Story.date.desc().nullslast(), Story.id.desc())
+            .limit(limit).all())
+
+
+def headlines_body(stories):
+    """Wrap stories in a News API style /top-headlines body."""
+    articles = [story.to_article() for story in stories]
+    return {'status': 'ok', 'totalResults': len(articles), 'articles': articles}
+
+
+def local_headlines(sources=None, country=None, category=None, limit=50, max_age=INGEST_MAX_AGE):
+    """Return `local_stories` as a News API style body, or None."""
+    stories = local_stories(sources=sources, country=country, category=category,
+                            limit=limit, max_age=max_age)
+    return None if stories is None else headlines_body(stories)
+
+
+def last_good_headlines(data, sources=None, country=None, category=None):
+    """Return `data`, or if it is an error body, whatever was last ingested for the query.
+
+    For when upstream fails and the client has no cached response to fall back on.
+    """
+    if data.get('status') == 'ok':
+        return data
+    return local_headlines(sources=sources, country=country, category=category,
+                           max_age=None) or data
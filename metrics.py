@@ -0,0 +1,281 @@
+"""Request timing and Prometheus metrics for Courier app.
+
+Each request's time is split into the phases it spends waiting on the
+database, waiting on the News API and rendering templates. Those land in
+per-route histograms, and calls that actually go upstream are counted per
+endpoint and status code; /metrics serves them all in Prometheus' text format.
+Requests slower than SLOW_REQUEST_SECONDS are logged with the breakdown.
+
+Metrics are kept per process, so each gunicorn or uvicorn worker reports the
+requests it served.
+"""
+import logging
+import threading
+import time
+
+from flask import g, has_request_context
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASES = ('db', 'upstream', 'render')
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names, values):
+    """`{name="value",...}`, or nothing for a metric without labels."""
+    labels = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return f'{{{labels}}}' if labels else ''
+
+
+class Value:
+    """A labelled counter or gauge; `kind` is the Prometheus type."""
+
+    def __init__(self, name, help, labels=(), kind='counter'):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return '\n'.join(lines)
+
+
+class Histogram:
+    """A labelled Prometheus histogram that any thread can observe into."""
+
+    def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # label values -> per-bucket counts, then the sum and the count
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels):
+        """How many values were observed with these labels."""
+        with self._lock:
+            series = self._series.get(tuple(str(labels[name]) for name in self.labels))
+            return series[-1] if series else 0
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series_list = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in series_list:
+            labels = _format_labels(self.labels, key)
+            counts = series[:len(self.buckets)] + [series[-1]]
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                bucket = _format_labels(self.labels + ('le',), key + (bound,))
+                lines.append(f'{self.name}_bucket{bucket} {count}')
+            lines.append(f'{self.name}_sum{labels} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{labels} {series[-1]}')
+        return '\n'.join(lines)
+
+
+REQUEST_SECONDS = Histogram('courier_request_duration_seconds',
+                            'Time to serve a request, until its body was sent.',
+                            ('route', 'method', 'status'))
+PHASE_SECONDS = Histogram('courier_request_phase_seconds',
+                          'Time a request spent waiting on the database, waiting on the '
+                          'News API, or rendering templates.', ('route', 'phase'))
+UPSTREAM_SECONDS = Histogram('courier_upstream_request_duration_seconds',
+                             'News API calls that went upstream, by endpoint and status.',
+                             ('endpoint', 'status'))
+UPSTREAM_DENIED = Value('courier_upstream_budget_denied_total',
+                        'News API calls not made because the request budget was spent.',
+                        ('priority',))
+BUDGET_USED = Value('courier_upstream_budget_used',
+                    'News API requests made today, across every worker sharing the budget.',
+                    kind='gauge')
+BUDGET_LIMIT = Value('courier_upstream_budget_limit', 'News API requests allowed per day.',
+                     kind='gauge')
+UPSTREAM_LOOKUPS = Value('courier_upstream_lookups_total',
+                         'News API lookups the cache could not answer fresh: calls made, calls '
+                         'that joined an identical one in flight, and stale answers refreshed in '
+                         'the background.', ('client', 'outcome'))
+UPSTREAM_POOL = Value('courier_upstream_pool_connections',
+                      'Connections to the News API: opened since the worker started, idle in the '
+                      'pool now, and the most the pool keeps.', ('host', 'state'), kind='gauge')
+REGISTRY = [REQUEST_SECONDS, PHASE_SECONDS, UPSTREAM_SECONDS, UPSTREAM_DENIED, BUDGET_USED,
+            BUDGET_LIMIT, UPSTREAM_LOOKUPS, UPSTREAM_POOL]
+# Run before every scrape, to copy in counters kept outside the registry.
+_collectors = []
+
+
+def add_collector(collect):
+    _collectors.append(collect)
+
+
+def remove_collector(collect):
+    if collect in _collectors:
+        _collectors.remove(collect)
+
+
+def render_metrics():
+    """Every metric in Prometheus' text exposition format."""
+    for collect in list(_collectors):
+        # one broken collector mustn't take the whole scrape down
+        try:
+            collect()
+        except Exception:
+            logger.exception("Metrics collector %r failed", collect)
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def observe_news_client(stats, client):
+    """Copy a News API client's `stats()` into the lookup and connection pool metrics."""
+    flight = stats['single_flight']
+    UPSTREAM_LOOKUPS.set(flight['calls'], client=client, outcome='called')
+    UPSTREAM_LOOKUPS.set(flight['coalesced'], client=client, outcome='coalesced')
+    UPSTREAM_LOOKUPS.set(stats['background_refreshes'], client=client, outcome='refreshed')
+    for host, pool in stats.get('pools', {}).items():
+        UPSTREAM_POOL.set(pool['connections'], host=host, state='opened')
+        UPSTREAM_POOL.set(pool['idle'], host=host, state='idle')
+        UPSTREAM_POOL.set(pool['maxsize'], host=host, state='maxsize')
+
+
+class RequestTimer:
+    """Wall time and per-phase time for the request being served."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.queries = 0
+        self._render_started = None
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def summary(self):
+        return (f"db {1000 * self.phases['db']:.0f} ms in {self.queries} queries, "
+                f"upstream {1000 * self.phases['upstream']:.0f} ms, "
+                f"render {1000 * self.phases['render']:.0f} ms")
+
+    def render_started(self):
+        self._render_started = (time.perf_counter(),
+                                self.phases['db'] + self.phases['upstream'])
+
+    def render_finished(self):
+        """Count the render, less any db or upstream wait it triggered (a LazyPage load)."""
+        if self._render_started is None:
+            return
+        started, waited = self._render_started
+        waited_since = self.phases['db'] + self.phases['upstream'] - waited
+        self.phases['render'] += max(time.perf_counter() - started - waited_since, 0.0)
+        self._render_started = None
+
+
+def start_request_timer():
+    g.request_timer = RequestTimer()
+
+
+def current_timer():
+    """The RequestTimer of the request on this thread, or None."""
+    return g.get('request_timer') if has_request_context() else None
+
+
+def observe_request(timer, route, method, status, logger=None, slow_seconds=None):
+    """Record a finished request, and log it if it took `slow_seconds` or longer."""
+    seconds = timer.elapsed()
+    REQUEST_SECONDS.observe(seconds, route=route, method=method, status=status)
+    for phase, phase_seconds in timer.phases.items():
+        PHASE_SECONDS.observe(phase_seconds, route=route, phase=phase)
+    if logger is not None and slow_seconds is not None and seconds >= slow_seconds:
+        logger.warning("Slow request: %s %s %s in %.0f ms (%s)", method, route, status,
+                       1000 * seconds, timer.summary())
+
+
+class upstream_phase:
+    """Count the time spent in the block as the current request's upstream phase."""
+
+    def __enter__(self):
+        self.timer = current_timer()
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timer is not None:
+            self.timer.phases['upstream'] += time.perf_counter() - self.start
+
+
+def observe_upstream(endpoint, status, seconds):
+    UPSTREAM_SECONDS.observe(seconds, endpoint=endpoint, status=status)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(conn, cursor, statement, parameters, context, executemany):
+    if current_timer() is not None:
+        conn.info['courier_query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('courier_query_start', None)
+    timer = current_timer()
+    if started is not None and timer is not None:
+        timer.phases['db'] += time.perf_counter() - started
+        timer.queries += 1
+
+
+@before_render_template.connect
+def _render_started(app, template, context, **extra):
+    timer = current_timer()
+    if timer is not None:
+        timer.render_started()
+
+
+@template_rendered.connect
+def _render_finished(app, template, context, **extra):
+    timer = current_timer()
+    if timer is not None:
+        timer.render_finished()
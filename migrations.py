@@ -0,0 +1,66 @@
+"""Schema upgrades for existing Courier databases.
+
+`db.create_all()` only creates missing tables, so columns and indexes added to
+existing tables are applied here. Every statement is idempotent; run them with
+`flask upgrade-db` after deploying a model change.
+"""
+from sqlalchemy import text
+
+from models import db
+
+MIGRATIONS = [
+    # Headline ingestion (Story/Outlet)
+    "ALTER TABLE outlets ADD COLUMN IF NOT EXISTS source_id TEXT",
+    "CREATE INDEX IF NOT EXISTS ix_outlets_source_id ON outlets (source_id)",
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS url TEXT",
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS description TEXT",
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS url_to_image TEXT",
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS country TEXT",
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS category TEXT",
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS fetched_at TIMESTAMP",
+    "CREATE UNIQUE INDEX IF NOT EXISTS stories_url_key ON stories (url)",
+    "CREATE INDEX IF NOT EXISTS ix_stories_fetched_at ON stories (fetched_at)",
+    "CREATE INDEX IF NOT EXISTS ix_stories_outlet_date ON stories (outlet, date)",
+    "CREATE INDEX IF NOT EXISTS ix_stories_country_category_date "
+    "ON stories (country, category, date)",
+    # One row per (user, country) and (user, outlet); drop duplicates left by the
+    # old delete-all/re-insert save before adding the unique indexes.
+    'DELETE FROM country_preferences a USING country_preferences b '
+    'WHERE a."user" = b."user" AND a.country = b.country AND a.id > b.id',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_country_preferences_user_country '
+    'ON country_preferences ("user", country)',
+    'DELETE FROM outlet_preferences a USING outlet_preferences b '
+    'WHERE a."user" = b."user" AND a.outlet = b.outlet AND a.id > b.id',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_outlet_preferences_user_outlet '
+    'ON outlet_preferences ("user", outlet)',
+    # Full-text search; existing stories are indexed by upgrade() below.
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS search_vector TSVECTOR",
+    "CREATE INDEX IF NOT EXISTS ix_stories_search ON stories USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS ix_stories_date ON stories (date DESC NULLS LAST)",
+    # Ranking; existing stories are tagged by upgrade() below.
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS tags INTEGER[]",
+    'DELETE FROM likes a USING likes b '
+    'WHERE a."user" = b."user" AND a.story = b.story AND a.id > b.id',
+    'CREATE UNIQUE INDEX IF NOT EXISTS uq_likes_user_story ON likes ("user", story)',
+    # Near-duplicate clusters; recent stories are clustered by upgrade() below.
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS minhash INTEGER[]",
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS lsh_bands BIGINT[]",
+    "ALTER TABLE stories ADD COLUMN IF NOT EXISTS cluster INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_stories_lsh_bands ON stories USING GIN (lsh_bands)",
+]
+
+
+def upgrade():
+    """Create missing tables, then apply every migration in order."""
+    from search import backfill_search_vectors
+    from ranking import tag_stories
+    from dedup import backfill_clusters
+
+    db.create_all()
+    for statement in MIGRATIONS:
+        db.session.execute(text(statement))
+    backfill_search_vectors()
+    tag_stories()
+    backfill_clusters()
+    db.session.commit()
+    return len(MIGRATIONS)
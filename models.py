@@ -1,9 +1,9 @@
 """Models for Courier app."""
 from flask_sqlalchemy import SQLAlchemy
-from flask_bcrypt import Bcrypt
+from sqlalchemy.dialects.postgresql import ARRAY, TSVECTOR
+from services import get_password_hasher
 
 db = SQLAlchemy()
-bcrypt = Bcrypt()
 
 def connect_db(app): 
     db.app = app
@@ -29,7 +29,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = get_password_hasher().hash(password)
 
         user = User(
             username=username,
@@ -46,13 +46,18 @@ class User(db.Model):
         """Authenticate the sign in. 
 
         If can't find matching user (or if password is wrong), returns False.
+        If the hash was made at a different cost than configured, the password
+        is rehashed; the caller commits the change.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            hasher = get_password_hasher()
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -60,20 +65,72 @@ class User(db.Model):
 class Story(db.Model):
     """Story information from publication"""
     __tablename__ = "stories"
+    __table_args__ = (
+        db.Index('ix_stories_outlet_date', 'outlet', 'date'),
+        db.Index('ix_stories_country_category_date', 'country', 'category', 'date'),
+        db.Index('ix_stories_search', 'search_vector', postgresql_using='gin'),
+        db.Index('ix_stories_date', db.text('date DESC NULLS LAST')),
+        db.Index('ix_stories_lsh_bands', 'lsh_bands', postgresql_using='gin'),
+    )
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     title = db.Column(db.Text, nullable=False)
+    # ISO 8601 publishedAt from the News API, so it sorts as text
     date = db.Column(db.Text)
     author = db.Column(db.Text)
     outlet = db.Column(db.Integer, db.ForeignKey('outlets.id'))
+    url = db.Column(db.Text, unique=True)
+    description = db.Column(db.Text)
+    url_to_image = db.Column(db.Text)
+    country = db.Column(db.Text)
+    category = db.Column(db.Text)
+    fetched_at = db.Column(db.DateTime, index=True)
+    # weighted title/description/author/outlet lexemes for /search; see search.py
+    search_vector = db.Column(TSVECTOR)
+    # ids of the story's Content tags, for ranking; see ranking.py
+    tags = db.Column(ARRAY(db.Integer))
+    # near-duplicate detection; see dedup.py
+    minhash = db.Column(ARRAY(db.Integer))
+    lsh_bands = db.Column(ARRAY(db.BigInteger))
+    # id of the first story of its near-duplicate cluster
+    cluster = db.Column(db.Integer)
+    source = db.relationship('Outlet')
+
+    def to_article(self):
+        """Return the story shaped like a News API article."""
+        return {
+            'source': {'id': self.source.source_id, 'name': self.source.name},
+            'author': self.author,
+            'title': self.title,
+            'description': self.description,
+            'url': self.url,
+            'urlToImage': self.url_to_image,
+            'publishedAt': self.date,
+        }
+
+class UserFeed(db.Model):
+    """A user's materialized home feed: ids of the newest stories from their outlets"""
+    __tablename__ = "user_feeds"
+    user = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    # the sorted News API source ids the feed was built for
+    sources = db.Column(ARRAY(db.Text), nullable=False)
+    # newest first; see feeds.py
+    story_ids = db.Column(ARRAY(db.Integer), nullable=False)
+    built_at = db.Column(db.DateTime, nullable=False)
 
 class Outlet(db.Model):
     """Outlet information from publication"""
     __tablename__ = "outlets"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.Text, nullable=False, unique=True)
+    # News API source id; None for outlets the API only reports by name
+    source_id = db.Column(db.Text, index=True)
 
 class Content(db.Model):
-    """Content tags for users to add to their story filters"""
+    """Content tags for users to add to their story filters
+
+    Ingested stories are tagged with their title's keywords and category;
+    `story` is unused.
+    """
     __tablename__ = "content"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.Text, unique=True, nullable = False)
@@ -82,6 +139,7 @@ class Content(db.Model):
 class Likes(db.Model):
     """Likes users make on stories"""
     __tablename__ = "likes"
+    __table_args__ = (db.UniqueConstraint('user', 'story', name='uq_likes_user_story'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user = db.Column(db.Integer, db.ForeignKey('users.id'))
     story = db.Column(db.Integer, db.ForeignKey('stories.id'))
@@ -98,6 +156,8 @@ class Preferences(db.Model):
 class CountryPreferences(db.Model):
     """Users set their country preferences"""
     __tablename__ = "country_preferences"
+    # The unique index also serves every lookup by user (leftmost column).
+    __table_args__ = (db.UniqueConstraint('user', 'country', name='uq_country_preferences_user_country'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'))
     country = db.Column(db.Text)
@@ -105,6 +165,7 @@ class CountryPreferences(db.Model):
 class OutletPreferences(db.Model):
     """Users set their country preferences"""
     __tablename__ = "outlet_preferences"
+    __table_args__ = (db.UniqueConstraint('user', 'outlet', name='uq_outlet_preferences_user_outlet'),)
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user = db.Column(db.Integer, db.ForeignKey('users.id'))
     outlet = db.Column(db.Text)
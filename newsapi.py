@@ -0,0 +1,439 @@
+"""News API client for Courier app."""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from cache import cache_key
+from config import (NEWSAPI_BASE_URL, NEWSAPI_POOL_SIZE, NEWSAPI_CONNECT_TIMEOUT,
+                    NEWSAPI_READ_TIMEOUT, NEWSAPI_RETRIES, NEWSAPI_BACKOFF, NEWSAPI_CACHE_TTLS,
+                    NEWSAPI_FANOUT_WORKERS, NEWSAPI_FANOUT_DEADLINE, NEWSAPI_QUOTA_MAX_WAIT,
+                    NEWSAPI_STALE_WHILE_REVALIDATE, NEWSAPI_REFRESH_WORKERS)
+from metrics import observe_upstream, upstream_phase, UPSTREAM_DENIED
+from quota import INTERACTIVE, BACKGROUND
+
+
+def error_payload(code, message):
+    """Build an error body shaped like the ones the News API returns."""
+    return {'status': 'error', 'code': code, 'message': message}
+
+
+def budget_spent_payload():
+    return error_payload('upstreamBudgetSpent',
+                         'Too many News API requests right now. Please try again later.')
+
+
+class EndpointStats:
+    """Running latency and status counters for one upstream endpoint."""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.statuses = {}
+
+    def record(self, seconds, status):
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status == 'error' or (isinstance(status, int) and status >= 400):
+            self.errors += 1
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': round(1000 * self.total_seconds / self.count, 2) if self.count else 0.0,
+            'max_ms': round(1000 * self.max_seconds, 2),
+            'statuses': dict(self.statuses),
+        }
+
+
+class _Call:
+    """One in-flight upstream call that other threads can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one.
+
+    The first caller for a key runs the function; callers that arrive while it
+    is still running wait for it and get the same result (or exception).
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._in_flight.get(key)
+            if call is None:
+                call = self._in_flight[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+        return call.result
+
+    def stats(self):
+        return {'calls': self.calls, 'coalesced': self.coalesced}
+
+
+class NewsAPIClient:
+    """Pooled, keep-alive client shared by every route that talks to the News API.
+
+    One requests.Session is reused for the life of the worker so TLS connections
+    to newsapi.org are kept alive between page views instead of being opened
+    per request. Idempotent GETs are retried with exponential backoff on
+    connection errors and 5xx responses. A 429 is not retried: it means the
+    quota is spent, and every retry would count against it again.
+
+    When a cache is given, successful responses for endpoints listed in
+    `cache_ttls` are stored under a normalized key for that endpoint's TTL.
+    Identical queries already in flight on another thread share that call's
+    result instead of going upstream again, so returned bodies are shared and
+    must be treated as read-only.
+
+    An entry that expired less than `stale_while_revalidate` seconds ago is
+    returned at once while one background call refreshes it. When a call
+    fails (upstream down, an error status, or over the quota's budget), `get`
+    returns the last good response if the cache still holds it.
+
+    When a quota is given, every upstream call spends from it; one over
+    budget isn't made and comes back as an `upstreamBudgetSpent` error.
+    """
+
+    def __init__(self, api_key, base_url=NEWSAPI_BASE_URL, pool_size=NEWSAPI_POOL_SIZE,
+                 connect_timeout=NEWSAPI_CONNECT_TIMEOUT, read_timeout=NEWSAPI_READ_TIMEOUT,
+                 retries=NEWSAPI_RETRIES, backoff=NEWSAPI_BACKOFF, cache=None,
+                 cache_ttls=NEWSAPI_CACHE_TTLS, fanout_workers=NEWSAPI_FANOUT_WORKERS,
+                 quota=None, quota_max_wait=NEWSAPI_QUOTA_MAX_WAIT,
+                 stale_while_revalidate=NEWSAPI_STALE_WHILE_REVALIDATE,
+                 refresh_workers=NEWSAPI_REFRESH_WORKERS):
+        self.base_url = base_url.rstrip('/')
+        self.cache = cache
+        self.cache_ttls = cache_ttls
+        self.stale_while_revalidate = stale_while_revalidate
+        self.quota = quota
+        self.quota_max_wait = quota_max_wait
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_size = pool_size
+
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            # Retry-After can ask for minutes; never hold a request thread that long.
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                                   max_retries=retry)
+        self.session = requests.Session()
+        self.session.headers.update({'X-API-Key': api_key})
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        self._lock = threading.Lock()
+        self._endpoints = {}
+        self._flight = SingleFlight()
+        self._executor = ThreadPoolExecutor(max_workers=fanout_workers,
+                                            thread_name_prefix='newsapi-fanout')
+        self._refresh_executor = ThreadPoolExecutor(max_workers=refresh_workers,
+                                                    thread_name_prefix='newsapi-refresh')
+        self._refreshing = set()
+        self.refreshes = 0
+
+    def get(self, endpoint, params=None):
+        """GET a News API endpoint and return the parsed JSON body.
+
+        Network failures are returned as a News API style error body so that
+        callers can treat them the same way as an error from upstream.
+        """
+        with upstream_phase():
+            return self._get(endpoint, params)
+
+    def _get(self, endpoint, params):
+        key = cache_key(endpoint, params)
+        ttl = self.cache_ttls.get(endpoint) if self.cache is not None else None
+        if ttl:
+            data = self.cache.get(key)
+            if data is not None:
+                return data
+            data = self.cache.get_stale(key, self.stale_while_revalidate)
+            if data is not None:
+                self._refresh_in_background(endpoint, params, key, ttl)
+                return data
+
+        return self._flight.do(key, lambda: self._fetch_and_store(endpoint, params, key, ttl))
+
+    def _fetch_and_store(self, endpoint, params, key, ttl, priority=INTERACTIVE):
+        data = self.fetch(endpoint, params, priority)
+        if data.get('status') == 'ok':
+            if ttl:
+                self.cache.set(key, data, ttl)
+            return data
+        if self.cache is not None:
+            return self.cache.get_stale(key) or data
+        return data
+
+    def _refresh_in_background(self, endpoint, params, key, ttl):
+        """Refetch an expired entry on the refresh pool, once however many readers ask."""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            self.refreshes += 1
+
+        def run():
+            try:
+                self._flight.do(key, lambda: self._fetch_and_store(endpoint, params, key, ttl,
+                                                                   BACKGROUND))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        self._refresh_executor.submit(run)
+
+    def get_many(self, endpoint, params_list, deadline=NEWSAPI_FANOUT_DEADLINE):
+        """GET the same endpoint once per params dict, concurrently.
+
+        Results come back in the order of `params_list`. Lookups still running
+        when `deadline` seconds have passed are returned as an `upstreamTimeout`
+        error body so one slow query can't hold the whole request open.
+        """
+        futures = [self._executor.submit(self.get, endpoint, params) for params in params_list]
+        with upstream_phase():
+            wait(futures, timeout=deadline)
+        results = []
+        for future in futures:
+            if future.done():
+                results.append(future.result())
+            else:
+                future.cancel()
+                results.append(error_payload('upstreamTimeout',
+                                             f"No response from the News API within {deadline}s."))
+        return results
+
+    def fetch(self, endpoint, params=None, priority=INTERACTIVE):
+        """GET an endpoint from upstream, bypassing the cache.
+
+        Background work (ingestion, catalog refreshes) passes
+        priority=BACKGROUND, which leaves part of the budget to page views.
+        """
+        if not self._spend_budget(priority):
+            return budget_spent_payload()
+        start = time.perf_counter()
+        try:
+            response = self.session.get(f"{self.base_url}{endpoint}", params=params,
+                                        timeout=self.timeout)
+            data = response.json()
+            status = response.status_code
+        except requests.RequestException as e:
+            data = error_payload('upstreamUnavailable', str(e))
+            status = 'error'
+        except ValueError:
+            data = error_payload('upstreamInvalidResponse', 'The News API returned a non-JSON body.')
+            status = 'error'
+        seconds = time.perf_counter() - start
+        self._record(endpoint, seconds, status)
+        observe_upstream(endpoint, status, seconds)
+        return data
+
+    def _spend_budget(self, priority):
+        """Take a request from the quota, waiting briefly for one if a page view needs it."""
+        if self.quota is None:
+            return True
+        wait = self.quota.acquire(priority)
+        if 0 < wait <= self.quota_max_wait and priority == INTERACTIVE:
+            time.sleep(wait)
+            wait = self.quota.acquire(priority)
+        if wait:
+            UPSTREAM_DENIED.inc(priority=priority)
+        return not wait
+
+    def _record(self, endpoint, seconds, status):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.record(seconds, status)
+
+    def endpoint_stats(self):
+        """Return per-endpoint latency and status counters."""
+        with self._lock:
+            return {endpoint: stats.as_dict() for endpoint, stats in self._endpoints.items()}
+
+    def pool_stats(self):
+        """Return connection pool usage per upstream host.
+
+        `idle` is the number of kept-alive connections waiting in the pool;
+        `connections` is how many were ever opened. A `connections` count that
+        keeps climbing past `maxsize` means the pool is too small for the
+        worker's concurrency and connections are being discarded.
+        """
+        stats = {}
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'maxsize': self.pool_size,
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle': idle,
+            }
+        return stats
+
+    def stats(self):
+        return {'endpoints': self.endpoint_stats(), 'pools': self.pool_stats(),
+                'single_flight': self._flight.stats(), 'background_refreshes': self.refreshes}
+
+
+class AsyncNewsAPIClient:
+    """Non-blocking News API client for the ASGI serving mode.
+
+    Mirrors NewsAPIClient: one pooled httpx.AsyncClient per worker, the same
+    cache and TTLs, and single-flight coalescing of identical in-flight
+    queries, but every wait on upstream yields to the event loop so one worker
+    can hold thousands of upstream requests open at once. The quota,
+    stale-while-revalidate and last-good fallback work the same way too; the
+    quota and cache backends block (SQLite waits on other workers' locks), so
+    they are called on worker threads.
+    """
+
+    def __init__(self, api_key, base_url=NEWSAPI_BASE_URL, max_connections=1000,
+                 connect_timeout=NEWSAPI_CONNECT_TIMEOUT, read_timeout=NEWSAPI_READ_TIMEOUT,
+                 retries=NEWSAPI_RETRIES, cache=None, cache_ttls=NEWSAPI_CACHE_TTLS,
+                 quota=None, quota_max_wait=NEWSAPI_QUOTA_MAX_WAIT,
+                 stale_while_revalidate=NEWSAPI_STALE_WHILE_REVALIDATE):
+        import httpx
+
+        self.base_url = base_url.rstrip('/')
+        self.cache = cache
+        self.cache_ttls = cache_ttls
+        self.stale_while_revalidate = stale_while_revalidate
+        self.quota = quota
+        self.quota_max_wait = quota_max_wait
+        self.client = httpx.AsyncClient(
+            headers={'X-API-Key': api_key},
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+            transport=httpx.AsyncHTTPTransport(retries=retries),
+        )
+        self.calls = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self._in_flight = {}
+
+    def stats(self):
+        return {'single_flight': {'calls': self.calls, 'coalesced': self.coalesced},
+                'background_refreshes': self.refreshes}
+
+    async def get(self, endpoint, params=None):
+        """GET a News API endpoint and return the parsed JSON body."""
+        key = cache_key(endpoint, params)
+        ttl = self.cache_ttls.get(endpoint) if self.cache is not None else None
+        if ttl:
+            data = await asyncio.to_thread(self.cache.get, key)
+            if data is not None:
+                return data
+            data = await asyncio.to_thread(self.cache.get_stale, key,
+                                           self.stale_while_revalidate)
+            if data is not None:
+                if key not in self._in_flight:
+                    self.refreshes += 1
+                    self._start(endpoint, params, key, ttl, BACKGROUND)
+                return data
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self.calls += 1
+            task = self._start(endpoint, params, key, ttl, INTERACTIVE)
+        else:
+            self.coalesced += 1
+        # shield so one cancelled caller doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    def _start(self, endpoint, params, key, ttl, priority):
+        task = self._in_flight[key] = asyncio.ensure_future(self._fetch_and_store(
+            endpoint, params, key, ttl, priority))
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return task
+
+    async def _fetch_and_store(self, endpoint, params, key, ttl, priority):
+        data = await self.fetch(endpoint, params, priority)
+        if data.get('status') == 'ok':
+            if ttl:
+                await asyncio.to_thread(self.cache.set, key, data, ttl)
+            return data
+        if self.cache is not None:
+            return await asyncio.to_thread(self.cache.get_stale, key) or data
+        return data
+
+    async def fetch(self, endpoint, params=None, priority=INTERACTIVE):
+        """GET an endpoint from upstream, bypassing the cache."""
+        import httpx
+
+        if not await self._spend_budget(priority):
+            return budget_spent_payload()
+        start = time.perf_counter()
+        try:
+            response = await self.client.get(f"{self.base_url}{endpoint}", params=params)
+            data = response.json()
+            status = response.status_code
+        except httpx.HTTPError as e:
+            data = error_payload('upstreamUnavailable', str(e))
+            status = 'error'
+        except ValueError:
+            data = error_payload('upstreamInvalidResponse', 'The News API returned a non-JSON body.')
+            status = 'error'
+        observe_upstream(endpoint, status, time.perf_counter() - start)
+        return data
+
+    async def _spend_budget(self, priority):
+        if self.quota is None:
+            return True
+        wait = await asyncio.to_thread(self.quota.acquire, priority)
+        if 0 < wait <= self.quota_max_wait and priority == INTERACTIVE:
+            await asyncio.sleep(wait)
+            wait = await asyncio.to_thread(self.quota.acquire, priority)
+        if wait:
+            UPSTREAM_DENIED.inc(priority=priority)
+        return not wait
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,64 @@
+"""Password hashing on a bounded worker pool for Courier app."""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+from config import BCRYPT_LOG_ROUNDS, BCRYPT_WORKERS, BCRYPT_QUEUE_DEPTH, BCRYPT_QUEUE_TIMEOUT
+
+
+class PasswordQueueFull(Exception):
+    """Raised when too many hashes are already running or waiting."""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a dedicated pool instead of the request thread.
+
+    bcrypt releases the GIL, so hashing on `workers` threads caps the CPU a
+    login burst can take while other request threads keep serving pages. At
+    most `workers + queue_depth` hashes may be running or queued; a caller that
+    can't get a slot within `queue_timeout` seconds gets PasswordQueueFull
+    rather than piling up behind the burst.
+    """
+
+    def __init__(self, rounds=BCRYPT_LOG_ROUNDS, workers=BCRYPT_WORKERS,
+                 queue_depth=BCRYPT_QUEUE_DEPTH, queue_timeout=BCRYPT_QUEUE_TIMEOUT):
+        self.rounds = rounds
+        self.queue_timeout = queue_timeout
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(workers + queue_depth)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordQueueFull("Too many password checks in progress.")
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost."""
+        salt = bcrypt.gensalt(self.rounds)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def check(self, pw_hash, password):
+        """Return True if `password` matches `pw_hash`."""
+        try:
+            return self._run(bcrypt.checkpw, password.encode('utf-8'), pw_hash.encode('utf-8'))
+        except ValueError:
+            # not a bcrypt hash
+            return False
+
+    def needs_rehash(self, pw_hash):
+        """Return True if `pw_hash` was made with a different cost than configured."""
+        try:
+            return int(pw_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
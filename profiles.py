@@ -0,0 +1,60 @@
+"""Cached slim user profiles for Courier app."""
+from dataclasses import dataclass, asdict
+
+from flask import session
+
+from config import PROFILE_CACHE_TTL
+from models import db, User, CountryPreferences, OutletPreferences
+from services import get_profile_cache
+
+PROFILE_VERSION_KEY = "profile_version"
+
+
+@dataclass(frozen=True)
+class UserProfile:
+    """What a page needs to know about the logged in user, without the ORM row."""
+    id: int
+    username: str
+    image_url: str
+    countries: tuple
+    outlets: tuple
+
+    @classmethod
+    def from_db(cls, user_id):
+        """Load the profile with one query per table, or None if the user is gone."""
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        countries = db.session.scalars(db.select(CountryPreferences.country)
+                                       .where(CountryPreferences.user == user_id)
+                                       .order_by(CountryPreferences.id))
+        outlets = db.session.scalars(db.select(OutletPreferences.outlet)
+                                     .where(OutletPreferences.user == user_id)
+                                     .order_by(OutletPreferences.id))
+        return cls(user.id, user.username, user.image_url, tuple(countries), tuple(outlets))
+
+
+def _key(user_id):
+    # The version lives in the user's session, so after an update every worker
+    # reading that session misses the old entry, even with a per-worker cache.
+    return f"user-profile:{user_id}:{session.get(PROFILE_VERSION_KEY, 0)}"
+
+
+def load_profile(user_id):
+    """Return the user's profile from the cache, loading it on a miss."""
+    key = _key(user_id)
+    profile_cache = get_profile_cache()
+    cached = profile_cache.get(key)
+    if cached is not None:
+        return UserProfile(**{**cached, 'countries': tuple(cached['countries']),
+                              'outlets': tuple(cached['outlets'])})
+    profile = UserProfile.from_db(user_id)
+    if profile is not None:
+        profile_cache.set(key, asdict(profile), PROFILE_CACHE_TTL)
+    return profile
+
+
+def invalidate_profile(user_id):
+    """Drop the cached profile after the user or their preferences change."""
+    get_profile_cache().delete(_key(user_id))
+    session[PROFILE_VERSION_KEY] = session.get(PROFILE_VERSION_KEY, 0) + 1
@@ -0,0 +1,150 @@
+"""News API request budget for Courier app.
+
+A token bucket caps the request rate and a counter caps the requests per UTC
+day. Interactive requests (a page view waiting on upstream) may spend the
+whole budget; background work (headline ingestion, catalog refreshes) leaves
+a `reserve` share of both untouched, so it can't starve page views.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from cache import sqlite_connector
+
+INTERACTIVE = 'interactive'
+BACKGROUND = 'background'
+
+
+def utc_day(now):
+    return datetime.fromtimestamp(now, timezone.utc).strftime('%Y-%m-%d')
+
+
+class BucketState:
+    """Tokens left in the bucket and requests made on `day`."""
+
+    def __init__(self, tokens, updated_at, day, used):
+        self.tokens = tokens
+        self.updated_at = updated_at
+        self.day = day
+        self.used = used
+
+
+class Quota:
+    """Token bucket plus daily limit; subclasses say where the state is kept.
+
+    `rate` tokens are added per second up to `burst`, and `daily_limit`
+    requests may be made per UTC day.
+    """
+
+    def __init__(self, rate, burst, daily_limit, reserve=0.2):
+        self.rate = rate
+        self.burst = burst
+        self.daily_limit = daily_limit
+        self.reserve = reserve
+
+    def acquire(self, priority=INTERACTIVE):
+        """Spend one request from the budget.
+
+        Returns 0 if the request may go ahead, or how many seconds until it
+        could (infinity once the day's budget is spent).
+        """
+        with self._transaction() as (state, now):
+            return self._take(state, now, priority)
+
+    def usage(self):
+        """The requests made today and the daily limit."""
+        with self._transaction() as (state, now):
+            self._refill(state, now)
+            return {'used': state.used, 'limit': self.daily_limit}
+
+    def background_remaining(self):
+        """The requests background work may still make today."""
+        with self._transaction() as (state, now):
+            self._refill(state, now)
+            return max(0, int(self.daily_limit * (1 - self.reserve)) - state.used)
+
+    def _refill(self, state, now):
+        state.tokens = min(self.burst, state.tokens + (now - state.updated_at) * self.rate)
+        state.updated_at = now
+        day = utc_day(now)
+        if state.day != day:
+            state.day = day
+            state.used = 0
+
+    def _take(self, state, now, priority):
+        self._refill(state, now)
+        background = priority == BACKGROUND
+        daily_limit = self.daily_limit * (1 - self.reserve) if background else self.daily_limit
+        floor = self.burst * self.reserve if background else 0
+        if state.used >= daily_limit:
+            return float('inf')
+        if state.tokens - floor < 1:
+            return (1 + floor - state.tokens) / self.rate
+        state.tokens -= 1
+        state.used += 1
+        return 0
+
+    def _new_state(self, now):
+        return BucketState(self.burst, now, utc_day(now), 0)
+
+
+class MemoryQuota(Quota):
+    """A budget for this process only."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._state = self._new_state(time.time())
+
+    @contextmanager
+    def _transaction(self):
+        with self._lock:
+            yield self._state, time.time()
+
+
+class SQLiteQuota(Quota):
+    """A budget shared by every worker on the host through a SQLite file."""
+
+    def __init__(self, path, *args, name='newsapi', **kwargs):
+        super().__init__(*args, **kwargs)
+        self.path = path
+        self.name = name
+        # a spent token must survive a crash, so commits are fully synced
+        self._connect = sqlite_connector(path, synchronous=None)
+        self._connect().execute("""CREATE TABLE IF NOT EXISTS quota (
+                                       name TEXT PRIMARY KEY,
+                                       tokens REAL NOT NULL,
+                                       updated_at REAL NOT NULL,
+                                       day TEXT NOT NULL,
+                                       used INTEGER NOT NULL)""")
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connect()
+        now = time.time()
+        # take the write lock up front, so two workers can't spend the same token
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated_at, day, used FROM quota WHERE name = ?",
+                               (self.name,)).fetchone()
+            state = BucketState(*row) if row else self._new_state(now)
+            yield state, now
+            conn.execute("INSERT OR REPLACE INTO quota (name, tokens, updated_at, day, used) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (self.name, state.tokens, state.updated_at, state.day, state.used))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def make_quota(backend, rate, burst, daily_limit, reserve, path=None):
+    """Build the quota backend named in config, or None for 'off'."""
+    if backend == 'off':
+        return None
+    if backend == 'memory':
+        return MemoryQuota(rate, burst, daily_limit, reserve=reserve)
+    if backend == 'sqlite':
+        return SQLiteQuota(path, rate, burst, daily_limit, reserve=reserve)
+    raise ValueError(f"Unknown quota backend: {backend}")
@@ -0,0 +1,213 @@
+"""Personalized ranking of home feed stories, learned from likes.
+
+A candidate story's score adds up three signals:
+
+- recency: RANK_RECENCY_WEIGHT, halved every RANK_HALF_LIFE seconds since it
+  was published;
+- outlet affinity: RANK_OUTLET_WEIGHT times the share of the user's likes
+  that went to the story's outlet;
+- tag affinity: RANK_TAG_WEIGHT times the share of the user's likes on
+  stories with each of the story's content tags, averaged over its tags.
+
+Only the user's last RANK_MAX_LIKES likes count, and a user without likes
+sees their feed newest first. Scores are computed with NumPy for a batch of
+users and candidates at once: affinities are users x outlets and users x tags
+matrices over the outlets and tags the candidates have, and the candidates'
+tags are a sparse candidates x tags matrix kept as index arrays.
+"""
+import time
+from itertools import chain
+
+import numpy as np
+from sqlalchemy import any_, func, literal
+from sqlalchemy.dialects.postgresql import REGCONFIG, insert
+
+from config import (RANK_RECENCY_WEIGHT, RANK_HALF_LIFE, RANK_OUTLET_WEIGHT, RANK_TAG_WEIGHT,
+                    RANK_MAX_LIKES)
+from models import db, Story, Content, Likes
+from search import SEARCH_CONFIG
+
+
+def story_tag_names():
+    """SQL expression for a story's tag names: its title's lexemes and 'category:<name>'."""
+    lexemes = func.tsvector_to_array(func.to_tsvector(literal(SEARCH_CONFIG).cast(REGCONFIG),
+                                                      Story.title))
+    return func.array_remove(func.array_append(lexemes, 'category:' + Story.category), None)
+
+
+def tag_stories(story_ids=None):
+    """Tag stories with Content rows, adding any tags not seen before.
+
+    Tags the given stories, or every story not tagged yet. Does not commit.
+    """
+    if story_ids is not None and not story_ids:
+        return
+    stories = Story.id.in_(story_ids) if story_ids is not None else Story.tags.is_(None)
+    names = story_tag_names()
+    db.session.execute(insert(Content)
+                       .from_select(['name'], db.select(func.unnest(names)).where(stories).distinct())
+                       .on_conflict_do_nothing(index_elements=['name']))
+    tag_ids = db.select(Content.id).where(Content.name == any_(names)).correlate(Story)
+    db.session.execute(db.update(Story).where(stories)
+                       .values(tags=func.array(tag_ids.scalar_subquery())),
+                       execution_options={'synchronize_session': False})
+
+
+def like_story(user_id, story_id):
+    """Record that the user likes the story. Commits."""
+    db.session.execute(insert(Likes).values(user=user_id, story=story_id)
+                       .on_conflict_do_nothing(index_elements=['user', 'story']))
+    db.session.commit()
+
+
+def unlike_story(user_id, story_id):
+    """Forget a like. Commits."""
+    db.session.execute(db.delete(Likes).where(Likes.user == user_id, Likes.story == story_id))
+    db.session.commit()
+
+
+def liked_stories(user_ids):
+    """Return the outlet and tags of each user's last RANK_MAX_LIKES liked stories.
+
+    One query for all the users; the result is a list of (outlet, tags) lists
+    in the order of `user_ids`.
+    """
+    numbered = (db.select(Likes.user, Story.outlet, Story.tags,
+                          func.row_number().over(partition_by=Likes.user,
+                                                 order_by=Likes.id.desc()).label('n'))
+                .join(Story, Story.id == Likes.story)
+                .where(Likes.user.in_(user_ids))
+                .subquery())
+    likes = {user_id: [] for user_id in user_ids}
+    for user_id, outlet, tags in db.session.execute(
+            db.select(numbered.c.user, numbered.c.outlet, numbered.c.tags)
+            .where(numbered.c.n <= RANK_MAX_LIKES)):
+        likes[user_id].append((outlet, tags or []))
+    return [likes[user_id] for user_id in user_ids]
+
+
+def user_likes(user_id):
+    """SQL expression for one user's liked stories, to select alongside another query.
+
+    Evaluates to a JSON array of [outlet, tags] pairs for the user's last
+    RANK_MAX_LIKES likes; see `parse_likes`.
+    """
+    latest = (db.select(Story.outlet, Story.tags)
+              .join(Likes, Likes.story == Story.id)
+              .where(Likes.user == user_id)
+              .order_by(Likes.id.desc())
+              .limit(RANK_MAX_LIKES)
+              .subquery())
+    return (db.select(func.coalesce(func.json_agg(func.json_build_array(latest.c.outlet,
+                                                                       latest.c.tags)),
+                                    func.json_build_array()))
+            .scalar_subquery())
+
+
+def parse_likes(rows):
+    """Turn a `user_likes` value into the (outlet, tags) list liked_stories gives."""
+    return [(outlet, tags or []) for outlet, tags in rows or []]
+
+
+def flatten(groups):
+    """Return (group row, value) index arrays for a list of lists of ints."""
+    counts = np.fromiter((len(group) for group in groups), dtype=np.int64, count=len(groups))
+    values = np.fromiter(chain.from_iterable(groups), dtype=np.int64, count=counts.sum())
+    return np.repeat(np.arange(len(groups)), counts), values
+
+
+class Candidates:
+    """The stories being ranked, as the arrays scoring works on.
+
+    `outlets` are outlet ids (None for unknown), `tags` lists of Content ids
+    and `published` ISO 8601 publishedAt strings (or None).
+    """
+
+    def __init__(self, outlets, tags, published, now=None):
+        now = time.time() if now is None else now
+        outlets = np.array([-1 if outlet is None else outlet for outlet in outlets], dtype=np.int64)
+        self.outlet_ids, self.outlet_index = np.unique(outlets, return_inverse=True)
+        tags = [tag_ids or [] for tag_ids in tags]
+        self.tag_rows, tag_values = flatten(tags)
+        self.tag_ids, self.tag_index = np.unique(tag_values, return_inverse=True)
+        self.tag_counts = np.bincount(self.tag_rows, minlength=len(tags))
+
+        # numpy parses the timestamps if the trailing Z is dropped
+        published = np.array([date[:19] if date else 'NaT' for date in published],
+                             dtype='datetime64[s]')
+        age = np.maximum(now - published.astype(np.int64), 0)
+        self.recency = np.where(np.isnat(published), 0.0, 0.5 ** (age / RANK_HALF_LIFE))
+
+    @classmethod
+    def from_stories(cls, stories, now=None):
+        return cls([story.outlet for story in stories], [story.tags for story in stories],
+                   [story.date for story in stories], now)
+
+    def __len__(self):
+        return len(self.recency)
+
+
+def columns(ids, values):
+    """Map `values` to their index in the sorted array `ids`; -1 where absent."""
+    index = np.searchsorted(ids, values)
+    index = np.minimum(index, len(ids) - 1) if len(ids) else np.zeros_like(values)
+    found = (ids[index] == values) if len(ids) else np.zeros(len(values), dtype=bool)
+    return np.where(found, index, -1)
+
+
+def affinities(likes, candidates):
+    """Each user's like shares for the candidates' outlets and tags.
+
+    `likes` has one list of (outlet, tags) per user, as from liked_stories.
+    Returns a users x outlets and a users x tags matrix, columns in the order
+    of `candidates.outlet_ids` and `candidates.tag_ids`.
+    """
+    users = len(likes)
+    like_counts = np.fromiter((len(user_likes) for user_likes in likes), dtype=np.int64,
+                              count=users)
+    shares = 1 / np.maximum(like_counts, 1)
+
+    like_users, like_outlets = flatten([[-1 if outlet is None else outlet for outlet, _ in user_likes]
+                                        for user_likes in likes])
+    outlet_affinity = np.zeros((users, len(candidates.outlet_ids)))
+    cols = columns(candidates.outlet_ids, like_outlets)
+    # a like on a story from an unknown outlet says nothing about other unknown ones
+    cols[like_outlets < 0] = -1
+    np.add.at(outlet_affinity, (like_users[cols >= 0], cols[cols >= 0]), 1)
+
+    tag_users, tag_values = flatten([list(chain.from_iterable(tags for _, tags in user_likes))
+                                     for user_likes in likes])
+    tag_affinity = np.zeros((users, len(candidates.tag_ids)))
+    cols = columns(candidates.tag_ids, tag_values)
+    np.add.at(tag_affinity, (tag_users[cols >= 0], cols[cols >= 0]), 1)
+    return outlet_affinity * shares[:, None], tag_affinity * shares[:, None]
+
+
+def score(candidates, outlet_affinity, tag_affinity):
+    """Score every candidate for every user: a users x candidates matrix."""
+    scores = RANK_RECENCY_WEIGHT * np.broadcast_to(candidates.recency,
+                                                   (len(outlet_affinity), len(candidates)))
+    scores = scores + RANK_OUTLET_WEIGHT * outlet_affinity[:, candidates.outlet_index]
+    # sum each candidate's run of tag columns: differences of a running total
+    running = np.cumsum(tag_affinity[:, candidates.tag_index], axis=1)
+    running = np.concatenate([np.zeros((len(running), 1)), running], axis=1)
+    ends = np.cumsum(candidates.tag_counts)
+    tag_sums = running[:, ends] - running[:, ends - candidates.tag_counts]
+    return scores + RANK_TAG_WEIGHT * tag_sums / np.maximum(candidates.tag_counts, 1)
+
+
+def rank_stories(user_id, stories, likes=None, now=None):
+    """Return `stories` best first for the user; ties keep their order.
+
+    `likes` are the user's (outlet, tags) likes if the caller already has
+    them; otherwise they are looked up.
+    """
+    if not stories:
+        return stories
+    if likes is None:
+        likes = liked_stories([user_id])[0]
+    if not likes:
+        return stories
+    candidates = Candidates.from_stories(stories, now)
+    scores = score(candidates, *affinities([likes], candidates))[0]
+    return [stories[i] for i in np.argsort(-scores, kind='stable')]
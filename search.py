@@ -0,0 +1,89 @@
+"""Full-text search over ingested stories.
+
+Each story keeps a weighted `tsvector` of its title (A), description (B),
+and author and outlet name (C), indexed with GIN. A search is an AND of the
+query's words, the last of which also matches as a prefix, so results show
+up while the last word is still being typed.
+"""
+import re
+
+from sqlalchemy import func, literal
+from sqlalchemy.dialects.postgresql import REGCONFIG
+from sqlalchemy.orm import contains_eager
+
+from config import SEARCH_MAX_PAGE, SEARCH_RANK_WINDOW
+from models import db, Story, Outlet
+
+SEARCH_CONFIG = 'english'
+# Longer queries only make the tsquery slower; nobody types 12 words into a search box.
+MAX_QUERY_WORDS = 12
+WORD = re.compile(r'\w+')
+
+
+def story_search_vector(title, description, author, outlet_name):
+    """The SQL expression for a story's search vector; arguments are columns or values."""
+    def weighted(value, weight):
+        return func.setweight(func.to_tsvector(literal(SEARCH_CONFIG).cast(REGCONFIG),
+                                               func.coalesce(value, '')), weight)
+    return (weighted(title, 'A').op('||')(weighted(description, 'B'))
+            .op('||')(weighted(func.concat_ws(' ', author, outlet_name), 'C')))
+
+
+def search_tsquery(query):
+    """Turn what the user typed into to_tsquery syntax, or None if it has no words.
+
+    Only runs of word characters are kept, so operators and quotes in the
+    input can't break the tsquery.
+    """
+    words = WORD.findall(query.lower())[:MAX_QUERY_WORDS]
+    if not words:
+        return None
+    return ' & '.join(words[:-1] + [f"{words[-1]}:*"])
+
+
+def search_stories(query, page, page_size):
+    """Return one page of stories matching `query`, best match first.
+
+    Shaped like a /top-headlines body with `page`, `pageSize` and `nextPage`,
+    like a feed page. Pages past SEARCH_MAX_PAGE come back empty without a
+    query: each one scans past all the rows before it, and the best matches
+    are on the first few anyway.
+
+    Only the newest SEARCH_RANK_WINDOW matches are ranked. A rare word finds
+    its few rows through the GIN index; a common one matches most of the
+    table, and walking ix_stories_date until the window fills is far cheaper
+    than ranking every match.
+    """
+    body = {'status': 'ok', 'query': query, 'articles': [], 'page': page,
+            'pageSize': page_size, 'nextPage': None}
+    tsquery_text = search_tsquery(query)
+    if tsquery_text is None or page > SEARCH_MAX_PAGE:
+        return body
+    tsquery = func.to_tsquery(literal(SEARCH_CONFIG).cast(REGCONFIG), tsquery_text)
+    newest = (db.select(Story.id, func.ts_rank_cd(Story.search_vector, tsquery).label('rank'))
+              .where(Story.search_vector.op('@@')(tsquery))
+              .order_by(Story.date.desc().nullslast())
+              .limit(SEARCH_RANK_WINDOW)
+              .subquery())
+    stories = (Story.query.join(newest, Story.id == newest.c.id)
+               .join(Outlet, Story.outlet == Outlet.id)
+               .options(contains_eager(Story.source))
+               .order_by(newest.c.rank.desc(), Story.date.desc().nullslast(), Story.id.desc())
+               .offset((page - 1) * page_size)
+               .limit(page_size + 1)
+               .all())
+    body['articles'] = [story.to_article() for story in stories[:page_size]]
+    if len(stories) > page_size and page < SEARCH_MAX_PAGE:
+        body['nextPage'] = page + 1
+    return body
+
+
+def backfill_search_vectors():
+    """Fill in the search vector of stories stored before search existed."""
+    outlet_name = (db.select(Outlet.name).where(Outlet.id == Story.outlet)
+                   .scalar_subquery())
+    return db.session.execute(
+        db.update(Story).where(Story.search_vector.is_(None))
+        .values(search_vector=story_search_vector(Story.title, Story.description,
+                                                  Story.author, outlet_name))
+    ).rowcount
@@ -1,6 +1,9 @@
-from app import app
+from app import create_app
 from models import db, User, Story, Outlet, Content, Likes, Preferences
 
+app = create_app()
+app.app_context().push()
+
 
 # db.drop_all()
 # db.create_all()
\ No newline at end of file
@@ -0,0 +1,86 @@
+"""Shared services for Courier app, built on first use.
+
+Nothing here is constructed at import time, so workers, tests and CLI
+commands that never talk to the News API or check a password don't pay for
+the HTTP client, its connection pool, the caches or the bcrypt pool.
+"""
+import os
+import threading
+
+from config import (NEWSAPI_CACHE_BACKEND, NEWSAPI_CACHE_MAX_ENTRIES, NEWSAPI_CACHE_PATH,
+                    NEWSAPI_CACHE_MAX_STALE, NEWSAPI_QUOTA_BACKEND, NEWSAPI_QUOTA_PATH,
+                    NEWSAPI_RATE_LIMIT, NEWSAPI_RATE_BURST, NEWSAPI_DAILY_QUOTA,
+                    NEWSAPI_BACKGROUND_RESERVE, PROFILE_CACHE_BACKEND, PROFILE_CACHE_MAX_ENTRIES,
+                    PROFILE_CACHE_PATH)
+
+# Reentrant because building one service may build another (the client needs
+# the cache).
+_lock = threading.RLock()
+_services = {}
+
+
+def _get_or_build(name, build):
+    service = _services.get(name)
+    if service is None:
+        with _lock:
+            service = _services.get(name)
+            if service is None:
+                service = _services[name] = build()
+    return service
+
+
+def built(name):
+    """Return the service `name` if something has already built it, otherwise None."""
+    return _services.get(name)
+
+
+def get_api_key():
+    """Return the News API key from NEWSAPI_KEY, or the untracked api_key module."""
+    key = os.environ.get('NEWSAPI_KEY')
+    if key is None:
+        from api_key import api_key as key
+    return key
+
+
+def get_news_cache():
+    from cache import make_cache
+    return _get_or_build('news_cache', lambda: make_cache(
+        NEWSAPI_CACHE_BACKEND, NEWSAPI_CACHE_MAX_ENTRIES, NEWSAPI_CACHE_PATH,
+        NEWSAPI_CACHE_MAX_STALE))
+
+
+def get_news_quota():
+    """Return the News API request budget, or None if NEWSAPI_QUOTA_BACKEND is 'off'."""
+    from quota import make_quota
+    if NEWSAPI_QUOTA_BACKEND == 'off':
+        return None
+    return _get_or_build('news_quota', lambda: make_quota(
+        NEWSAPI_QUOTA_BACKEND, NEWSAPI_RATE_LIMIT, NEWSAPI_RATE_BURST, NEWSAPI_DAILY_QUOTA,
+        NEWSAPI_BACKGROUND_RESERVE, NEWSAPI_QUOTA_PATH))
+
+
+def get_news_client():
+    from newsapi import NewsAPIClient
+    return _get_or_build('news_client', lambda: NewsAPIClient(
+        get_api_key(), cache=get_news_cache(), quota=get_news_quota()))
+
+
+def get_sources_catalog():
+    from catalog import SourcesCatalog
+    return _get_or_build('sources_catalog', SourcesCatalog)
+
+
+def get_profile_cache():
+    from cache import make_cache
+    return _get_or_build('profile_cache', lambda: make_cache(
+        PROFILE_CACHE_BACKEND, PROFILE_CACHE_MAX_ENTRIES, PROFILE_CACHE_PATH))
+
+
+def get_password_hasher():
+    from passwords import PasswordHasher
+    return _get_or_build('password_hasher', PasswordHasher)
+
+
+def get_thumbnailer():
+    from thumbnails import Thumbnailer
+    return _get_or_build('thumbnailer', Thumbnailer)
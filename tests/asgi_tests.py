@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+os.environ['DATABASE_URL'] = "postgresql:///capstone_1_test"
+
+import httpx
+
+import compression
+import metrics
+
+from app import create_app
+from asgi import CourierASGI, ThreadedWsgiToAsgi
+from helpers import CURR_USER_KEY
+from models import db, User, OutletPreferences
+
+flask_app = create_app('testing')
+flask_app.app_context().push()
+db.create_all()
+
+
+class HeadlinesClient:
+    """Async stand-in for the News API client."""
+
+    def __init__(self):
+        self.params = []
+
+    async def get(self, endpoint, params=None):
+        self.params.append(params)
+        name = params.get('country') or params.get('sources')
+        return {'status': 'ok', 'articles': [{'title': f"{name} news", 'source': {'name': name}}]}
+
+    def stats(self):
+        return {'single_flight': {'calls': len(self.params), 'coalesced': 0},
+                'background_refreshes': 0}
+
+    async def aclose(self):
+        pass
+
+
+class ASGIAppTest(TestCase):
+    """Tests the async serving mode."""
+
+    def setUp(self):
+        user = User(username='user1', email='joe@shmoe.com', password='pass')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(OutletPreferences(user=user.id, outlet='bbc-news'))
+        db.session.commit()
+
+        self.asgi_app = CourierASGI(flask_app)
+        self.asgi_app.news_client = HeadlinesClient()
+        serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        self.cookie = {flask_app.config['SESSION_COOKIE_NAME']:
+                       serializer.dumps({CURR_USER_KEY: user.id})}
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def get(self, path, cookies=None, headers=None):
+        async def request():
+            transport = httpx.ASGITransport(app=self.asgi_app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://test',
+                                         cookies=cookies) as client:
+                return await client.get(path, headers=headers)
+        return asyncio.run(request())
+
+    def test_interact_with_api(self):
+        response = self.get('/interact_with_api?country=us&category=health', cookies=self.cookie)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['articles'][0]['title'], 'us news')
+        self.assertEqual(self.asgi_app.news_client.params,
+                         [{'country': 'us', 'category': 'health'}])
+
+    def test_requires_login(self):
+        response = self.get('/interact_with_api?country=us&category=health')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.headers['location'], '/login')
+
+    def test_deleted_user_is_logged_out(self):
+        OutletPreferences.query.delete()
+        User.query.delete()
+        db.session.commit()
+        for path in ('/interact_with_api?country=us&category=health', '/user_home'):
+            response = self.get(path, cookies=self.cookie)
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.headers['location'], '/login')
+        self.assertEqual(self.asgi_app.news_client.params, [])
+
+    def test_other_routes_go_to_flask(self):
+        response = self.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Login", response.content)
+
+    def test_user_home_fetches_headlines_async(self):
+        """The upstream fallback for /user_home runs on the event loop"""
+        response = self.get('/user_home', cookies=self.cookie)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"bbc-news news", response.content)
+        self.assertEqual(self.asgi_app.news_client.params,
+                         [{'sources': 'bbc-news', 'pagesize': 50}])
+
+    def test_flask_requests_run_in_parallel(self):
+        """A slow Flask view doesn't queue the others behind it"""
+        def slow_app(environ, start_response):
+            time.sleep(0.3)
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            return [b'done']
+        asgi_app = ThreadedWsgiToAsgi(slow_app, threads=4)
+
+        async def requests():
+            transport = httpx.ASGITransport(app=asgi_app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+                return await asyncio.gather(*(client.get('/') for _ in range(4)))
+
+        start = time.perf_counter()
+        responses = asyncio.run(requests())
+        self.assertLess(time.perf_counter() - start, 0.9)
+        self.assertEqual([r.content for r in responses], [b'done'] * 4)
+
+    def test_interact_with_api_conditional_get(self):
+        response = self.get('/interact_with_api?country=us&category=health', cookies=self.cookie)
+        self.assertIn('max-age=', response.headers['cache-control'])
+
+        response = self.get('/interact_with_api?country=us&category=health', cookies=self.cookie,
+                            headers={'If-None-Match': response.headers['etag']})
+        self.assertEqual(response.status_code, 304)
+
+    def test_interact_with_api_compressed_like_flask(self):
+        encoding = 'br' if compression.brotli is not None else 'gzip'
+        with patch('compression.COMPRESS_MIN_SIZE', 0):
+            response = self.get('/interact_with_api?country=us&category=health',
+                                cookies=self.cookie, headers={'Accept-Encoding': encoding})
+        self.assertEqual(response.headers['content-encoding'], encoding)
+        self.assertEqual(response.headers['vary'], 'Cookie, Accept-Encoding')
+        self.assertTrue(response.headers['etag'].startswith('W/"'))
+        self.assertEqual(response.json()['articles'][0]['title'], 'us news')
+
+    def test_lifespan_registers_metrics_collector(self):
+        async def lifespan():
+            messages, sent = asyncio.Queue(), asyncio.Queue()
+            task = asyncio.ensure_future(self.asgi_app({'type': 'lifespan'}, messages.get, sent.put))
+            await messages.put({'type': 'lifespan.startup'})
+            await sent.get()
+            text = metrics.render_metrics()
+            await messages.put({'type': 'lifespan.shutdown'})
+            await sent.get()
+            await task
+            return text
+
+        self.assertIn('courier_upstream_lookups_total{client="async",outcome="called"} 0',
+                      asyncio.run(lifespan()))
+        self.assertNotIn(self.asgi_app.collect_metrics, metrics._collectors)
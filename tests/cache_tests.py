@@ -0,0 +1,100 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from cache import cache_key, MemoryCache, SQLiteCache, sqlite_connector
+
+
+class CacheKeyTest(TestCase):
+    """Tests cache key normalization."""
+
+    def test_list_order_is_ignored(self):
+        self.assertEqual(cache_key('/top-headlines', {'sources': 'bbc-news,cnn'}),
+                         cache_key('/top-headlines', {'sources': 'cnn,bbc-news'}))
+        self.assertEqual(cache_key('/top-headlines/sources', {'country': ['us', 'ar']}),
+                         cache_key('/top-headlines/sources', {'country': 'ar,US'}))
+
+    def test_param_order_and_empty_values_are_ignored(self):
+        self.assertEqual(cache_key('/top-headlines', {'country': 'us', 'category': 'health'}),
+                         cache_key('/top-headlines', {'category': 'health', 'country': 'us',
+                                                      'q': None}))
+
+    def test_endpoints_do_not_collide(self):
+        self.assertNotEqual(cache_key('/top-headlines', {'country': 'us'}),
+                            cache_key('/top-headlines/sources', {'country': 'us'}))
+
+
+class CacheBackendTests:
+    """Shared behaviour for every cache backend."""
+
+    def test_get_set(self):
+        self.cache.set('a', {'status': 'ok'}, 60)
+        self.assertEqual(self.cache.get('a'), {'status': 'ok'})
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_expiry(self):
+        self.cache.set('a', {'status': 'ok'}, 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_stale_entries_kept_for_max_stale(self):
+        self.cache.max_stale = 60
+        self.cache.set('a', {'status': 'ok'}, 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(self.cache.get_stale('a'), {'status': 'ok'})
+        self.assertIsNone(self.cache.get_stale('b'))
+
+        self.cache.max_stale = 0
+        self.assertIsNone(self.cache.get_stale('a'))
+
+    def test_lru_eviction(self):
+        """Least recently used entry is dropped once the size cap is passed"""
+        self.cache.set('a', 1, 60)
+        time.sleep(0.001)
+        self.cache.set('b', 2, 60)
+        time.sleep(0.001)
+        self.cache.get('a')
+        time.sleep(0.001)
+        self.cache.set('c', 3, 60)
+        time.sleep(0.001)
+        self.cache.set('d', 4, 60)
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('a'), 1)
+
+
+class MemoryCacheTest(CacheBackendTests, TestCase):
+
+    def setUp(self):
+        self.cache = MemoryCache(max_entries=3)
+
+
+class SQLiteCacheTest(CacheBackendTests, TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.cache = SQLiteCache(self.path, max_entries=3)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_shared_between_instances(self):
+        """Another worker pointed at the same file sees the entry"""
+        self.cache.set('a', {'status': 'ok'}, 60)
+        other = SQLiteCache(self.path, max_entries=3)
+        self.assertEqual(other.get('a'), {'status': 'ok'})
+
+    def test_one_connection_per_thread(self):
+        connect = sqlite_connector(self.path)
+        self.assertIs(connect(), connect())
+        other = []
+        thread = threading.Thread(target=lambda: other.append(connect()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], connect())
+        self.assertEqual(connect().execute("PRAGMA journal_mode").fetchone(), ('wal',))
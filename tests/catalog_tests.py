@@ -0,0 +1,82 @@
+import os
+import tempfile
+import time
+from unittest import TestCase
+
+from catalog import SourcesCatalog
+
+SOURCES = [
+    {'id': 'bbc-news', 'name': 'BBC News', 'category': 'general', 'country': 'gb'},
+    {'id': 'clarin', 'name': 'Clarin', 'category': 'general', 'country': 'ar'},
+    {'id': 'espn', 'name': 'ESPN', 'category': 'sports', 'country': 'us'},
+    {'id': 'cnn', 'name': 'CNN', 'category': 'general', 'country': 'us'},
+]
+
+
+class CatalogClient:
+    """Answers the unfiltered sources call the way the News API does."""
+
+    def __init__(self, status='ok'):
+        self.status = status
+        self.calls = 0
+
+    def fetch(self, endpoint, params=None, priority=None):
+        self.calls += 1
+        return {'status': self.status, 'sources': SOURCES}
+
+
+class SourcesCatalogTest(TestCase):
+    """Tests the local sources catalog."""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'sources.json')
+        self.catalog = SourcesCatalog(path=self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_not_ready_without_file(self):
+        self.assertFalse(self.catalog.is_ready())
+
+    def test_refresh_and_filter(self):
+        self.assertEqual(self.catalog.refresh(CatalogClient()), 4)
+        self.assertTrue(self.catalog.is_ready())
+        self.assertEqual([s['id'] for s in self.catalog.by_country('us')], ['espn', 'cnn'])
+        self.assertEqual([s['id'] for s in self.catalog.by_category('sports')], ['espn'])
+        self.assertEqual([s['id'] for s in self.catalog.for_countries(['ar', 'gb'])],
+                         ['clarin', 'bbc-news'])
+        self.assertEqual(self.catalog.by_country('zz'), [])
+
+    def test_failed_refresh_keeps_file(self):
+        self.catalog.refresh(CatalogClient())
+        self.assertIsNone(self.catalog.refresh(CatalogClient(status='error')))
+        self.assertEqual(len(self.catalog.sources), 4)
+
+    def test_other_process_sees_refresh(self):
+        """A worker picks up the file written by the refresh command"""
+        self.catalog.refresh(CatalogClient())
+        worker_catalog = SourcesCatalog(path=self.path)
+        client = CatalogClient()
+
+        self.assertTrue(worker_catalog.is_ready(client))
+        self.assertEqual(len(worker_catalog.by_country('us')), 2)
+        self.assertEqual(client.calls, 0)
+
+    def test_failed_background_refresh_backs_off(self):
+        """An upstream outage doesn't cause a full fetch on every page view"""
+        client = CatalogClient(status='error')
+        for _ in range(3):
+            self.assertFalse(self.catalog.is_ready(client))
+            while self.catalog._refreshing:
+                time.sleep(0.01)
+
+        self.assertEqual(client.calls, 1)
+
+        self.catalog.attempted_at -= self.catalog.retry_after
+        client.status = 'ok'
+        self.catalog.is_ready(client)
+        while self.catalog._refreshing:
+            time.sleep(0.01)
+        self.assertEqual(client.calls, 2)
+        self.assertTrue(self.catalog.is_ready(client))
@@ -0,0 +1,29 @@
+import gzip
+from unittest import TestCase, skipIf
+
+import compression
+from compression import accepted_encodings, choose_encoding, compress
+
+
+class CompressionTest(TestCase):
+    """Tests picking and applying a response coding."""
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip, deflate, br;q=0.5'), {'gzip', 'deflate', 'br'})
+        self.assertEqual(accepted_encodings('gzip;q=0, identity'), {'identity'})
+        self.assertEqual(accepted_encodings(None), set())
+
+    def test_small_bodies_are_not_compressed(self):
+        self.assertIsNone(choose_encoding('gzip', 10))
+        self.assertIsNone(choose_encoding('identity', 10000))
+        self.assertEqual(choose_encoding('gzip', 10000), 'gzip')
+
+    def test_gzip_round_trip(self):
+        body = b'{"articles":[]}' * 100
+        self.assertEqual(gzip.decompress(compress(body, 'gzip')), body)
+
+    @skipIf(compression.brotli is None, "brotli is not installed")
+    def test_prefers_brotli(self):
+        self.assertEqual(choose_encoding('gzip, br', 10000), 'br')
+        body = b'{"articles":[]}' * 100
+        self.assertEqual(compression.brotli.decompress(compress(body, 'br')), body)
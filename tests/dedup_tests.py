@@ -0,0 +1,106 @@
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///capstone_1_test"
+
+from app import create_app
+
+app = create_app('testing')
+app.app_context().push()
+from models import db, User, Story, OutletPreferences
+from ingest import upsert_stories
+from feeds import load_feed
+from dedup import (shingles, minhash, band_keys, similarity, MinHashIndex, cluster_stories,
+                   BANDS, NUM_HASHES)
+
+db.create_all()
+
+FED = "Fed holds interest rates steady, signals two cuts later this year"
+FED_AGAIN = "Fed holds rates steady and signals two cuts later this year"
+PHONE = "Apple unveils new iPhone with faster chip"
+
+
+def signature(text):
+    return minhash(shingles(text))
+
+
+def article(url, title, source_id, name, day=1):
+    return {'source': {'id': source_id, 'name': name}, 'title': f"{title} - {name}", 'url': url,
+            'publishedAt': f"2024-01-{day:02d}T00:00:00Z"}
+
+
+class SignatureTest(TestCase):
+    """Tests shingling, MinHash and the in-memory LSH index."""
+
+    def test_shingles_ignore_case_punctuation_and_outlet_suffix(self):
+        self.assertEqual(shingles("Rates HELD! - Reuters"), shingles("rates held"))
+        self.assertEqual(shingles("Rates held", "Fed"), {'rates', 'ates ', 'tes h', 'es he',
+                                                          's hel', ' held', 'held ', 'eld f',
+                                                          'ld fe', 'd fed'})
+        self.assertEqual(shingles("Hi"), {'hi'})
+
+    def test_similar_titles_share_bands(self):
+        self.assertEqual(len(signature(FED)), NUM_HASHES)
+        self.assertEqual(signature(FED), signature(FED))
+        self.assertGreater(similarity(signature(FED), signature(FED_AGAIN)), 0.5)
+        self.assertLess(similarity(signature(FED), signature(PHONE)), 0.2)
+
+        keys = band_keys(signature(FED))
+        self.assertEqual(len(set(keys)), BANDS)
+        self.assertTrue(set(keys) & set(band_keys(signature(FED_AGAIN))))
+
+    def test_index_matches_other_outlets(self):
+        index = MinHashIndex()
+        index.add(1, signature(FED), band_keys(signature(FED)), outlet=1)
+        index.add(2, signature(PHONE), band_keys(signature(PHONE)), outlet=2, cluster=9)
+        self.assertEqual(index.match(signature(FED_AGAIN), band_keys(signature(FED_AGAIN)), 3), 1)
+        self.assertIsNone(index.match(signature(FED_AGAIN), band_keys(signature(FED_AGAIN)), 1))
+        self.assertEqual(index.match(signature(PHONE), band_keys(signature(PHONE)), 3), 9)
+
+
+class ClusterTest(TestCase):
+    """Tests clustering ingested stories and collapsing them in feeds."""
+
+    def setUp(self):
+        user = User(username='reader', email='reader@test.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        db.session.add_all([OutletPreferences(user=self.user_id, outlet=o)
+                            for o in ('reuters', 'cnn', 'the-verge')])
+        upsert_stories([article('r1', FED, 'reuters', 'Reuters', 3),
+                        article('v1', PHONE, 'the-verge', 'The Verge', 2)])
+        upsert_stories([article('c1', FED_AGAIN, 'cnn', 'CNN', 4),
+                        article('c2', FED, 'cnn', 'CNN', 1)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def cluster(self, url):
+        return Story.query.filter_by(url=url).one().cluster
+
+    def test_ingest_clusters_across_outlets(self):
+        r1 = Story.query.filter_by(url='r1').one()
+        self.assertEqual(r1.cluster, r1.id)
+        self.assertEqual(self.cluster('c1'), r1.id)
+        self.assertEqual(self.cluster('c2'), r1.id)
+        self.assertNotEqual(self.cluster('v1'), r1.id)
+
+    def test_same_outlet_stays_apart(self):
+        upsert_stories([article('v2', PHONE + ' today', 'the-verge', 'The Verge')])
+        db.session.commit()
+        self.assertNotEqual(self.cluster('v2'), self.cluster('v1'))
+
+    def test_unchanged_story_keeps_cluster(self):
+        cluster = self.cluster('c1')
+        self.assertEqual(cluster_stories([Story.query.filter_by(url='c1').one().id]), 0)
+        self.assertEqual(self.cluster('c1'), cluster)
+
+    def test_feed_shows_one_card_per_cluster(self):
+        data = load_feed(self.user_id, ['reuters', 'cnn', 'the-verge'])
+        self.assertEqual([a['url'] for a in data['articles']], ['c1', 'v1'])
+        self.assertEqual(data['articles'][0]['alsoCoveredBy'], [{'name': 'Reuters', 'url': 'r1'}])
+        self.assertNotIn('alsoCoveredBy', data['articles'][1])
@@ -0,0 +1,158 @@
+"""A local stand-in for the News API, for tests and load tests.
+
+Answers /top-headlines and /top-headlines/sources from the recorded fixtures
+in tests/fixtures, filtered the way the real API filters them, with
+configurable latency, error rate and payload size. Run it on its own with
+
+    python tests/fake_newsapi.py --port 8790 --latency 0.1 --error-rate 0.01
+
+and point the app at it with NEWSAPI_BASE_URL=http://127.0.0.1:8790/v2.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+
+def error(code, message):
+    return {'status': 'error', 'code': code, 'message': message}
+
+
+class FakeNewsAPI:
+    """A threaded HTTP server that behaves like the parts of the News API we use.
+
+    `latency` seconds (plus up to `jitter`) are added to every response,
+    `error_rate` of requests fail with a 500, and `/top-headlines` returns up
+    to `articles` stories, cycling the fixtures when more are asked for.
+    These can be changed while the server runs. `requests` counts calls per
+    path.
+    """
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, error_rate=0.0, articles=20,
+                 api_key=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.articles = articles
+        self.api_key = api_key
+        self.headlines = load_fixture('top_headlines.json')['articles']
+        self.sources = load_fixture('sources.json')['sources']
+        self.requests = {}
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}/v2"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def respond(self, path, query, api_key):
+        """Return (status, body) for one request."""
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        if self.api_key is not None and api_key != self.api_key:
+            return 401, error('apiKeyInvalid', 'Your API key is invalid or incorrect.')
+        if random.random() < self.error_rate:
+            return 500, error('unexpectedError', 'This shouldn\'t happen, and if it does then '
+                              'it\'s our fault, not yours.')
+        if path == '/v2/top-headlines/sources':
+            return 200, self.sources_body(query)
+        if path == '/v2/top-headlines':
+            return self.headlines_body(query)
+        return 404, error('routeNotFound', 'Route not found.')
+
+    def sources_body(self, query):
+        countries = {c for value in query.get('country', []) for c in value.split(',')}
+        categories = set(query.get('category', []))
+        sources = [s for s in self.sources
+                   if (not countries or s['country'] in countries)
+                   and (not categories or s['category'] in categories)]
+        return {'status': 'ok', 'sources': sources}
+
+    def headlines_body(self, query):
+        sources = [s for value in query.get('sources', []) for s in value.split(',') if s]
+        country = query.get('country', [None])[0]
+        category = query.get('category', [None])[0]
+        if sources and (country or category):
+            return 400, error('parametersIncompatible', "You can't mix the sources param with "
+                              "the country or category params.")
+        if not (sources or country or category or query.get('q')):
+            return 400, error('parametersMissing', 'Required parameters are missing. Please set '
+                              'any of the following parameters and try again: sources, q, '
+                              'language, country, category.')
+        page_size = query.get('pageSize') or query.get('pagesize') or [self.articles]
+        count = min(int(page_size[0]), self.articles)
+
+        articles = []
+        for i in range(count):
+            article = dict(self.headlines[i % len(self.headlines)])
+            if sources:
+                source_id = sources[i % len(sources)]
+                article['source'] = {'id': source_id, 'name': source_id.replace('-', ' ').title()}
+            tag = ','.join(sources) or f"{country}-{category}"
+            article['url'] = f"{article['url']}?feed={tag}&n={i}"
+            articles.append(article)
+        return 200, {'status': 'ok', 'totalResults': len(articles), 'articles': articles}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                status, body = fake.respond(url.path.rstrip('/'), parse_qs(url.query),
+                                            self.headers.get('X-Api-Key'))
+                body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8790)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--articles', type=int, default=20)
+    args = parser.parse_args()
+    fake = FakeNewsAPI(args.port, args.latency, args.jitter, args.error_rate, args.articles)
+    print(f"Fake News API on {fake.url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+os.environ['DATABASE_URL'] = "postgresql:///capstone_1_test"
+
+from app import create_app
+
+app = create_app('testing')
+app.app_context().push()
+app.config['WTF_CSRF_ENABLED'] = False
+from models import db, User, Story, OutletPreferences, UserFeed
+from helpers import CURR_USER_KEY
+from ingest import upsert_stories
+from feeds import load_feed, build_feed
+from services import get_profile_cache
+
+db.create_all()
+
+
+def article(url, day, source_id='bbc-news', name='BBC News'):
+    return {'source': {'id': source_id, 'name': name}, 'title': f"Story {url}", 'url': url,
+            'publishedAt': f"2024-01-{day:02d}T00:00:00Z"}
+
+
+class FeedsTest(TestCase):
+    """Tests materialized home feeds and fan-out on ingest."""
+
+    def setUp(self):
+        self.users = {}
+        for name, outlets in (('bbc', ['bbc-news']), ('both', ['bbc-news', 'cnn']),
+                              ('cnn', ['cnn'])):
+            user = User(username=name, email=f"{name}@test.com", password='x')
+            db.session.add(user)
+            db.session.commit()
+            db.session.add_all([OutletPreferences(user=user.id, outlet=o) for o in outlets])
+            self.users[name] = user.id
+        upsert_stories([article('b1', 2), article('b2', 3),
+                        article('c1', 4, source_id='cnn', name='CNN')])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def urls(self, data):
+        return [a['url'] for a in data['articles']]
+
+    def test_load_builds_then_reads_stored_ids(self):
+        user_id = self.users['both']
+        self.assertIsNone(load_feed(user_id))
+        self.assertEqual(self.urls(load_feed(user_id, ['cnn', 'bbc-news'])), ['c1', 'b2', 'b1'])
+        self.assertEqual(db.session.get(UserFeed, user_id).sources, ['bbc-news', 'cnn'])
+
+        db.session.remove()
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            data = load_feed(user_id, ['bbc-news', 'cnn'])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual(self.urls(data), ['c1', 'b2', 'b1'])
+        self.assertEqual(data['articles'][0]['source']['name'], 'CNN')
+        # one lookup by user id and one batch fetch of the stories
+        self.assertEqual(len(statements), 2)
+
+    def test_ingest_fans_out_to_followers(self):
+        for user_id in self.users.values():
+            build_feed(user_id, list(db.session.scalars(
+                db.select(OutletPreferences.outlet).where(OutletPreferences.user == user_id))))
+        upsert_stories([article('b3', 5), article('c0', 1, source_id='cnn', name='CNN')])
+        db.session.commit()
+
+        self.assertEqual(self.urls(load_feed(self.users['bbc'])), ['b3', 'b2', 'b1'])
+        self.assertEqual(self.urls(load_feed(self.users['both'])), ['b3', 'c1', 'b2', 'b1', 'c0'])
+        self.assertEqual(self.urls(load_feed(self.users['cnn'])), ['c1', 'c0'])
+
+    def test_fan_out_keeps_feed_length(self):
+        user_id = self.users['bbc']
+        with patch('feeds.FEED_LENGTH', 2):
+            build_feed(user_id, ['bbc-news'])
+            upsert_stories([article('b3', 5), article('b0', 1)])
+            db.session.commit()
+        self.assertEqual(db.session.get(UserFeed, user_id).story_ids,
+                         [Story.query.filter_by(url=url).one().id for url in ('b3', 'b2')])
+
+    def test_stale_or_changed_feeds_are_rebuilt(self):
+        user_id = self.users['bbc']
+        build_feed(user_id, ['bbc-news'])
+        self.assertEqual(self.urls(load_feed(user_id, ['bbc-news', 'cnn'])), ['c1', 'b2', 'b1'])
+
+        UserFeed.query.update({'built_at': datetime.utcnow() - timedelta(days=1)})
+        db.session.commit()
+        self.assertIsNone(load_feed(user_id))
+
+        # nothing stored for a newly followed outlet: no feed until the ingester catches up
+        self.assertIsNone(load_feed(user_id, ['bbc-news', 'espn']))
+        self.assertIsNone(db.session.get(UserFeed, user_id))
+
+    def test_submit_prefs_rebuilds_feed(self):
+        user_id = self.users['bbc']
+        build_feed(user_id, ['bbc-news'])
+        get_profile_cache().clear()
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+            c.post('/submit_prefs', data={'countries[]': ['us'], 'outlets[]': ['cnn']})
+        db.session.remove()
+        feed = db.session.get(UserFeed, user_id)
+        self.assertEqual(feed.sources, ['cnn'])
+        self.assertEqual(self.urls(load_feed(user_id)), ['c1'])
@@ -0,0 +1,124 @@
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///capstone_1_test"
+
+from app import create_app
+
+app = create_app('testing')
+app.app_context().push()
+from models import db, User, Story, Outlet, OutletPreferences, CountryPreferences
+from config import INGEST_INTERVAL, NEWSAPI_DAILY_QUOTA, NEWSAPI_BACKGROUND_RESERVE
+from ingest import (tracked_queries, upsert_stories, ingest_once, local_headlines, paced_interval,
+                    SECONDS_PER_DAY)
+
+db.create_all()
+
+
+def article(url, title='Title', source_id='bbc-news', name='BBC News', published='2024-01-01T00:00:00Z'):
+    return {'source': {'id': source_id, 'name': name}, 'author': 'A', 'title': title,
+            'description': 'D', 'url': url, 'urlToImage': None, 'publishedAt': published}
+
+
+class HeadlinesClient:
+    """Returns canned headlines for every query."""
+
+    def __init__(self, articles):
+        self.articles = articles
+        self.params = []
+
+    def fetch(self, endpoint, params=None, priority=None):
+        self.params.append(params)
+        return {'status': 'ok', 'articles': self.articles}
+
+
+class IngestTest(TestCase):
+    """Tests headline ingestion into stories and outlets."""
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def test_upsert_dedupes_by_url(self):
+        count = upsert_stories([article('http://a'), article('http://a', title='Updated'),
+                                article('http://b', source_id=None, name='Wire')])
+        db.session.commit()
+        upsert_stories([article('http://a', title='Again')], country='gb', category='general')
+        db.session.commit()
+
+        self.assertEqual(count, 2)
+        self.assertEqual(Story.query.count(), 2)
+        self.assertEqual(Outlet.query.count(), 2)
+        story = Story.query.filter_by(url='http://a').one()
+        self.assertEqual(story.title, 'Again')
+        self.assertEqual(story.country, 'gb')
+        self.assertEqual(story.source.source_id, 'bbc-news')
+
+    def test_skips_removed_articles(self):
+        self.assertEqual(upsert_stories([article('http://a', title='[Removed]')]), 0)
+
+    def test_tracked_queries(self):
+        user = User(username='user1', email='joe@shmoe.com', password='pass')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add_all([OutletPreferences(user=user.id, outlet='cnn'),
+                            OutletPreferences(user=user.id, outlet='bbc-news'),
+                            CountryPreferences(user=user.id, country='us')])
+        db.session.commit()
+
+        queries = tracked_queries()
+        self.assertEqual(queries[0], {'sources': 'bbc-news,cnn'})
+        self.assertIn({'country': 'us', 'category': 'health'}, queries)
+
+    def test_a_day_of_ticks_fits_the_background_budget(self):
+        budget = int(NEWSAPI_DAILY_QUOTA * (1 - NEWSAPI_BACKGROUND_RESERVE))
+        # one followed country plus outlets, two countries, and more than a day's budget allows
+        for queries in (8, 15, 50, budget + 1):
+            now, used, short_ticks, last_tick = 0.0, 0, 0, 0.0
+            while now < SECONDS_PER_DAY:
+                spent = min(queries, budget - used)
+                if spent:
+                    used += spent
+                    short_ticks += spent < queries
+                    last_tick = now
+                pause = paced_interval(INGEST_INTERVAL, queries, budget - used,
+                                       SECONDS_PER_DAY - now)
+                self.assertGreaterEqual(pause, INGEST_INTERVAL)
+                now += pause
+            self.assertLessEqual(used, budget)
+            if queries <= budget:
+                self.assertEqual(short_ticks, 0)
+                # still polling near the end of the day rather than out of budget by noon
+                self.assertGreater(last_tick, SECONDS_PER_DAY * 0.9)
+
+    def test_local_headlines(self):
+        user = User(username='user1', email='joe@shmoe.com', password='pass')
+        db.session.add(user)
+        db.session.commit()
+        db.session.add(OutletPreferences(user=user.id, outlet='bbc-news'))
+        db.session.commit()
+        client = HeadlinesClient([article('http://old', published='2024-01-01T00:00:00Z'),
+                                  article('http://new', published='2024-01-02T00:00:00Z'),
+                                  article('http://cnn', source_id='cnn', name='CNN')])
+        ingest_once(client)
+
+        data = local_headlines(sources=['bbc-news'])
+        self.assertEqual([a['url'] for a in data['articles']], ['http://new', 'http://old'])
+        self.assertEqual(data['articles'][0]['source']['name'], 'BBC News')
+        self.assertIsNone(local_headlines(sources=['espn']))
+        # a newly followed outlet with nothing stored yet sends the feed upstream
+        self.assertIsNone(local_headlines(sources=['bbc-news', 'espn']))
+        # without both a country and a category the query is upstream's to answer
+        self.assertIsNone(local_headlines(country='us'))
+        upsert_stories([article('http://gb', source_id='bbc-news')], country='gb', category='health')
+        db.session.commit()
+        self.assertEqual([a['url'] for a in local_headlines(country='gb', category='health')['articles']],
+                         ['http://gb'])
+        self.assertIsNone(local_headlines())
+
+        # stale stories are not served
+        Story.query.update({'fetched_at': datetime.utcnow() - timedelta(days=1)})
+        db.session.commit()
+        self.assertIsNone(local_headlines(sources=['bbc-news']))
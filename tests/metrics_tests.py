@@ -0,0 +1,78 @@
+from unittest import TestCase
+
+from metrics import (Histogram, RequestTimer, UPSTREAM_LOOKUPS, UPSTREAM_POOL, render_metrics,
+                     observe_news_client, add_collector, remove_collector)
+
+
+class HistogramTestCase(TestCase):
+    """Tests the Prometheus histogram."""
+
+    def test_render(self):
+        histogram = Histogram('test_seconds', 'Test latency.', ('route',), buckets=(0.1, 1.0))
+        histogram.observe(0.05, route='/a')
+        histogram.observe(0.5, route='/a')
+        histogram.observe(5, route='/a')
+
+        self.assertEqual(histogram.render().splitlines(), [
+            '# HELP test_seconds Test latency.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{route="/a",le="0.1"} 1',
+            'test_seconds_bucket{route="/a",le="1.0"} 2',
+            'test_seconds_bucket{route="/a",le="+Inf"} 3',
+            'test_seconds_sum{route="/a"} 5.550000',
+            'test_seconds_count{route="/a"} 3',
+        ])
+        self.assertEqual(histogram.count(route='/a'), 3)
+        self.assertEqual(histogram.count(route='/b'), 0)
+
+    def test_label_values_escaped(self):
+        histogram = Histogram('test_seconds', 'Test latency.', ('route',), buckets=())
+        histogram.observe(1, route='say "hi"\n')
+        self.assertIn('test_seconds_count{route="say \\"hi\\"\\n"} 1', histogram.render())
+
+
+class RequestTimerTestCase(TestCase):
+    """Tests the per-request phase breakdown."""
+
+    def test_render_excludes_waits_inside_it(self):
+        timer = RequestTimer()
+        timer.render_started()
+        # a lazily loaded feed waits on upstream in the middle of the render
+        timer.phases['upstream'] += 60
+        timer.render_finished()
+        self.assertEqual(timer.phases['render'], 0.0)
+        self.assertIn('upstream 60000 ms', timer.summary())
+
+
+class NewsClientMetricsTestCase(TestCase):
+    """Tests exporting the News API client's own counters."""
+
+    def tearDown(self):
+        UPSTREAM_LOOKUPS.clear()
+        UPSTREAM_POOL.clear()
+
+    def test_client_stats_exported(self):
+        observe_news_client({'single_flight': {'calls': 3, 'coalesced': 4},
+                             'background_refreshes': 1,
+                             'pools': {'https://newsapi.org:443': {
+                                 'maxsize': 10, 'connections': 2, 'requests': 7, 'idle': 1}}},
+                            'sync')
+        text = render_metrics()
+        self.assertIn('courier_upstream_lookups_total{client="sync",outcome="called"} 3\n', text)
+        self.assertIn('courier_upstream_lookups_total{client="sync",outcome="coalesced"} 4\n', text)
+        self.assertIn('courier_upstream_lookups_total{client="sync",outcome="refreshed"} 1\n', text)
+        self.assertIn('courier_upstream_pool_connections{host="https://newsapi.org:443",'
+                      'state="opened"} 2\n', text)
+        self.assertIn('courier_upstream_pool_connections{host="https://newsapi.org:443",'
+                      'state="idle"} 1\n', text)
+
+    def test_failing_collector_is_logged_and_skipped(self):
+        def broken():
+            raise AttributeError('stats')
+
+        add_collector(broken)
+        try:
+            with self.assertLogs('metrics', 'ERROR'):
+                self.assertIn('courier_request_duration_seconds', render_metrics())
+        finally:
+            remove_collector(broken)
@@ -2,11 +2,15 @@ import os
 from unittest import TestCase
 from models import db, User, CountryPreferences, OutletPreferences
 from sqlalchemy.exc import IntegrityError, DataError
+from services import get_password_hasher
 
 
 os.environ['DATABASE_URL'] = "postgresql:///capstone_1_test"
 
-from app import app
+from app import create_app
+
+app = create_app('testing')
+app.app_context().push()
 
 db.create_all()
 
@@ -178,6 +182,28 @@ class UserModelTest(TestCase):
          self.assertFalse(false_password)
          self.assertFalse(false_username)
 
+    def test_authenticate_rehashes(self):
+         """Password is rehashed on login when the configured cost changes"""
+         hasher = get_password_hasher()
+         rounds = hasher.rounds
+         hasher.rounds = 4
+         try:
+              User.signup(
+                   username = 'user1',
+                   email = 'joe@shmoe.com',
+                   password = 'pass',
+                   image_url = 'www.google.com'
+              )
+              db.session.commit()
+              hasher.rounds = 5
+              user = User.authenticate("user1", "pass")
+              db.session.commit()
+         finally:
+              hasher.rounds = rounds
+
+         self.assertTrue(user.password.startswith('$2b$05$'))
+         self.assertTrue(User.authenticate("user1", "pass"))
+
 
 class StoryModelTest(TestCase):
     """Tests story model. Currently there is no functionality to store the story to the db; can add later if time"""
@@ -258,6 +284,24 @@ class CountryPreferencesTest(TestCase):
           pref = CountryPreferences.query.filter_by(user=1).first()
           self.assertIsNone(pref)
 
+     def test_unique_user_country(self):
+          """A user can't hold the same country twice"""
+          user = User(
+            username = 'user1',
+            email = 'joe@shmoe.com',
+            password = 'pass',
+            image_url = 'www.google.com'
+          )
+          db.session.add(user)
+          db.session.commit()
+
+          db.session.add(CountryPreferences(user=user.id, country="us"))
+          db.session.commit()
+          db.session.add(CountryPreferences(user=user.id, country="us"))
+          with self.assertRaises(IntegrityError):
+               db.session.commit()
+          db.session.rollback()
+
 
 class TestOutletPreferences(TestCase):
      """Tests media preferences model."""
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from cache import MemoryCache, cache_key
+from fake_newsapi import FakeNewsAPI
+from newsapi import NewsAPIClient, AsyncNewsAPIClient
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers every GET with a small News API style body over keep-alive."""
+    protocol_version = 'HTTP/1.1'
+
+    calls = 0
+
+    def do_GET(self):
+        StubHandler.calls += 1
+        if 'slow' in self.path:
+            time.sleep(0.5)
+        if 'limited' in self.path:
+            body = json.dumps({'status': 'error', 'code': 'rateLimited'}).encode()
+            self.send_response(429)
+            self.send_header('Retry-After', '3600')
+        else:
+            body = json.dumps({'status': 'ok', 'path': self.path}).encode()
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class NewsAPIClientTest(TestCase):
+    """Tests the pooled News API client."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = NewsAPIClient('key', base_url=f"http://127.0.0.1:{self.server.server_port}",
+                                    retries=0)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_connection(self):
+        """Repeated calls should go over one kept-alive connection"""
+        for _ in range(3):
+            data = self.client.get('/top-headlines', params={'country': 'us'})
+            self.assertEqual(data['status'], 'ok')
+
+        pools = list(self.client.pool_stats().values())
+        self.assertEqual(pools[0]['connections'], 1)
+        self.assertEqual(pools[0]['requests'], 3)
+        self.assertEqual(pools[0]['idle'], 1)
+
+    def test_records_endpoint_stats(self):
+        self.client.get('/top-headlines')
+        self.client.get('/top-headlines/sources')
+        self.client.get('/top-headlines/sources')
+
+        stats = self.client.endpoint_stats()
+        self.assertEqual(stats['/top-headlines']['count'], 1)
+        self.assertEqual(stats['/top-headlines/sources']['count'], 2)
+        self.assertEqual(stats['/top-headlines/sources']['statuses'], {200: 2})
+
+    def test_network_error_returns_error_body(self):
+        """Connection failures come back shaped like a News API error"""
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        client = NewsAPIClient('key', base_url=f"http://127.0.0.1:{port}", retries=0)
+
+        data = client.get('/top-headlines')
+        self.assertEqual(data['status'], 'error')
+        self.assertEqual(data['code'], 'upstreamUnavailable')
+        self.assertEqual(client.endpoint_stats()['/top-headlines']['errors'], 1)
+
+    def test_rate_limited_calls_are_not_retried(self):
+        """A 429 means the quota is spent, so retrying only spends more of it"""
+        client = NewsAPIClient('key', base_url=f"http://127.0.0.1:{self.server.server_port}",
+                               retries=2, backoff=0)
+        StubHandler.calls = 0
+        start = time.perf_counter()
+        data = client.get('/top-headlines', params={'q': 'limited'})
+
+        self.assertEqual(data['code'], 'rateLimited')
+        self.assertEqual(StubHandler.calls, 1)
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_cache_serves_repeat_queries(self):
+        """Equivalent queries should only reach upstream once"""
+        client = NewsAPIClient('key', base_url=f"http://127.0.0.1:{self.server.server_port}",
+                               retries=0, cache=MemoryCache())
+        client.get('/top-headlines', params={'sources': 'bbc-news,cnn'})
+        data = client.get('/top-headlines', params={'sources': 'cnn,bbc-news'})
+
+        self.assertEqual(data['status'], 'ok')
+        self.assertEqual(client.endpoint_stats()['/top-headlines']['count'], 1)
+
+    def test_get_many_keeps_order(self):
+        countries = ['us', 'ar', 'gb', 'fr']
+        data = self.client.get_many('/top-headlines/sources',
+                                    [{'country': country} for country in countries])
+        self.assertEqual([d['path'] for d in data],
+                         [f"/top-headlines/sources?country={country}" for country in countries])
+
+    def test_get_many_deadline(self):
+        """A slow lookup times out without holding up the others"""
+        start = time.perf_counter()
+        data = self.client.get_many('/top-headlines/sources',
+                                    [{'country': 'us'}, {'country': 'slow'}], deadline=0.2)
+
+        self.assertLess(time.perf_counter() - start, 0.45)
+        self.assertEqual(data[0]['status'], 'ok')
+        self.assertEqual(data[1]['code'], 'upstreamTimeout')
+
+    def test_concurrent_identical_calls_are_coalesced(self):
+        """Identical in-flight queries share one upstream call"""
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                       self.client.get('/top-headlines', params={'country': 'slow'})))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual(self.client.endpoint_stats()['/top-headlines']['count'], 1)
+        self.assertEqual(self.client.stats()['single_flight'], {'calls': 1, 'coalesced': 4})
+
+
+class StaleWhileRevalidateTest(TestCase):
+    """Tests serving expired and last good responses."""
+
+    params = {'country': 'us', 'category': 'general'}
+
+    def setUp(self):
+        self.fake = FakeNewsAPI().start()
+        self.cache = MemoryCache(max_stale=3600)
+        self.client = NewsAPIClient('key', base_url=self.fake.url, retries=0, cache=self.cache,
+                                    stale_while_revalidate=60)
+        self.first = self.client.get('/top-headlines', params=self.params)
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def expire(self, seconds_ago):
+        key = cache_key('/top-headlines', self.params)
+        self.cache._entries[key] = (time.time() - seconds_ago, self.first)
+
+    def wait_for_refreshes(self):
+        self.client._refresh_executor.submit(lambda: None).result()
+        while self.client._refreshing:
+            time.sleep(0.01)
+
+    def test_expired_entry_served_while_refreshed_once(self):
+        self.expire(5)
+        self.fake.latency = 0.2
+        start = time.perf_counter()
+        results = [self.client.get('/top-headlines', params=self.params) for _ in range(5)]
+        self.assertLess(time.perf_counter() - start, 0.1)
+        self.assertTrue(all(result is self.first for result in results))
+
+        self.wait_for_refreshes()
+        self.assertEqual(self.fake.requests, {'/v2/top-headlines': 2})
+        self.assertIsNot(self.client.get('/top-headlines', params=self.params), self.first)
+        self.assertEqual(self.client.stats()['background_refreshes'], 1)
+
+    def test_too_stale_entry_is_refetched(self):
+        self.expire(120)
+        data = self.client.get('/top-headlines', params=self.params)
+        self.assertIsNot(data, self.first)
+        self.assertEqual(self.client.stats()['background_refreshes'], 0)
+
+    def test_upstream_error_serves_last_good(self):
+        self.expire(120)
+        self.fake.error_rate = 1
+        self.assertIs(self.client.get('/top-headlines', params=self.params), self.first)
+
+        data = self.client.get('/top-headlines', params={'country': 'gb', 'category': 'general'})
+        self.assertEqual(data['code'], 'unexpectedError')
+
+
+class SlowQuota:
+    """A quota that always grants, after blocking like a contended SQLite lock."""
+
+    def __init__(self):
+        self.threads = set()
+
+    def acquire(self, priority):
+        self.threads.add(threading.current_thread())
+        time.sleep(0.2)
+        return 0
+
+
+class AsyncNewsAPIClientTest(TestCase):
+    """Tests the ASGI mode's client."""
+
+    def setUp(self):
+        self.fake = FakeNewsAPI().start()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_quota_and_cache_do_not_block_the_loop(self):
+        quota = SlowQuota()
+
+        async def run():
+            client = AsyncNewsAPIClient('key', base_url=self.fake.url, retries=0,
+                                        cache=MemoryCache(), quota=quota)
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    await asyncio.sleep(0.01)
+                    ticks += 1
+
+            ticker = asyncio.ensure_future(tick())
+            data = await client.get('/top-headlines', params={'country': 'us'})
+            ticker.cancel()
+            await client.aclose()
+            return data, ticks
+
+        data, ticks = asyncio.run(run())
+        self.assertEqual(data['status'], 'ok')
+        self.assertGreater(ticks, 10)
+        self.assertNotIn(threading.main_thread(), quota.threads)
@@ -0,0 +1,58 @@
+import threading
+from unittest import TestCase
+
+from passwords import PasswordHasher, PasswordQueueFull
+
+
+class PasswordHasherTest(TestCase):
+    """Tests hashing on the bounded bcrypt pool."""
+
+    def test_hash_and_check(self):
+        hasher = PasswordHasher(rounds=4, workers=1, queue_depth=1)
+        pw_hash = hasher.hash('secret')
+        self.assertTrue(pw_hash.startswith('$2b$04$'))
+        self.assertTrue(hasher.check(pw_hash, 'secret'))
+        self.assertFalse(hasher.check(pw_hash, 'wrong'))
+        self.assertFalse(hasher.check('not-a-hash', 'secret'))
+
+    def test_needs_rehash(self):
+        pw_hash = PasswordHasher(rounds=4).hash('secret')
+        self.assertFalse(PasswordHasher(rounds=4).needs_rehash(pw_hash))
+        self.assertTrue(PasswordHasher(rounds=5).needs_rehash(pw_hash))
+
+    def test_queue_full(self):
+        """Callers are turned away once every slot is taken"""
+        hasher = PasswordHasher(rounds=4, workers=1, queue_depth=0, queue_timeout=0.05)
+        release = threading.Event()
+        started = threading.Event()
+
+        def block():
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=hasher._run, args=(block,))
+        thread.start()
+        started.wait()
+        with self.assertRaises(PasswordQueueFull):
+            hasher.hash('secret')
+        release.set()
+        thread.join()
+
+        self.assertEqual(hasher.rejected, 1)
+        self.assertTrue(hasher.check(hasher.hash('secret'), 'secret'))
+
+    def test_rejections_counted_across_threads(self):
+        hasher = PasswordHasher(rounds=4, workers=1, queue_depth=0, queue_timeout=0)
+        hasher._slots.acquire()
+
+        def reject():
+            for _ in range(1000):
+                with self.assertRaises(PasswordQueueFull):
+                    hasher.hash('secret')
+
+        threads = [threading.Thread(target=reject) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(hasher.rejected, 8000)
@@ -0,0 +1,128 @@
+import os
+import tempfile
+from unittest import TestCase
+
+import metrics
+from cache import MemoryCache
+from fake_newsapi import FakeNewsAPI
+from newsapi import NewsAPIClient
+from quota import MemoryQuota, SQLiteQuota, INTERACTIVE, BACKGROUND
+
+
+class QuotaTests:
+    """Shared behaviour for every quota backend."""
+
+    def test_burst_then_refill(self):
+        for _ in range(10):
+            self.assertEqual(self.quota.acquire(), 0)
+        wait = self.quota.acquire()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+
+    def test_background_leaves_a_reserve(self):
+        """Background work stops at 80% of the bucket; page views can use the rest"""
+        granted = 0
+        while self.quota.acquire(BACKGROUND) == 0:
+            granted += 1
+        self.assertEqual(granted, 8)
+        self.assertEqual(self.quota.acquire(INTERACTIVE), 0)
+        self.assertEqual(self.quota.acquire(INTERACTIVE), 0)
+
+    def test_daily_limit(self):
+        self.quota = self.make_quota(rate=1000, burst=1000, daily_limit=100)
+        for _ in range(100):
+            self.assertEqual(self.quota.acquire(), 0)
+        self.assertEqual(self.quota.acquire(), float('inf'))
+        self.assertEqual(self.quota.usage(), {'used': 100, 'limit': 100})
+
+    def test_background_remaining(self):
+        self.quota = self.make_quota(rate=1000, burst=1000, daily_limit=100)
+        self.assertEqual(self.quota.background_remaining(), 80)
+        for _ in range(3):
+            self.quota.acquire(INTERACTIVE)
+        self.assertEqual(self.quota.background_remaining(), 77)
+        for _ in range(90):
+            self.quota.acquire(INTERACTIVE)
+        self.assertEqual(self.quota.background_remaining(), 0)
+
+
+class MemoryQuotaTest(QuotaTests, TestCase):
+
+    def setUp(self):
+        self.quota = self.make_quota(rate=10, burst=10, daily_limit=100)
+
+    def make_quota(self, **kwargs):
+        return MemoryQuota(**kwargs)
+
+    def test_new_day_resets_usage(self):
+        self.quota.acquire()
+        self.quota._state.day = '2000-01-01'
+        self.assertEqual(self.quota.usage()['used'], 0)
+
+
+class SQLiteQuotaTest(QuotaTests, TestCase):
+
+    def setUp(self):
+        self.paths = []
+        self.quota = self.make_quota(rate=10, burst=10, daily_limit=100)
+
+    def make_quota(self, **kwargs):
+        fd, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        self.paths.append(path)
+        return SQLiteQuota(path, **kwargs)
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def test_shared_between_workers(self):
+        """Another worker pointed at the same file spends from the same budget"""
+        other = SQLiteQuota(self.quota.path, rate=10, burst=10, daily_limit=100)
+        for _ in range(5):
+            self.quota.acquire()
+            other.acquire()
+        self.assertGreater(other.acquire(), 0)
+        self.assertEqual(self.quota.usage()['used'], 10)
+
+
+class BudgetedClientTest(TestCase):
+    """Tests the News API client over its request budget."""
+
+    def setUp(self):
+        self.fake = FakeNewsAPI().start()
+        self.quota = MemoryQuota(rate=0.001, burst=1, daily_limit=100)
+        self.cache = MemoryCache(max_stale=60)
+        self.client = NewsAPIClient('key', base_url=self.fake.url, retries=0, cache=self.cache,
+                                    quota=self.quota, quota_max_wait=0)
+        metrics.UPSTREAM_DENIED.clear()
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_over_budget_serves_stale(self):
+        params = {'country': 'us', 'category': 'general'}
+        fresh = self.client.get('/top-headlines', params=params)
+        self.assertEqual(fresh['status'], 'ok')
+        # expire the entry
+        self.cache._entries['/top-headlines?category=general&country=us'] = (0, fresh)
+        self.cache.max_stale = float('inf')
+
+        self.assertIs(self.client.get('/top-headlines', params=params), fresh)
+        self.assertEqual(self.fake.requests, {'/v2/top-headlines': 1})
+        self.assertEqual(metrics.UPSTREAM_DENIED.get(priority=INTERACTIVE), 1)
+
+    def test_over_budget_without_cache(self):
+        self.client.get('/top-headlines', params={'country': 'us', 'category': 'general'})
+        data = self.client.get('/top-headlines', params={'country': 'gb', 'category': 'general'})
+        self.assertEqual(data['code'], 'upstreamBudgetSpent')
+        self.assertEqual(self.fake.requests, {'/v2/top-headlines': 1})
+
+    def test_waits_briefly_for_a_token(self):
+        self.quota.rate = 20
+        self.client.quota_max_wait = 0.5
+        for country in ('us', 'gb', 'ar'):
+            data = self.client.get('/top-headlines', params={'country': country,
+                                                             'category': 'general'})
+            self.assertEqual(data['status'], 'ok')
+        self.assertEqual(metrics.UPSTREAM_DENIED.get(priority=INTERACTIVE), 0)
@@ -0,0 +1,156 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event
+
+os.environ['DATABASE_URL'] = "postgresql:///capstone_1_test"
+
+from app import create_app
+
+app = create_app('testing')
+app.app_context().push()
+app.config['WTF_CSRF_ENABLED'] = False
+from models import db, User, Story, Content, Likes, OutletPreferences
+from helpers import CURR_USER_KEY
+from ingest import upsert_stories
+from feeds import load_feed
+from services import get_profile_cache
+from ranking import (Candidates, affinities, score, liked_stories, like_story, unlike_story,
+                     rank_stories, tag_stories)
+
+db.create_all()
+
+# 2024-01-01T00:00:00Z
+NOW = 1704067200
+
+
+def article(url, title, day=1, source_id='bbc-news', name='BBC News'):
+    return {'source': {'id': source_id, 'name': name}, 'title': title, 'url': url,
+            'publishedAt': f"2024-01-{day:02d}T00:00:00Z"}
+
+
+class ScoreTest(TestCase):
+    """Tests the vectorized scoring, without the database."""
+
+    def test_recency_halves_every_half_life(self):
+        candidates = Candidates([1, 1, 1], [[], [], []],
+                                ['2024-01-01T00:00:00Z', '2023-12-31T18:00:00Z', None], now=NOW)
+        self.assertEqual(list(candidates.recency), [1.0, 0.5, 0.0])
+
+    def test_affinity_is_share_of_likes(self):
+        candidates = Candidates([1, 2, None], [[10, 11], [12], []], [None, None, None], now=NOW)
+        likes = [[(1, [10]), (1, [10, 12]), (3, [11]), (None, [])], []]
+        outlet_affinity, tag_affinity = affinities(likes, candidates)
+        # columns are sorted ids, unknown outlets (-1) first
+        self.assertEqual(outlet_affinity.tolist(), [[0, 0.5, 0], [0, 0, 0]])
+        self.assertEqual(tag_affinity.tolist(), [[0.5, 0.25, 0.25], [0, 0, 0]])
+
+        scores = score(candidates, outlet_affinity, tag_affinity)
+        self.assertEqual(scores.shape, (2, 3))
+        # outlet 0.5 * 0.5, tags (0.5 + 0.25) / 2
+        self.assertAlmostEqual(scores[0, 0], 0.25 + 0.375)
+        self.assertAlmostEqual(scores[0, 1], 0.25)
+        self.assertEqual(scores[0, 2], 0)
+        self.assertEqual(scores[1].tolist(), [0, 0, 0])
+
+    def test_empty_batch(self):
+        candidates = Candidates([], [], [], now=NOW)
+        self.assertEqual(score(candidates, *affinities([[(1, [2])]], candidates)).shape, (1, 0))
+
+
+class RankingTest(TestCase):
+    """Tests likes, tagging and ranking over stored stories."""
+
+    def setUp(self):
+        self.client = app.test_client()
+        get_profile_cache().clear()
+        user = User(username='reader', email='reader@test.com', password='x')
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        db.session.add_all([OutletPreferences(user=self.user_id, outlet=o)
+                            for o in ('bbc-news', 'cnn')])
+        upsert_stories([article('b1', 'Election results are in', 3),
+                        article('b2', 'Football final tonight', 2),
+                        article('c1', 'Election recount ordered', 1, 'cnn', 'CNN'),
+                        article('c2', 'Weather turns cold', 4, 'cnn', 'CNN')],
+                       category='general')
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def story(self, url):
+        return Story.query.filter_by(url=url).one()
+
+    def tag_names(self, url):
+        return {content.name for content in
+                Content.query.filter(Content.id.in_(self.story(url).tags))}
+
+    def test_ingest_tags_stories(self):
+        self.assertEqual(self.tag_names('b1'), {'elect', 'result', 'category:general'})
+        self.assertEqual(Content.query.filter_by(name='elect').count(), 1)
+
+        Story.query.update({'tags': None})
+        db.session.commit()
+        tag_stories()
+        self.assertEqual(self.tag_names('c2'), {'weather', 'turn', 'cold', 'category:general'})
+
+    def test_like_is_idempotent(self):
+        story_id = self.story('b1').id
+        like_story(self.user_id, story_id)
+        like_story(self.user_id, story_id)
+        self.assertEqual(Likes.query.filter_by(user=self.user_id).count(), 1)
+        unlike_story(self.user_id, story_id)
+        self.assertEqual(Likes.query.filter_by(user=self.user_id).count(), 0)
+
+    def test_liked_stories_keeps_latest(self):
+        for url in ('b1', 'b2', 'c2'):
+            like_story(self.user_id, self.story(url).id)
+        with patch('ranking.RANK_MAX_LIKES', 2):
+            likes = liked_stories([self.user_id, 0])
+        self.assertEqual([outlet for outlet, _ in likes[0]],
+                         [self.story('c2').outlet, self.story('b2').outlet])
+        self.assertEqual(likes[1], [])
+
+    def test_without_likes_order_is_kept(self):
+        stories = Story.query.order_by(Story.date.desc()).all()
+        self.assertEqual(rank_stories(self.user_id, stories), stories)
+
+    def test_likes_rank_outlet_and_tags(self):
+        like_story(self.user_id, self.story('b1').id)
+        urls = [story.url for story in
+                rank_stories(self.user_id, Story.query.order_by(Story.date.desc()).all())]
+        # b1 shares outlet and tags, b2 the outlet, c1 'elect'; c2 only the category
+        self.assertEqual(urls, ['b1', 'b2', 'c1', 'c2'])
+
+    def test_home_feed_is_ranked(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            self.assertEqual(c.post('/api/like?url=c1').json, {'status': 'ok', 'liked': True})
+            self.assertEqual(c.post('/api/like?url=nowhere').status_code, 404)
+            page = c.get('/api/feed').json
+            self.assertEqual([a['url'] for a in page['articles']][:2], ['c1', 'c2'])
+
+            self.assertEqual(c.delete('/api/like?url=c1').json, {'status': 'ok', 'liked': False})
+            self.assertEqual([a['url'] for a in load_feed(self.user_id)['articles']],
+                             ['c2', 'b1', 'b2', 'c1'])
+
+    def test_ranked_feed_read_is_two_statements(self):
+        like_story(self.user_id, self.story('c1').id)
+        load_feed(self.user_id, ['bbc-news', 'cnn'])
+        db.session.remove()
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        try:
+            data = load_feed(self.user_id)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', listener)
+        self.assertEqual([a['url'] for a in data['articles']][0], 'c1')
+        # the likes ride along with the feed lookup
+        self.assertEqual(len(statements), 2)
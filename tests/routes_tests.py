@@ -1,24 +1,59 @@
+import gzip
+import json
 import os
+import tempfile
+from datetime import datetime
 from unittest import TestCase
-from flask import session
-from models import db, User, CountryPreferences
+from unittest.mock import patch
+from flask import session, g
+from sqlalchemy import event
+from models import db, User, CountryPreferences, OutletPreferences, Story
 from forms import LoginForm, UserAddForm, PreferencesForm
+from config import supported_countries
 
 os.environ['DATABASE_URL'] = "postgresql:///capstone_1_test"
 
 
-from app import app
-from helpers import CURR_USER_KEY, do_login
+from app import create_app
+
+app = create_app('testing')
+app.app_context().push()
+from helpers import CURR_USER_KEY, do_login, update_user_preferences
+from ingest import upsert_stories
+from services import get_profile_cache
+import metrics
+import services
+from cache import MemoryCache
+from catalog import SourcesCatalog
+from newsapi import NewsAPIClient
+from quota import MemoryQuota
+from fake_newsapi import FakeNewsAPI
 
 
 db.create_all()
 app.config['WTF_CSRF_ENABLED'] = False
 
+fake_newsapi = FakeNewsAPI().start()
+
+
+def use_fake_newsapi():
+    """Point the app's News API client at the fake, with an empty cache and catalog."""
+    fake_newsapi.latency = fake_newsapi.error_rate = 0
+    fake_newsapi.requests.clear()
+    services._services['news_quota'] = MemoryQuota(rate=1000, burst=1000, daily_limit=10**6)
+    services._services['news_client'] = NewsAPIClient('test', base_url=fake_newsapi.url,
+                                                      retries=0, cache=MemoryCache(),
+                                                      quota=services._services['news_quota'])
+    services._services['sources_catalog'] = SourcesCatalog(
+        path=os.path.join(tempfile.mkdtemp(), 'sources.json'))
+
 
 class UserRoutesTestCase(TestCase):
     """Tests user routes."""
     def setUp(self):
         self.client = app.test_client()
+        use_fake_newsapi()
+        get_profile_cache().clear()
         User.query.delete()
 
         self.testuser = User.signup(username="testuser",
@@ -126,7 +161,7 @@ class UserRoutesTestCase(TestCase):
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.testuser.id
             response = c.post('/user/first_prefs', data=form_data)
-            self.assertIn(b"ar", response.data)
+            self.assertIn(b"clarin", response.data)
             
 
     
@@ -140,7 +175,7 @@ class UserRoutesTestCase(TestCase):
             with c.session_transaction() as sess:
                 sess[CURR_USER_KEY] = self.testuser.id
             response = c.get('/user/pref')
-            self.assertIn(b"ar", response.data)
+            self.assertIn(b"la-nacion", response.data)
 
     
     def test_display_profile(self):
@@ -150,7 +185,312 @@ class UserRoutesTestCase(TestCase):
                   sess[CURR_USER_KEY] = self.testuser.id
              response = c.get('/display_profile')
              self.assertIn(b"testuser", response.data)
-                  
 
 
-            
+class UpdatePreferencesTestCase(TestCase):
+    """Tests saving preferences from /submit_prefs."""
+    def setUp(self):
+        self.client = app.test_client()
+        get_profile_cache().clear()
+        self.user = User.signup(username="testuser",
+                                email="test@test.com",
+                                password="testuser",
+                                image_url=None)
+        db.session.commit()
+        self.user_id = self.user.id
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count_statement)
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def count_statement(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def saved_preferences(self):
+        countries = {p.country for p in CountryPreferences.query.filter_by(user=self.user_id)}
+        outlets = {p.outlet for p in OutletPreferences.query.filter_by(user=self.user_id)}
+        return countries, outlets
+
+    def test_submit_prefs(self):
+        form_data = {'countries[]': ['us', 'ar'], 'outlets[]': ['cnn', 'clarin']}
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            response = c.post('/submit_prefs', data=form_data)
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.saved_preferences(), ({'us', 'ar'}, {'cnn', 'clarin'}))
+
+    def test_profile_cached_across_requests(self):
+        """Pages after the first don't query the db to learn who the user is"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            c.get('/display_profile')
+            del self.statements[:]
+            response = c.get('/display_profile')
+            self.assertIn(b"testuser", response.data)
+            self.assertEqual(self.statements, [])
+
+    def test_submit_prefs_invalidates_profile(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            c.get('/display_profile')
+            c.post('/submit_prefs', data={'countries[]': ['us'], 'outlets[]': ['cnn']})
+            c.get('/user/manage_prefs')
+            self.assertEqual(g.user.countries, ('us',))
+            self.assertEqual(g.user.outlets, ('cnn',))
+
+    def test_update_is_a_set_diff(self):
+        update_user_preferences(self.user_id, ['us', 'ar'], ['cnn', 'clarin'])
+        rows_before = {p.id for p in CountryPreferences.query.filter_by(user=self.user_id)}
+
+        update_user_preferences(self.user_id, ['us', 'gb'], ['cnn', 'bbc-news', 'bbc-news'])
+        self.assertEqual(self.saved_preferences(), ({'us', 'gb'}, {'cnn', 'bbc-news'}))
+        # the unchanged row was kept rather than deleted and re-inserted
+        us = CountryPreferences.query.filter_by(user=self.user_id, country='us').one()
+        self.assertIn(us.id, rows_before)
+
+    def test_update_statement_count(self):
+        """Saving costs a constant number of statements, however many values change"""
+        update_user_preferences(self.user_id, ['us', 'ar'], ['cnn', 'clarin'])
+        del self.statements[:]
+        update_user_preferences(self.user_id, ['us', 'ar'], ['cnn', 'clarin'])
+        self.assertEqual(len(self.statements), 2)
+
+        del self.statements[:]
+        countries = [code for name, code in supported_countries if code != 'ar']
+        update_user_preferences(self.user_id, countries, [f"outlet-{i}" for i in range(50)])
+        self.assertEqual(len(self.statements), 6)
+
+
+
+class FeedTestCase(TestCase):
+    """Tests the paginated home feed."""
+    def setUp(self):
+        self.client = app.test_client()
+        get_profile_cache().clear()
+        user = User(username="testuser", email="test@test.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        db.session.add(OutletPreferences(user=self.user_id, outlet='bbc-news'))
+        upsert_stories([{'source': {'id': 'bbc-news', 'name': 'BBC News'}, 'title': f"Story {i}",
+                         'url': f"http://bbc/{i}", 'publishedAt': f"2024-01-{i + 1:02d}T00:00:00Z"}
+                        for i in range(12)])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def test_home_renders_first_page(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            response = c.get('/user_home')
+            self.assertEqual(response.data.count(b'card-title">Story'), 10)
+            self.assertIn(b"Story 11", response.data)
+            self.assertNotIn(b"Story 1<", response.data)
+            self.assertIn(b'data-next-page="2"', response.data)
+
+    def test_feed_api_pages(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            page = c.get('/api/feed?page=2').json
+            self.assertEqual([a['title'] for a in page['articles']], ['Story 1', 'Story 0'])
+            self.assertIsNone(page['nextPage'])
+
+            page = c.get('/api/feed?page=1&page_size=5').json
+            self.assertEqual(len(page['articles']), 5)
+            self.assertEqual((page['page'], page['pageSize'], page['nextPage']), (1, 5, 2))
+
+    def test_home_is_streamed(self):
+        """The page streams, and flashed messages are still shown exactly once"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+                sess['_flashes'] = [('success', 'Hello, testuser!')]
+            response = c.get('/user_home')
+            self.assertTrue(response.is_streamed)
+            self.assertIn(b"Hello, testuser!", response.data)
+            self.assertIn(b"Story 11", response.data)
+            self.assertNotIn(b"Hello, testuser!", c.get('/user_home').data)
+
+    def test_feed_api_conditional_get(self):
+        """A repeat request with the ETag gets an empty 304"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            response = c.get('/api/feed?page=2')
+            etag = response.headers['ETag']
+            self.assertEqual(response.headers['Cache-Control'],
+                             'private, max-age=60, stale-while-revalidate=240')
+            self.assertIn('Cookie', response.headers['Vary'])
+
+            response = c.get('/api/feed?page=2', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.data, b'')
+
+            response = c.get('/api/feed?page=1', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_feed_api_slim_and_compressed(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            response = c.get('/api/feed', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertTrue(response.headers['ETag'].startswith('W/'))
+            page = json.loads(gzip.decompress(response.data))
+            self.assertEqual(set(page['articles'][0]), {'source', 'title', 'description', 'url',
+                                                        'urlToImage'})
+            self.assertEqual(page['articles'][0]['source'], {'name': 'BBC News'})
+
+            response = c.get('/api/feed', headers={'Accept-Encoding': 'gzip',
+                                                   'If-None-Match': response.headers['ETag']})
+            self.assertEqual(response.status_code, 304)
+
+
+class NewsAPIRoutesTestCase(TestCase):
+    """Tests the routes that go to the News API, against the fake."""
+    def setUp(self):
+        self.client = app.test_client()
+        use_fake_newsapi()
+        get_profile_cache().clear()
+        user = User(username="testuser", email="test@test.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        db.session.add(OutletPreferences(user=self.user_id, outlet='bbc-news'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def test_user_home_upstream_fallback(self):
+        """With nothing ingested, the feed comes from upstream once for every page"""
+        with self.client as c:
+            self.login(c)
+            response = c.get('/user_home')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"Bbc News", response.data)
+            page = c.get('/api/feed?page=2').json
+            self.assertEqual(len(page['articles']), 10)
+        self.assertEqual(fake_newsapi.requests, {'/v2/top-headlines': 1})
+
+    def test_interact_with_api(self):
+        with self.client as c:
+            self.login(c)
+            data = c.get('/interact_with_api?country=us&category=general').json
+            self.assertEqual(data['status'], 'ok')
+            self.assertEqual(len(data['articles']), 20)
+
+            data = c.get('/interact_with_api').json
+            self.assertEqual(data['code'], 'parametersMissing')
+
+    def test_first_prefs_per_country(self):
+        with self.client as c:
+            self.login(c)
+            data = c.post('/user/first_prefs', data={'countries[]': ['ar', 'gb']}).json
+            self.assertEqual([[s['id'] for s in body['sources']] for body in data],
+                             [['clarin', 'la-nacion'], ['bbc-news', 'bbc-sport', 'financial-times']])
+
+    def test_upstream_errors_render(self):
+        fake_newsapi.error_rate = 1
+        with self.client as c:
+            self.login(c)
+            response = c.get('/user_home')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(b"here's your preferred news", response.data)
+
+    def test_upstream_error_shows_older_stories(self):
+        """Stories ingested too long ago to be fresh still beat an empty feed"""
+        upsert_stories([{'source': {'id': 'bbc-news', 'name': 'BBC News'}, 'title': "Old story",
+                         'url': "http://bbc/old"}])
+        Story.query.update({Story.fetched_at: datetime(2000, 1, 1)})
+        db.session.commit()
+        fake_newsapi.error_rate = 1
+        with self.client as c:
+            self.login(c)
+            self.assertIn(b"Old story", c.get('/user_home').data)
+            self.assertEqual(fake_newsapi.requests, {'/v2/top-headlines': 1})
+
+
+class MetricsTestCase(TestCase):
+    """Tests request timing and the /metrics endpoint."""
+    def setUp(self):
+        self.client = app.test_client()
+        use_fake_newsapi()
+        get_profile_cache().clear()
+        metrics.REQUEST_SECONDS.clear()
+        metrics.PHASE_SECONDS.clear()
+        metrics.UPSTREAM_SECONDS.clear()
+        user = User(username="testuser", email="test@test.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        db.session.add(OutletPreferences(user=self.user_id, outlet='bbc-news'))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def get(self, url):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+            response = c.get(url)
+            response.get_data()
+            response.close()
+        return response
+
+    def test_phases_recorded_per_route(self):
+        """A streamed home page counts its db, upstream and render time once the body is sent"""
+        fake_newsapi.latency = 0.05
+        self.get('/user_home')
+
+        route = {'route': '/user_home'}
+        self.assertEqual(metrics.REQUEST_SECONDS.count(method='GET', status=200, **route), 1)
+        for phase in metrics.PHASES:
+            self.assertEqual(metrics.PHASE_SECONDS.count(phase=phase, **route), 1)
+        self.assertEqual(metrics.UPSTREAM_SECONDS.count(endpoint='/top-headlines', status=200), 1)
+
+        text = self.get('/metrics').get_data(as_text=True)
+        self.assertIn('courier_request_duration_seconds_count{route="/user_home",method="GET",'
+                      'status="200"} 1', text)
+        self.assertIn('courier_upstream_request_duration_seconds_count{endpoint="/top-headlines",'
+                      'status="200"} 1', text)
+        self.assertIn('courier_upstream_budget_used 1\n', text)
+        self.assertIn('courier_upstream_lookups_total{client="sync",outcome="called"}', text)
+        self.assertIn('courier_upstream_pool_connections{host="http://', text)
+        upstream = [line for line in text.splitlines() if line.startswith(
+            'courier_request_phase_seconds_sum{route="/user_home",phase="upstream"}')]
+        self.assertGreaterEqual(float(upstream[0].split()[-1]), 0.05)
+
+    def test_upstream_errors_by_status(self):
+        fake_newsapi.error_rate = 1
+        self.get('/interact_with_api?country=us&category=general')
+        self.assertEqual(metrics.UPSTREAM_SECONDS.count(endpoint='/top-headlines', status=500), 1)
+
+    def test_slow_requests_logged(self):
+        with patch('app.SLOW_REQUEST_SECONDS', 0):
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                self.get('/user_home')
+        self.assertIn('Slow request: GET /user_home 200', logs.output[0])
+        self.assertIn('upstream', logs.output[0])
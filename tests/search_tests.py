@@ -0,0 +1,107 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+os.environ['DATABASE_URL'] = "postgresql:///capstone_1_test"
+
+from app import create_app
+
+app = create_app('testing')
+app.app_context().push()
+from models import db, User, Story
+from helpers import CURR_USER_KEY
+from ingest import upsert_stories
+from migrations import upgrade
+from search import search_tsquery, search_stories
+
+db.create_all()
+
+
+def article(url, title, description=None, author=None, name='BBC News',
+            published='2024-01-01T00:00:00Z'):
+    return {'source': {'id': name.lower().replace(' ', '-'), 'name': name}, 'author': author,
+            'title': title, 'description': description, 'url': url, 'publishedAt': published}
+
+
+class SearchTest(TestCase):
+    """Tests full-text search over ingested stories."""
+
+    def setUp(self):
+        upsert_stories([
+            article('u1', 'Running shoes are selling fast', 'A market report', 'Jane Jones'),
+            article('u2', 'Markets rally on rate cut', 'Runners and traders cheer', name='CNN'),
+            article('u3', 'Weather turns cold', 'Snow expected',
+                    published='2024-02-01T00:00:00Z'),
+        ])
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+
+    def titles(self, query, page=1, page_size=10):
+        return [a['title'] for a in search_stories(query, page, page_size)['articles']]
+
+    def test_tsquery_keeps_only_words(self):
+        self.assertEqual(search_tsquery("Rate CUT"), 'rate & cut:*')
+        self.assertEqual(search_tsquery("'); drop table stories; --"),
+                         'drop & table & stories:*')
+        self.assertIsNone(search_tsquery(' !& '))
+
+    def test_stemming_and_prefix(self):
+        self.assertEqual(self.titles('run'), ['Running shoes are selling fast', 'Markets rally on rate cut'])
+        self.assertEqual(self.titles('running sho'), ['Running shoes are selling fast'])
+        self.assertEqual(self.titles('nothing like this'), [])
+        self.assertEqual(self.titles(''), [])
+
+    def test_title_ranks_above_description(self):
+        self.assertEqual(self.titles('market'), ['Markets rally on rate cut',
+                                                 'Running shoes are selling fast'])
+
+    def test_author_and_outlet_searchable(self):
+        self.assertEqual(self.titles('jones'), ['Running shoes are selling fast'])
+        self.assertEqual(self.titles('cnn'), ['Markets rally on rate cut'])
+
+    def test_pagination(self):
+        upsert_stories([article(f"p{i}", f"Budget talks {i}", published=f"2024-03-{i + 1:02d}")
+                        for i in range(5)])
+        first = search_stories('budget', 1, 2)
+        self.assertEqual([a['title'] for a in first['articles']], ['Budget talks 4', 'Budget talks 3'])
+        self.assertEqual(first['nextPage'], 2)
+        self.assertEqual(self.titles('budget', page=3, page_size=2), ['Budget talks 0'])
+        self.assertIsNone(search_stories('budget', 3, 2)['nextPage'])
+
+    def test_pages_stop_at_max_page(self):
+        upsert_stories([article(f"p{i}", f"Budget talks {i}", published=f"2024-03-{i + 1:02d}")
+                        for i in range(5)])
+        with patch('search.SEARCH_MAX_PAGE', 2):
+            self.assertIsNone(search_stories('budget', 2, 2)['nextPage'])
+            last = search_stories('budget', 3, 2)
+        self.assertEqual((last['articles'], last['page'], last['nextPage']), ([], 3, None))
+
+    def test_ranks_only_newest_matches(self):
+        # u1 ranks higher for 'run' but u2 is newer; a window of one keeps only u2
+        Story.query.filter_by(url='u2').update({'date': '2024-01-05T00:00:00Z'})
+        db.session.commit()
+        with patch('search.SEARCH_RANK_WINDOW', 1):
+            self.assertEqual(self.titles('run'), ['Markets rally on rate cut'])
+
+    def test_upgrade_backfills_old_stories(self):
+        Story.query.update({Story.search_vector: None})
+        db.session.commit()
+        self.assertEqual(self.titles('weather'), [])
+        upgrade()
+        self.assertEqual(self.titles('weather'), ['Weather turns cold'])
+
+    def test_search_route(self):
+        user = User(username="testuser", email="test@test.com", password="x")
+        db.session.add(user)
+        db.session.commit()
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user.id
+            data = c.get('/search?q=snow').json
+        self.assertEqual([a['title'] for a in data['articles']], ['Weather turns cold'])
+        self.assertEqual(data['articles'][0]['source'], {'name': 'BBC News'})
+        self.assertEqual(data['query'], 'snow')
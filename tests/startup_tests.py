@@ -0,0 +1,65 @@
+import json
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# `import app` + create_app() measured at ~0.6s here, almost all of it Flask
+# and SQLAlchemy. The budget leaves room for a slow CI box but catches an
+# eager import of the HTTP client, a cache or the database at startup.
+STARTUP_BUDGET = 1.5
+
+
+def run_clean(code, timeout=30):
+    """Run `code` in a fresh interpreter and return what it prints as JSON."""
+    env = {**os.environ, 'NEWSAPI_KEY': 'test', 'NEWSAPI_CACHE_BACKEND': 'memory'}
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise AssertionError(result.stderr)
+    return json.loads(result.stdout)
+
+
+class StartupTestCase(TestCase):
+    """Tests for how much work importing and building the app does."""
+
+    def test_create_app_is_fast_and_lazy(self):
+        result = run_clean("""
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+app = create_app('testing')
+elapsed = time.perf_counter() - start
+import services
+from models import db
+with app.app_context():
+    pool = db.engine.pool
+    connections = pool.checkedin() + pool.checkedout()
+print(json.dumps({'elapsed': elapsed, 'requests': 'requests' in sys.modules,
+                  'services': sorted(services._services), 'connections': connections}))
+""")
+        self.assertLess(result['elapsed'], STARTUP_BUDGET)
+        self.assertFalse(result['requests'])
+        self.assertEqual(result['services'], [])
+        self.assertEqual(result['connections'], 0)
+
+    def test_news_client_builds_in_clean_process(self):
+        """The client builds the cache it depends on without deadlocking."""
+        result = run_clean("""
+import json
+import services
+client = services.get_news_client()
+print(json.dumps({'same': client is services.get_news_client(),
+                  'cache': client.cache is services.get_news_cache()}))
+""", timeout=10)
+        self.assertEqual(result, {'same': True, 'cache': True})
+
+    def test_production_profile_does_not_echo(self):
+        result = run_clean("""
+import json
+from app import create_app
+print(json.dumps(create_app('production').config['SQLALCHEMY_ECHO']))
+""")
+        self.assertFalse(result)
@@ -0,0 +1,258 @@
+import io
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+os.environ['DATABASE_URL'] = "postgresql:///capstone_1_test"
+
+from PIL import Image
+
+from app import create_app
+
+app = create_app('testing')
+from helpers import thumbnail_url, slim_article, _signed_thumbnail_url
+from thumbnails import resize, ThumbnailCache, Thumbnailer
+
+IMAGE_URL = 'https://images.example.com/photo.jpg'
+HOSTS = {'images.example.com': '93.184.216.34', 'cdn.example.com': '93.184.216.35',
+         'internal.example.com': '10.0.0.5'}
+
+
+def fake_resolve(host, port):
+    return {HOSTS.get(host, host)}
+
+
+def image_bytes(width=2400, height=1600, fmt='JPEG'):
+    out = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 30, 30)).save(out, fmt)
+    return out.getvalue()
+
+
+class FakeResponse:
+    def __init__(self, status_code, body, content_type='image/jpeg', location=None):
+        self.status_code = status_code
+        self.body = body
+        self.headers = {'Content-Type': content_type, 'Content-Length': str(len(body))}
+        if location:
+            self.headers['Location'] = location
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.body), chunk_size):
+            yield self.body[i:i + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Answers GETs with `responses` in turn, repeating the last, and counts the calls."""
+
+    def __init__(self, *responses):
+        self.responses = responses
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        return self.responses[min(self.calls, len(self.responses)) - 1]
+
+
+class ResizeTest(TestCase):
+    """Tests making thumbnails out of image bytes."""
+
+    def test_shrinks_to_width_keeping_aspect(self):
+        with Image.open(io.BytesIO(resize(image_bytes(), 800, 'webp'))) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('WEBP', (800, 533)))
+        with Image.open(io.BytesIO(resize(image_bytes(), 800, 'jpeg'))) as thumb:
+            self.assertEqual((thumb.format, thumb.size), ('JPEG', (800, 533)))
+
+    def test_small_images_are_not_enlarged_and_tall_ones_are_cut(self):
+        with Image.open(io.BytesIO(resize(image_bytes(300, 200), 800, 'jpeg'))) as thumb:
+            self.assertEqual(thumb.size, (300, 200))
+        with Image.open(io.BytesIO(resize(image_bytes(400, 4000), 800, 'jpeg'))) as thumb:
+            self.assertEqual(thumb.size, (400, 1200))
+
+    def test_png_with_alpha(self):
+        out = io.BytesIO()
+        Image.new('RGBA', (1000, 500), (0, 0, 0, 0)).save(out, 'PNG')
+        with Image.open(io.BytesIO(resize(out.getvalue(), 800, 'webp'))) as thumb:
+            self.assertEqual(thumb.mode, 'RGBA')
+        with Image.open(io.BytesIO(resize(out.getvalue(), 800, 'jpeg'))) as thumb:
+            self.assertEqual(thumb.mode, 'RGB')
+
+    def test_refuses_too_many_pixels(self):
+        with patch('thumbnails.MAX_PIXELS', 1000):
+            with self.assertRaises(ValueError):
+                resize(image_bytes(), 800, 'jpeg')
+
+
+class ThumbnailCacheTest(TestCase):
+    """Tests the on-disk thumbnail LRU."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = ThumbnailCache(self.directory, max_bytes=250)
+
+    def test_same_bytes_are_stored_once(self):
+        first = self.cache.set('a', b'x' * 100)
+        second = self.cache.set('b', b'x' * 100)
+        self.assertEqual(first, second)
+        self.assertEqual(self.cache.get('a'), first)
+        self.assertEqual(self.cache.total_bytes(), 100)
+        with open(first[1], 'rb') as f:
+            self.assertEqual(f.read(), b'x' * 100)
+
+    def test_evicts_least_recently_used(self):
+        _, old_path = self.cache.set('a', b'a' * 100)
+        self.cache.set('b', b'b' * 100)
+        self.cache.get('a')
+        self.cache.set('c', b'c' * 100)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('c'))
+        self.assertLessEqual(self.cache.total_bytes(), 250)
+        self.assertTrue(os.path.exists(old_path))
+
+    def test_eviction_sums_sizes_once(self):
+        self.cache.max_bytes = 1000
+        for n in range(10):
+            self.cache.set(str(n), bytes([n]) * 100)
+        statements = []
+        self.cache._connect().set_trace_callback(statements.append)
+        self.cache.max_bytes = 250
+        self.cache.evict()
+        self.assertEqual(len(self.cache), 2)
+        self.assertIsNotNone(self.cache.get('9'))
+        self.assertEqual(sum('SUM(' in sql for sql in statements), 1)
+
+    def test_shared_by_instances(self):
+        self.cache.set('a', b'a' * 10)
+        self.assertIsNotNone(ThumbnailCache(self.directory).get('a'))
+
+
+class ThumbnailerTest(TestCase):
+    """Tests fetching and caching thumbnails."""
+
+    def setUp(self):
+        resolver = patch('thumbnails.resolve', side_effect=fake_resolve)
+        resolver.start()
+        self.addCleanup(resolver.stop)
+
+    def thumbnailer(self, *responses):
+        session = FakeSession(*responses)
+        return Thumbnailer(ThumbnailCache(tempfile.mkdtemp()), session), session
+
+    def test_fetches_each_image_once(self):
+        thumbnailer, session = self.thumbnailer(FakeResponse(200, image_bytes()))
+        digest, path, mimetype = thumbnailer.thumbnail(IMAGE_URL, 800, 'image/webp,*/*')
+        self.assertEqual(mimetype, 'image/webp')
+        self.assertEqual(thumbnailer.thumbnail(IMAGE_URL, 800, 'image/webp,*/*')[0], digest)
+        self.assertEqual(session.calls, 1)
+        self.assertEqual(thumbnailer.thumbnail(IMAGE_URL, 800, 'image/*')[2], 'image/jpeg')
+        self.assertEqual(session.calls, 2)
+
+    def test_failures_are_remembered(self):
+        for response in (FakeResponse(404, b''), FakeResponse(200, b'<html>', 'text/html'),
+                         FakeResponse(200, b'not an image')):
+            thumbnailer, session = self.thumbnailer(response)
+            self.assertIsNone(thumbnailer.thumbnail(IMAGE_URL, 800))
+            self.assertIsNone(thumbnailer.thumbnail(IMAGE_URL, 800))
+            self.assertEqual(session.calls, 1)
+
+    def test_too_big_is_not_read(self):
+        thumbnailer, _ = self.thumbnailer(FakeResponse(200, image_bytes()))
+        with patch('thumbnails.THUMBNAIL_MAX_SOURCE_BYTES', 100):
+            self.assertIsNone(thumbnailer.thumbnail(IMAGE_URL, 800))
+
+    def test_private_hosts_are_not_fetched(self):
+        thumbnailer, session = self.thumbnailer(FakeResponse(200, image_bytes()))
+        for url in ('http://127.0.0.1/a.jpg', 'http://[::1]/a.jpg', 'http://169.254.169.254/a',
+                    'http://[::ffff:10.0.0.1]/a.jpg', 'https://internal.example.com/a.jpg',
+                    'file:///etc/passwd', 'gopher://images.example.com/a'):
+            self.assertIsNone(thumbnailer.fetch(url))
+        self.assertEqual(session.calls, 0)
+
+    def test_redirects_are_checked(self):
+        thumbnailer, session = self.thumbnailer(
+            FakeResponse(302, b'', location='http://internal.example.com/a.jpg'))
+        self.assertIsNone(thumbnailer.fetch(IMAGE_URL))
+        self.assertEqual(session.calls, 1)
+
+        thumbnailer, session = self.thumbnailer(
+            FakeResponse(301, b'', location='//cdn.example.com/a.jpg'),
+            FakeResponse(200, image_bytes()))
+        self.assertEqual(thumbnailer.fetch(IMAGE_URL), image_bytes())
+        self.assertEqual(session.calls, 2)
+
+        thumbnailer, session = self.thumbnailer(FakeResponse(302, b'', location=IMAGE_URL))
+        self.assertIsNone(thumbnailer.fetch(IMAGE_URL))
+        self.assertEqual(session.calls, 4)
+
+
+class ImageProxyRouteTest(TestCase):
+    """Tests /img and the URLs the templates use for it."""
+
+    def setUp(self):
+        for patcher in (patch('thumbnails.resolve', side_effect=fake_resolve),
+                        patch('helpers.IMAGE_PROXY_SECRET', 'test-secret')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client = app.test_client()
+        self.thumbnailer = Thumbnailer(ThumbnailCache(tempfile.mkdtemp()),
+                                       FakeSession(FakeResponse(200, image_bytes())))
+
+    def test_thumbnail_urls(self):
+        url = thumbnail_url(IMAGE_URL)
+        self.assertTrue(url.startswith('/img?u=https'))
+        self.assertEqual(thumbnail_url(url), url)
+        self.assertIsNone(thumbnail_url(None))
+        self.assertEqual(slim_article({'urlToImage': IMAGE_URL})['urlToImage'], url)
+
+    def test_thumbnail_urls_signed_once_per_secret(self):
+        hits = _signed_thumbnail_url.cache_info().hits
+        url = thumbnail_url(IMAGE_URL)
+        self.assertEqual(thumbnail_url(IMAGE_URL), url)
+        self.assertGreater(_signed_thumbnail_url.cache_info().hits, hits)
+        with patch('helpers.IMAGE_PROXY_SECRET', 'another-secret'):
+            self.assertNotEqual(thumbnail_url(IMAGE_URL), url)
+
+    def test_serves_cacheable_thumbnail(self):
+        with patch('app.get_thumbnailer', return_value=self.thumbnailer):
+            response = self.client.get(thumbnail_url(IMAGE_URL),
+                                       headers={'Accept': 'image/avif,image/webp,*/*'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'image/webp')
+            self.assertIn('immutable', response.headers['Cache-Control'])
+            self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+            self.assertIn('Accept', response.headers['Vary'])
+            self.assertLess(len(response.data), len(image_bytes()))
+
+            again = self.client.get(thumbnail_url(IMAGE_URL),
+                                    headers={'Accept': 'image/webp',
+                                             'If-None-Match': response.headers['ETag']})
+            self.assertEqual(again.status_code, 304)
+
+    def test_rejects_unsigned_urls(self):
+        with patch('app.get_thumbnailer', return_value=self.thumbnailer):
+            response = self.client.get('/img', query_string={'u': IMAGE_URL, 'w': 800, 's': 'x'})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(self.thumbnailer.session.calls, 0)
+
+    def test_off_without_a_secret(self):
+        url = thumbnail_url(IMAGE_URL)
+        with patch('helpers.IMAGE_PROXY_SECRET', None), \
+                patch('app.get_thumbnailer', return_value=self.thumbnailer):
+            self.assertEqual(thumbnail_url(IMAGE_URL), IMAGE_URL)
+            self.assertEqual(self.client.get(url).status_code, 404)
+            self.assertEqual(self.thumbnailer.session.calls, 0)
+
+    def test_falls_back_to_original(self):
+        thumbnailer = Thumbnailer(ThumbnailCache(tempfile.mkdtemp()),
+                                  FakeSession(FakeResponse(403, b'')))
+        with patch('app.get_thumbnailer', return_value=thumbnailer):
+            response = self.client.get(thumbnail_url(IMAGE_URL))
+            self.assertEqual(response.status_code, 302)
+            self.assertEqual(response.headers['Location'], IMAGE_URL)
@@ -0,0 +1,265 @@
+"""Card-width thumbnails of article images, cached on disk.
+
+Publisher images are often several megabytes; the feeds show them about 800
+pixels wide. /img fetches each remote image once, shrinks it to
+THUMBNAIL_WIDTH in WebP (or JPEG for browsers without it) and keeps the
+result in a size-bounded LRU on disk. Files are named by the SHA-256 of
+their bytes, so a wire photo that several outlets link to is stored once,
+and the hash doubles as the ETag.
+"""
+import hashlib
+import io
+import ipaddress
+import os
+import socket
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+import requests
+from PIL import Image, ImageOps
+
+from cache import MemoryCache, sqlite_connector
+from config import (THUMBNAIL_CACHE_DIR, THUMBNAIL_CACHE_MAX_BYTES, THUMBNAIL_MAX_SOURCE_BYTES,
+                    THUMBNAIL_FETCH_TIMEOUT, THUMBNAIL_FAILURE_TTL)
+from metrics import observe_upstream
+from newsapi import SingleFlight
+
+FORMATS = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+QUALITY = {'webp': 75, 'jpeg': 80}
+# Tall images are cut off at three times their width rather than scaled down to it.
+MAX_ASPECT = 3
+CHUNK_SIZE = 64 * 1024
+# Decompression bombs are refused before Pillow decodes them.
+MAX_PIXELS = 40_000_000
+MAX_REDIRECTS = 3
+REDIRECTS = (301, 302, 303, 307, 308)
+
+
+def choose_format(accept):
+    """WebP if the Accept header lists it, otherwise JPEG."""
+    return 'webp' if 'image/webp' in (accept or '') else 'jpeg'
+
+
+def resolve(host, port):
+    """Every address `host` resolves to."""
+    return {info[4][0] for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)}
+
+
+def public_address(address):
+    """Whether `address` is a public one: not loopback, private, link-local or reserved."""
+    ip = ipaddress.ip_address(address.split('%')[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def allowed_url(url):
+    """Whether `url` is http(s) on a host that resolves only to public addresses."""
+    try:
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            return False
+        addresses = resolve(parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80))
+        return bool(addresses) and all(public_address(a) for a in addresses)
+    except (OSError, ValueError):
+        return False
+
+
+def peer_address(response):
+    """The address a streamed response is being read from, or None if it can't be seen."""
+    try:
+        # urllib3's response wraps http.client's, whose file keeps the socket
+        return response.raw._fp.fp.raw._sock.getpeername()[0]
+    except (AttributeError, OSError):
+        return None
+
+
+def resize(data, width, fmt):
+    """Return image bytes shrunk to at most `width` pixels wide, in `fmt`.
+
+    Raises if the bytes aren't an image Pillow can read, or would decode to
+    more than MAX_PIXELS pixels.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width * image.height > MAX_PIXELS:
+            raise ValueError(f"{image.width}x{image.height} image is too large")
+        # lets the JPEG decoder skip detail the thumbnail won't keep
+        image.draft('RGB', (width, width * MAX_ASPECT))
+        image = ImageOps.exif_transpose(image)
+        if image.width > width:
+            image.thumbnail((width, width * MAX_ASPECT), Image.LANCZOS)
+        if image.height > image.width * MAX_ASPECT:
+            image = image.crop((0, 0, image.width, image.width * MAX_ASPECT))
+        has_alpha = image.mode in ('RGBA', 'LA') or 'transparency' in image.info
+        image = image.convert('RGBA' if has_alpha and fmt == 'webp' else 'RGB')
+        out = io.BytesIO()
+        if fmt == 'webp':
+            image.save(out, 'WEBP', quality=QUALITY[fmt], method=4)
+        else:
+            image.save(out, 'JPEG', quality=QUALITY[fmt], optimize=True, progressive=True)
+        return out.getvalue()
+
+
+class ThumbnailCache:
+    """Thumbnails on disk, evicted least recently used past `max_bytes`.
+
+    An SQLite index in the same directory maps each key to the SHA-256 of
+    its thumbnail, which names the file. Every worker on a host can share the
+    directory.
+    """
+
+    def __init__(self, directory=THUMBNAIL_CACHE_DIR, max_bytes=THUMBNAIL_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._connect = sqlite_connector(os.path.join(directory, 'index.sqlite3'))
+        with self._connect() as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS thumbnails (
+                                key TEXT PRIMARY KEY,
+                                digest TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                accessed_at REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS thumbnails_accessed_at "
+                         "ON thumbnails (accessed_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS thumbnails_digest ON thumbnails (digest)")
+
+    def path(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def get(self, key):
+        """Return the (digest, path) stored for `key`, or None."""
+        conn = self._connect()
+        row = conn.execute("SELECT digest FROM thumbnails WHERE key = ?", (key,)).fetchone()
+        if row is None or not os.path.exists(self.path(row[0])):
+            self.misses += 1
+            return None
+        conn.execute("UPDATE thumbnails SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return row[0], self.path(row[0])
+
+    def set(self, key, data):
+        """Store a thumbnail for `key` and return its (digest, path)."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # readers never see a half-written file
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO thumbnails (key, digest, size, accessed_at) "
+                     "VALUES (?, ?, ?, ?)", (key, digest, len(data), time.time()))
+        self.evict()
+        return digest, path
+
+    def total_bytes(self):
+        return self._connect().execute(
+            "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM thumbnails)"
+        ).fetchone()[0]
+
+    def evict(self):
+        """Drop least recently used entries, and files no entry uses, until under max_bytes."""
+        conn = self._connect()
+        total = self.total_bytes()
+        while total > self.max_bytes:
+            oldest = conn.execute("SELECT key, digest, size FROM thumbnails "
+                                  "ORDER BY accessed_at LIMIT 64").fetchall()
+            if not oldest:
+                break
+            for key, digest, size in oldest:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM thumbnails WHERE key = ?", (key,))
+                if conn.execute("SELECT 1 FROM thumbnails WHERE digest = ?",
+                                (digest,)).fetchone() is None:
+                    total -= size
+                    try:
+                        os.remove(self.path(digest))
+                    except FileNotFoundError:
+                        pass
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM thumbnails").fetchone()[0]
+
+
+class Thumbnailer:
+    """Fetches remote images and makes cached thumbnails of them.
+
+    Concurrent requests for the same thumbnail share one fetch, and an image
+    that couldn't be fetched or read isn't tried again for
+    THUMBNAIL_FAILURE_TTL seconds.
+    """
+
+    def __init__(self, cache=None, session=None):
+        self.cache = cache if cache is not None else ThumbnailCache()
+        self.session = session if session is not None else requests.Session()
+        self.failures = MemoryCache(max_entries=10000)
+        self.single_flight = SingleFlight()
+
+    def thumbnail(self, url, width, accept=None):
+        """Return the (digest, path, mimetype) of the thumbnail, or None if there can't be one.
+
+        The format is the best one the `accept` header allows.
+        """
+        fmt = choose_format(accept)
+        key = f"{width}:{fmt}:{url}"
+        found = self.cache.get(key)
+        if found is None and not self.failures.get(key):
+            found = self.single_flight.do(key, lambda: self._make(key, url, width, fmt))
+        return None if found is None else (*found, FORMATS[fmt])
+
+    def _make(self, key, url, width, fmt):
+        found = self.cache.get(key)
+        if found is not None:
+            return found
+        data = self.fetch(url)
+        try:
+            thumbnail = resize(data, width, fmt) if data is not None else None
+        except Exception:
+            thumbnail = None
+        if thumbnail is None:
+            self.failures.set(key, True, THUMBNAIL_FAILURE_TTL)
+            return None
+        return self.cache.set(key, thumbnail)
+
+    def fetch(self, url):
+        """Return the image at `url`, or None if it can't be had, is too big or isn't public.
+
+        Redirects are followed by hand so every hop's host is checked, and
+        the address actually connected to is checked again before reading.
+        """
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                if not allowed_url(url):
+                    return None
+                with self.session.get(url, stream=True, timeout=THUMBNAIL_FETCH_TIMEOUT,
+                                      allow_redirects=False) as response:
+                    status = response.status_code
+                    if status in REDIRECTS and response.headers.get('Location'):
+                        url = urljoin(url, response.headers['Location'])
+                        continue
+                    peer = peer_address(response)
+                    if ((peer is not None and not public_address(peer))
+                            or response.status_code != 200
+                            or not response.headers.get('Content-Type', '').startswith('image/')
+                            or int(response.headers.get('Content-Length') or 0)
+                            > THUMBNAIL_MAX_SOURCE_BYTES):
+                        return None
+                    data = bytearray()
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        data += chunk
+                        if len(data) > THUMBNAIL_MAX_SOURCE_BYTES:
+                            return None
+                    return bytes(data)
+            return None
+        except (requests.RequestException, ValueError):
+            return None
+        finally:
+            observe_upstream('image', status, time.perf_counter() - start)